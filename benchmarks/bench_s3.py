@@ -0,0 +1,86 @@
+"""Benchmarks of `ToS3`, `FromS3` and `ListS3Objects`."""
+
+from bigrays import tasks
+from bigrays.run import BigRays
+
+from harness import benchmark, make_frame
+
+
+@benchmark
+def bench_to_s3(env, rows, columns):
+    df = make_frame(rows, columns)
+
+    class Upload(tasks.ToS3):
+        input = df
+        bucket = env.bucket
+        key = 'bench.csv'
+        overwrite_if_exists = True
+
+    return lambda: BigRays.run(Upload)
+
+
+@benchmark
+def bench_to_s3_chunked(env, rows, columns):
+    df = make_frame(rows, columns)
+
+    class Upload(tasks.ToS3):
+        # replaced by a fresh iterator of chunks on every run
+        input = None
+        bucket = env.bucket
+        key = 'bench.csv'
+        overwrite_if_exists = True
+
+        def run(self):
+            self.input = (df.iloc[i:i + 10000] for i in range(0, len(df), 10000))
+            return super().run()
+
+    return lambda: BigRays.run(Upload)
+
+
+def _put_csv(env, key, rows, columns):
+    body = make_frame(rows, columns).to_csv(index=False).encode()
+    env.s3.put_object(Bucket=env.bucket, Key=key, Body=body)
+
+
+@benchmark
+def bench_from_s3(env, rows, columns):
+    _put_csv(env, 'bench.csv', rows, columns)
+
+    class Download(tasks.FromS3):
+        bucket = env.bucket
+        key = 'bench.csv'
+
+    return lambda: BigRays.run(Download)
+
+
+@benchmark
+def bench_from_s3_csv(env, rows, columns):
+    _put_csv(env, 'bench.csv', rows, columns)
+
+    class Download(tasks.FromS3):
+        bucket = env.bucket
+        key = 'bench.csv'
+        read_as = 'csv'
+        chunksize = 10000
+
+    class Consume(tasks.Task):
+        input = Download.output
+
+        def run(self):
+            for chunk in self.input:
+                pass
+
+    return lambda: BigRays.run(Download, Consume)
+
+
+@benchmark(unit='items')
+def bench_list_s3_objects(env, objects, columns):
+    for i in range(objects):
+        env.s3.put_object(Bucket=env.bucket, Key='bench/%06d.csv' % i, Body=b'a\n1\n')
+
+    class List(tasks.ListS3Objects):
+        bucket = env.bucket
+        prefix = 'bench/'
+        include_metadata = True
+
+    return lambda: BigRays.run(List)
@@ -0,0 +1,103 @@
+"""Benchmarks of `SQLQuery` and `SQLWrite`."""
+
+import bigrays
+from bigrays import tasks
+from bigrays.mixins import WRITE_ENGINES
+from bigrays.run import BigRays
+
+from harness import benchmark, make_frame
+
+
+@benchmark
+def bench_sql_query(env, rows, columns):
+    env.create_table('bench', make_frame(rows, columns))
+
+    class Query(tasks.SQLQuery):
+        query = 'select * from bench'
+
+    def run():
+        BigRays.run(Query)
+        return Query.output
+    return run
+
+
+@benchmark
+def bench_sql_query_compact(env, rows, columns):
+    """`bench_sql_query` fetching through Arrow with categorized strings and
+    downcast integers.
+    """
+    env.create_table('bench', make_frame(rows, columns))
+
+    class Query(tasks.SQLQuery):
+        query = 'select * from bench'
+        fetch_engine = 'arrow'
+        categorize = 0.5
+        downcast = True
+
+    def run():
+        BigRays.run(Query)
+        return Query.output
+    return run
+
+
+@benchmark
+def bench_sql_query_chunked(env, rows, columns):
+    env.create_table('bench', make_frame(rows, columns))
+
+    class Query(tasks.SQLQuery):
+        query = 'select * from bench'
+        chunksize = 10000
+
+    class Consume(tasks.Task):
+        input = Query.output
+
+        def run(self):
+            for chunk in self.input:
+                pass
+
+    return lambda: BigRays.run(Query, Consume)
+
+
+@benchmark
+def bench_sql_query_partitioned(env, rows, columns):
+    df = make_frame(rows, columns)
+    df['id'] = range(rows)
+    env.create_table('bench', df)
+
+    class Query(tasks.SQLQuery):
+        query = 'select * from bench'
+        partition_column = 'id'
+        partitions = 4
+
+    return lambda: BigRays.run(Query)
+
+
+def _sql_write(write_engine):
+    def bench(env, rows, columns):
+        df = make_frame(rows, columns)
+
+        class Write(tasks.SQLWrite):
+            tablename = 'bench'
+            input = df
+            params = {'index': False, 'if_exists': 'replace'}
+
+        Write.write_engine = write_engine
+        return lambda: BigRays.run(Write)
+    bench.__name__ = 'bench_sql_write_' + write_engine
+    return benchmark(bench)
+
+
+for _write_engine in sorted(WRITE_ENGINES):
+    _sql_write(_write_engine)
+
+
+@benchmark(unit='items')
+def bench_sql_query_functional(env, calls, columns):
+    """`calls` calls of `bigrays.sql_query()` sharing a session."""
+    env.create_table('bench', make_frame(10, columns))
+
+    def run():
+        with bigrays.session(env.config):
+            for _ in range(calls):
+                bigrays.sql_query(query='select * from bench')
+    return run
@@ -0,0 +1,51 @@
+"""Benchmarks of `ToCSV` and of running many tasks with `BigRays.run()`."""
+
+import os
+import subprocess
+import sys
+
+from bigrays import tasks
+from bigrays.run import BigRays
+
+from harness import benchmark, make_frame
+
+
+@benchmark
+def bench_to_csv(env, rows, columns):
+    df = make_frame(rows, columns)
+
+    class Write(tasks.ToCSV):
+        input = df
+        filename = os.path.join(env.tmpdir, 'bench.csv')
+        overwrite_if_exists = True
+
+    return lambda: BigRays.run(Write)
+
+
+@benchmark(unit='items')
+def bench_run_tasks(env, n_tasks, columns):
+    """A chain of `n_tasks` tasks, each passing a small frame to the next,
+    measuring the per-task overhead of the runner.
+    """
+    df = make_frame(10, columns)
+
+    class Source(tasks.Task):
+        def run(self):
+            return df
+
+    chain = [Source]
+    for i in range(n_tasks - 1):
+        chain.append(type(tasks.Task)('Step%s' % i, (tasks.Task,), {
+            'input': chain[-1].output,
+            'run': lambda self: self.input,
+        }))
+    return lambda: BigRays.run(*chain)
+
+
+@benchmark(unit='items')
+def bench_import(env, imports, columns):
+    """`imports` imports of bigrays, each in a new interpreter."""
+    def run():
+        for _ in range(imports):
+            subprocess.check_call([sys.executable, '-c', 'import bigrays'])
+    return run
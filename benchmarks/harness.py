@@ -0,0 +1,205 @@
+"""Shared machinery of the benchmark suite, see `run.py`.
+
+A benchmark is a function registered with `@benchmark` taking an
+`Environment`, a size and a number of columns. It prepares its inputs and
+returns a callable performing the measured work. The size is a number of
+rows, or for benchmarks registered with `unit='items'` a number of tasks or
+S3 objects. The callable is timed `repeat` times (the fastest time is kept)
+and run once more with `tracemalloc` to record the peak memory allocated by
+Python while it ran. Memory allocated by extensions outside of Python's
+allocator (e.g. Arrow buffers) is not traced. If the callable returns a
+`DataFrame` its size in memory is recorded as well.
+"""
+
+import functools
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+import types
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+
+from bigrays.resources import SQLSession
+from bigrays.utils import is_dataframe, output_nbytes
+
+BENCHMARKS = {}
+
+
+def benchmark(func=None, unit='rows'):
+    """Register `func` under its name minus the "bench_" prefix. `unit` is
+    what the size passed to `func` counts, 'rows' or 'items'.
+    """
+    if func is None:
+        return functools.partial(benchmark, unit=unit)
+    func.unit = unit
+    BENCHMARKS[func.__name__[len('bench_'):]] = func
+    return func
+
+
+class Environment:
+    """Local stand-ins for the resources used by tasks.
+
+    - A SQLite database in a temporary directory, or the database at `url`.
+    - A moto-backed S3 bucket named `bucket`.
+
+    While the environment is entered `BigRays.run()` uses `config`, which
+    points `SQLSession` at the database and `S3Client` at moto, and tasks
+    are registered in a fresh task register.
+    """
+
+    bucket = 'bigrays-bench'
+
+    def __init__(self, url=None):
+        self._url = url
+        self._patches = []
+
+    def __enter__(self):
+        import boto3
+        import moto
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.url = self._url or 'sqlite:///' + os.path.join(self._tmpdir.name, 'bench.db')
+        self.engine = sa.create_engine(self.url)
+        self.config = types.SimpleNamespace(
+            ODBC_CONNECT_URL=self.url, AWS_ACCESS_KEY_ID='testing',
+            AWS_SECRET_ACCESS_KEY='testing', AWS_REGION='us-east-1',
+            **{name: 'bench' for name in SQLSession.required_configs})
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+        self._patches = [moto.mock_s3(),
+                         mock.patch('bigrays.run.BigRaysConfig', self.config),
+                         mock.patch('bigrays.tasks.TASK_REGISTER', [])]
+        for patch in self._patches:
+            patch.start()
+        self.s3 = boto3.client('s3', aws_access_key_id='testing',
+                               aws_secret_access_key='testing', region_name='us-east-1')
+        self.s3.create_bucket(Bucket=self.bucket)
+        self.tmpdir = self._tmpdir.name
+        return self
+
+    def __exit__(self, *exc):
+        for patch in reversed(self._patches):
+            patch.stop()
+        SQLSession.dispose_engines()
+        self.engine.dispose()
+        self._tmpdir.cleanup()
+
+    def create_table(self, name, df):
+        with self.engine.connect() as connection:
+            df.to_sql(name, connection, index=False, if_exists='replace')
+
+
+def make_frame(rows, columns):
+    """Return a `DataFrame` of `rows` rows alternating float, integer and
+    string columns.
+    """
+    random = np.random.RandomState(0)
+    data = {}
+    for i in range(columns):
+        if i % 3 == 0:
+            data['c%s' % i] = random.rand(rows)
+        elif i % 3 == 1:
+            data['c%s' % i] = random.randint(0, 1000000, rows)
+        else:
+            data['c%s' % i] = random.randint(0, 1000, rows).astype(str)
+    return pd.DataFrame(data)
+
+
+def measure(func, repeat):
+    """Return the fastest of `repeat` timings of `func`, and the peak memory
+    traced during and the return value of one more call.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        output = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(timings), peak, output
+
+
+def run_benchmarks(names, sizes, column_counts, repeat=3, url=None, log=print):
+    """Run each benchmark in `names` for every combination of size and
+    column count and return a list of result dicts.
+
+    Args:
+        sizes: Mapping of units ('rows' and 'items') to the sizes to run the
+            benchmarks of that unit with.
+    """
+    results = []
+    for name in names:
+        func = BENCHMARKS[name]
+        for columns in column_counts:
+            for size in sizes[func.unit]:
+                with Environment(url) as env:
+                    seconds, peak, output = measure(func(env, size, columns), repeat)
+                result = {
+                    'benchmark': name,
+                    'size': size,
+                    'unit': func.unit,
+                    'columns': columns,
+                    'seconds': seconds,
+                    'per_sec': size / seconds,
+                    'mib_per_sec': None,
+                    'peak_mib': peak / 1024 ** 2,
+                    'output_mib': None,
+                }
+                if is_dataframe(output):
+                    result['output_mib'] = output_nbytes(output) / 1024 ** 2
+                if func.unit == 'rows':
+                    n_bytes = output_nbytes(make_frame(size, columns))
+                    result['mib_per_sec'] = n_bytes / 1024 ** 2 / seconds
+                log(format_result(result))
+                results.append(result)
+    return results
+
+
+def format_result(result):
+    line = ('{benchmark:<26} {size:>9} {unit:<5} x {columns:<3} {seconds:>9.3f}s '
+            '{per_sec:>12,.0f} {unit}/s'.format(**result))
+    if result['mib_per_sec'] is not None:
+        line += ' {:>8.2f} MiB/s'.format(result['mib_per_sec'])
+    else:
+        line += ' ' * 15
+    line += ' {:>9.1f} MiB peak'.format(result['peak_mib'])
+    if result.get('output_mib') is not None:
+        line += ' {:>9.1f} MiB output'.format(result['output_mib'])
+    return line
+
+
+def compare(results, baseline, threshold):
+    """Return the results which are more than `threshold` (a fraction)
+    slower, or use more than `threshold` more peak memory, than the
+    matching result in `baseline`.
+    """
+    def key(result):
+        return result['benchmark'], result['size'], result['columns']
+    previous = {key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        slower = result['seconds'] > old['seconds'] * (1 + threshold)
+        larger = result['peak_mib'] > old['peak_mib'] * (1 + threshold)
+        if slower or larger:
+            regressions.append((old, result))
+    return regressions
+
+
+def save(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
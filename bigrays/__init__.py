@@ -1,32 +1,44 @@
 import logging
 
-from .functional_interface import (from_s3, list_s3_objects, sns_publish,
-                                   sns_publish_email, sns_task, sql_execute,
-                                   sql_query, sql_write, to_csv, to_s3, wrap_task)
-from .run import bigrays_run
-from .tasks import S3Task, SQLExecute, SQLQuery, SQLTask, SQLWrite, ToCSV, ToS3
+from .functional_interface import (from_s3, from_s3_map, list_s3_objects,
+                                   sns_publish, sns_publish_email, sns_task,
+                                   sql_execute, sql_query, sql_to_s3, sql_upsert,
+                                   sql_write, to_csv, to_s3, wrap_task)
+from .cache import OutputCache
+from .run import bigrays_resume, bigrays_run
+from .session import session
+from .tasks import (MapTask, S3Task, SQLExecute, SQLQuery, SQLTask, SQLToS3,
+                    SQLUpsert, SQLWrite, ToCSV, ToS3)
 
 # see https://docs.python.org/2/howto/logging.html#configuring-logging-for-a-library
 logging.getLogger('bigrays').addHandler(logging.NullHandler())
 
 
 __all__ = [
+    'MapTask',
+    'OutputCache',
     'S3Task',
     'SQLExecute',
     'SQLQuery',
     'SQLTask',
+    'SQLToS3',
+    'SQLUpsert',
     'SQLWrite',
     'ToCSV',
     'ToS3',
     'sql_execute',
     'sql_query',
     'sql_write',
+    'sql_upsert',
+    'sql_to_s3',
     'to_s3',
     'from_s3',
+    'from_s3_map',
     'list_s3_objects',
     'sns_task',
     'sns_publish',
     'sns_publish_email',
     'to_csv',
     'wrap_task',
+    'session',
 ]
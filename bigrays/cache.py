@@ -0,0 +1,318 @@
+"""Module implementing a content-addressed cache of task outputs.
+
+When `BigRays.run()` is given an `OutputCache` each cacheable task is
+looked up before it runs. On a hit the cached output is assigned to
+`Task.output` and the task (and the resource it requires) is skipped, on a
+miss the task runs and its output is stored.
+
+A task is cacheable if its `cache_fingerprint()` method returns a value
+(see `bigrays.tasks.BaseTask.cache_fingerprint()`). The cache key is a hash
+of
+
+1. the task class (module and qualified name),
+2. the fingerprint, e.g. the rendered query of `SQLQuery` after
+    `format_kws` have been applied,
+3. the configuration values required by the task's resource (e.g. the
+    ODBC connection parameters), and
+4. the task's `input`, if set.
+
+so that a task is re-run whenever any of these change. Note that the cache
+cannot know if the data behind a query or S3 key has changed, use `ttl` to
+bound how stale a cached output may be.
+
+Outputs are stored in a local directory, `DataFrame`s as Parquet (when
+`pyarrow` is installed), `io.BytesIO` streams as raw bytes and anything else
+as a pickle. Since loading a pickle can run arbitrary code the directory
+must be owned by the current user and not writable by anyone else.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import mmap
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+from . import exceptions as exc
+from .utils import ReprMixin, import_pandas, is_dataframe
+
+_logger = logging.getLogger(__name__)
+
+OUTPUT_FORMATS = ('.parquet', '.bin', '.pkl')
+
+
+class CacheStats(ReprMixin):
+    """Thread safe count of cache hits, misses and stored outputs."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.as_dict())
+
+    def record_hit(self):
+        self._increment('hits')
+
+    def record_miss(self):
+        self._increment('misses')
+
+    def record_store(self):
+        self._increment('stores')
+
+    def as_dict(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'stores': self.stores}
+
+    def _increment(self, stat):
+        with self._lock:
+            setattr(self, stat, getattr(self, stat) + 1)
+
+
+class OutputCache(ReprMixin):
+    """Cache of task outputs persisted to `directory`.
+
+    Args:
+        directory: Directory the outputs are stored in, created (readable by
+            the current user only) if it does not exist. Defaults to
+            "~/.cache/bigrays".
+        ttl: Number of seconds after which a cached output expires, by
+            default outputs never expire.
+        max_bytes: Maximum total size of the cached outputs. When exceeded
+            the least recently used outputs are evicted.
+    """
+
+    def __init__(self, directory=None, ttl=None, max_bytes=None):
+        if directory is None:
+            directory = os.path.join(os.path.expanduser('~'), '.cache', 'bigrays')
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        check_private(directory)
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.directory)
+
+    def key(self, task_instance, default_config):
+        """Return the cache key of `task_instance`, or `None` if it is not
+        cacheable.
+
+        Args:
+            task_instance: An instance of a `bigrays` task whose placeholders
+                have been set, i.e. one that is about to run.
+            default_config: The config used if the task does not set
+                `resource_config`.
+        """
+        fingerprint = task_instance.cache_fingerprint()
+        if fingerprint is None:
+            return None
+        task = type(task_instance)
+        config = getattr(task, 'resource_config', None) or default_config
+        resource = getattr(task, 'required_resource', None)
+        parts = {
+            'task': f'{task.__module__}.{task.__qualname__}',
+            'fingerprint': fingerprint,
+            'config': {name: getattr(config, name, None)
+                       for name in getattr(resource, 'required_configs', ())},
+        }
+        task_input = getattr(task_instance, 'input', None)
+        # avoid circular import
+        from .tasks import UNSET
+        if task_input is not UNSET:
+            parts['input'] = fingerprint_value(task_input)
+            if parts['input'] is None:
+                return None
+        serialized = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(serialized.encode()).hexdigest()
+
+    def get(self, key):
+        """Return a `(hit, output)` pair for `key`."""
+        with self._lock:
+            path = self._find(key)
+            if path is None:
+                self.stats.record_miss()
+                return False, None
+            stat = os.stat(path)
+            check_private(path, stat)
+            if self.ttl is not None and time.time() - stat.st_mtime > self.ttl:
+                _logger.info('cached output %s expired', key)
+                os.remove(path)
+                self.stats.record_miss()
+                return False, None
+            # the modification time records when the output was stored, the
+            # access time when it was last used (for LRU eviction)
+            os.utime(path, (time.time(), stat.st_mtime))
+        output = load_output(path)
+        self.stats.record_hit()
+        return True, output
+
+    def put(self, key, output):
+        """Store `output` under `key`. Outputs which cannot be stored (e.g.
+        iterators or open files) are ignored.
+        """
+        path = dump_output(output, os.path.join(self.directory, key))
+        if path is None:
+            return
+        with self._lock:
+            # remove the output of a previous run stored in another format
+            for ext in OUTPUT_FORMATS:
+                stale = os.path.join(self.directory, key + ext)
+                if stale != path and os.path.exists(stale):
+                    os.remove(stale)
+            self.stats.record_store()
+            if self.max_bytes is not None:
+                self._evict(self.max_bytes)
+
+    def clear(self):
+        """Remove all cached outputs."""
+        with self._lock:
+            for path, _ in self._entries():
+                os.remove(path)
+
+    def _find(self, key):
+        for ext in OUTPUT_FORMATS:
+            path = os.path.join(self.directory, key + ext)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if os.path.splitext(name)[1] in OUTPUT_FORMATS:
+                path = os.path.join(self.directory, name)
+                entries.append((path, os.stat(path)))
+        return entries
+
+    def _evict(self, max_bytes):
+        entries = sorted(self._entries(), key=lambda entry: entry[1].st_atime)
+        total = sum(stat.st_size for _, stat in entries)
+        for path, stat in entries:
+            if total <= max_bytes:
+                break
+            _logger.info('evicting cached output %s', os.path.basename(path))
+            os.remove(path)
+            total -= stat.st_size
+
+
+def check_private(path, stat=None):
+    """Raise a `ConfigurationError` unless `path` is owned by the current
+    user and not writable by its group or others. Ownership cannot be
+    checked on platforms without `os.getuid()` (e.g. Windows).
+    """
+    if not hasattr(os, 'getuid'):
+        return
+    stat = stat or os.stat(path)
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+        raise exc.ConfigurationError(
+            '%s must be owned by the current user and not writable by others' % path)
+
+
+def fingerprint_value(value):
+    """Return a hash of `value` for use in a cache key, or `None` if it
+    cannot be hashed (e.g. an iterator which would be consumed).
+    """
+    h = hashlib.sha256()
+    if is_dataframe(value):
+        h.update(repr(list(value.columns)).encode())
+        h.update(repr(list(value.dtypes.astype(str))).encode())
+        h.update(import_pandas().util.hash_pandas_object(value, index=True).values.tobytes())
+    elif isinstance(value, (bytes, bytearray)):
+        h.update(value)
+    elif isinstance(value, io.BytesIO):
+        h.update(value.getvalue())
+    elif isinstance(value, str):
+        h.update(value.encode())
+    else:
+        try:
+            h.update(json.dumps(value, sort_keys=True).encode())
+        except TypeError:
+            return None
+    return h.hexdigest()
+
+
+def dump_output(output, path):
+    """Write `output` to `path` plus the extension of the format chosen for
+    its type (one of `OUTPUT_FORMATS`). The file is replaced atomically.
+
+    Returns:
+        The path written to, or `None` if `output` cannot be stored (e.g. an
+        iterator, an open file or an object which cannot be pickled).
+    """
+    writer, ext = _writer(output)
+    if writer is None:
+        _logger.info('not storing output of type %s', type(output).__name__)
+        return None
+    directory = os.path.dirname(path) or '.'
+    try:
+        tmp_path = _write(writer, output, directory)
+    except Exception as err:
+        if writer is not _write_parquet:
+            _logger.warning('could not store output of type %s: %s', type(output).__name__, err)
+            return None
+        # e.g. non-string column names
+        _logger.info('could not store output as parquet, using pickle: %s', err)
+        ext = '.pkl'
+        tmp_path = _write(_write_pickle, output, directory)
+    os.replace(tmp_path, path + ext)
+    return path + ext
+
+
+def load_output(path):
+    """Load an output written by `dump_output()`."""
+    ext = os.path.splitext(path)[1]
+    if ext == '.parquet':
+        return import_pandas().read_parquet(path, engine='pyarrow')
+    with open(path, 'rb') as f:
+        if ext == '.bin':
+            return io.BytesIO(f.read())
+        return pickle.load(f)
+
+
+def _write(writer, output, directory):
+    # write to a temporary file first so that a partially written output
+    # is never read
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            writer(output, f)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+
+def _writer(output):
+    if is_dataframe(output):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return _write_pickle, '.pkl'
+        return _write_parquet, '.parquet'
+    if isinstance(output, io.BytesIO):
+        return _write_bytes, '.bin'
+    if isinstance(output, (io.IOBase, mmap.mmap)) or hasattr(output, '__next__'):
+        return None, None
+    return _write_pickle, '.pkl'
+
+
+def _write_parquet(df, f):
+    df.to_parquet(f, engine='pyarrow')
+
+
+def _write_bytes(stream, f):
+    f.write(stream.getvalue())
+
+
+def _write_pickle(output, f):
+    pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+
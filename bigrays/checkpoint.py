@@ -0,0 +1,159 @@
+"""Module implementing checkpoints, allowing a failed run to be resumed.
+
+When `BigRays.run()` is given a `checkpoint_dir` the output of every task is
+written to that directory as soon as the task succeeds, along with a status
+file recording which tasks succeeded or failed. `BigRays.resume()` restores
+the outputs of the tasks preceding the first failed (or unrun) task and
+runs the remaining tasks.
+
+Outputs are stored with `bigrays.cache.dump_output()`. A task whose output
+cannot be stored (e.g. an iterator of `DataFrame` chunks) is not recorded as
+succeeded, so a resumed run starts at that task at the latest. As with
+`bigrays.cache.OutputCache`, outputs may be pickles, so the directory and
+its files must be owned by the current user and not writable by others.
+"""
+
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+from . import watermarks
+from .cache import check_private, dump_output, load_output
+from .utils import ReprMixin
+
+_logger = logging.getLogger(__name__)
+
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class Checkpoint(ReprMixin):
+    """Task statuses and outputs persisted to `run_dir`.
+
+    Args:
+        run_dir: Directory the checkpoint is stored in, created (readable
+            by the current user only) if it does not exist. Any existing
+            checkpoint in the directory is loaded.
+
+    Raises:
+        `bigrays.exceptions.ConfigurationError`: If `run_dir` is not owned
+            by the current user or is writable by others.
+    """
+
+    status_file = 'status.json'
+
+    def __init__(self, run_dir):
+        os.makedirs(run_dir, mode=0o700, exist_ok=True)
+        check_private(run_dir)
+        self.run_dir = run_dir
+        self._lock = threading.Lock()
+        self._statuses = self._read_statuses()
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.run_dir)
+
+    @staticmethod
+    def task_id(task):
+        """Return the identifier of `task` in the checkpoint."""
+        return f'{task.__module__}.{task.__qualname__}'
+
+    def statuses(self):
+        """Return a mapping of task ids to their recorded status."""
+        with self._lock:
+            return {task_id: record['status'] for task_id, record in self._statuses.items()}
+
+    def record_success(self, task, output):
+        """Store `output` and record `task` as succeeded. Returns `False`
+        (recording nothing) if `output` could not be stored.
+        """
+        task_id = self.task_id(task)
+        filename = re.sub(r'[^\w.-]', '_', task_id)
+        path = dump_output(output, os.path.join(self.run_dir, filename))
+        if path is None:
+            _logger.warning('output of %s could not be checkpointed, it will be rerun on resume', task)
+            self._update(task_id, None)
+            return False
+        record = {'status': SUCCEEDED,
+                  'output': os.path.basename(path),
+                  'finished_at': time.time()}
+        watermark = watermarks.get_pending(task)
+        if watermark is not None:
+            record['watermark'] = watermarks.dump_value(watermark)
+        self._update(task_id, record)
+        return True
+
+    def record_failure(self, task):
+        self._update(self.task_id(task), {'status': FAILED, 'finished_at': time.time()})
+
+    def succeeded(self, task):
+        with self._lock:
+            record = self._statuses.get(self.task_id(task))
+        return record is not None and record['status'] == SUCCEEDED
+
+    def load(self, task):
+        """Return the stored output of `task`."""
+        with self._lock:
+            record = self._statuses[self.task_id(task)]
+        path = os.path.join(self.run_dir, os.path.basename(record['output']))
+        check_private(path)
+        return load_output(path)
+
+    def restore(self, tasks):
+        """Set the output of every task preceding the first task in `tasks`
+        which did not succeed, and return the tasks from that task on.
+
+        The watermarks the restored tasks reached (see `bigrays.watermarks`)
+        are set as pending again, to be committed at the end of the run.
+        """
+        tasks = list(tasks)
+        for i, task in enumerate(tasks):
+            if not self.succeeded(task):
+                break
+            _logger.info('restoring output of %s from checkpoint', task)
+            task.output = self.load(task)
+            with self._lock:
+                watermark = self._statuses[self.task_id(task)].get('watermark')
+            if watermark is not None:
+                watermarks.set_pending(task, watermarks.load_value(watermark))
+        else:
+            i = len(tasks)
+        _logger.info('resuming at task %s of %s', i + 1, len(tasks))
+        return tasks[i:]
+
+    def clear(self):
+        """Remove all statuses and outputs from the checkpoint."""
+        with self._lock:
+            for record in self._statuses.values():
+                if record.get('output') is not None:
+                    path = os.path.join(self.run_dir, record['output'])
+                    if os.path.exists(path):
+                        os.remove(path)
+            self._statuses = {}
+            self._write_statuses()
+
+    def _update(self, task_id, record):
+        with self._lock:
+            if record is None:
+                self._statuses.pop(task_id, None)
+            else:
+                self._statuses[task_id] = record
+            self._write_statuses()
+
+    def _read_statuses(self):
+        path = os.path.join(self.run_dir, self.status_file)
+        if not os.path.exists(path):
+            return {}
+        check_private(path)
+        with open(path) as f:
+            return json.load(f)
+
+    def _write_statuses(self):
+        # written atomically so that a crash never leaves a corrupt file
+        fd, tmp_path = tempfile.mkstemp(dir=self.run_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._statuses, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, os.path.join(self.run_dir, self.status_file))
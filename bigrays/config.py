@@ -1,8 +1,17 @@
+"""Module exposing `BigRaysConfig`, the configuration of bigrays read from
+`BIGRAYS_*` environment variables.
+
+environ-config (and attrs), which define `Config`, are imported and the
+environment is read when a configuration value is first accessed rather than
+when `bigrays` is imported, to keep start up fast.
+"""
+
 import logging
+import sys
+import threading
+import types
 import urllib.parse
 
-import environ
-
 
 _logger = logging.getLogger(__name__)
 
@@ -11,47 +20,153 @@ def _odbc_connect_params(s):
     return tuple(f'ODBC_{ss}' for ss in s.split(','))
 
 
-@environ.config(prefix='BIGRAYS')
-class Config:
-
-    # default all supported values to None
-    AWS_REQUIRE_SECRETS = environ.bool_var(
-        True,
-        help=('Are AWS credentials required?'
-              ' Set to False if using AWS roles or ~/.aws/credentials.'))
-    AWS_ACCESS_KEY_ID = environ.var(None)
-    AWS_SECRET_ACCESS_KEY = environ.var(None)
-    AWS_REGION = environ.var(None)
-
-    # we could do
-    #   @environ.config
-    #   class DB
-    # here, but from the user perspective it doesn't matter
-    # and not having a nested class makes requirement checking
-    # simpler in resources.py
-    ODBC_UID = environ.var(None, help='UID value for odbc_connect query parameter.')
-    ODBC_PWD = environ.var(None, help='PWD value for odbc_connect query parameter.')
-    ODBC_DSN = environ.var(None, help='DSN value for odbc_connect query parameter.')
-    ODBC_SERVER = environ.var(None, help='Server value for odbc_connect query parameter.')
-    ODBC_PORT = environ.var(None, help='Port value for odbc_connect query parameter.')
-    ODBC_DRIVER = environ.var(None, help='The ODBC connection driver, e.g. "{ODBC Driver 17 for SQL Server}"')
-    ODBC_FLAVOR = environ.var('mssql', help='The SQL flavor, or dialect.')
-
-    ODBC_CONNECT_PARAMS = environ.var('SERVER,PORT,DRIVER,UID,PWD', converter=_odbc_connect_params)
-    _connect_string = '{flavor}+pyodbc:///?odbc_connect={odbc_connect}'
+def _optional_int(s):
+    return None if s is None else int(s)
+
+
+def _comma_separated(s):
+    if s is None:
+        return ()
+    if isinstance(s, str):
+        return tuple(ss.strip() for ss in s.split(',') if ss.strip())
+    return tuple(s)
+
+
+_lock = threading.RLock()
+_config_class = None
+
+
+def _define_config():
+    """Return `Config`, defining it on the first call."""
+    global _config_class
+    with _lock:
+        if _config_class is None:
+            _config_class = _config_class_definition()
+        return _config_class
+
+
+def _config_class_definition():
+    import environ
+
+    @environ.config(prefix='BIGRAYS')
+    class Config:
+
+        # default all supported values to None
+        AWS_REQUIRE_SECRETS = environ.bool_var(
+            True,
+            help=('Are AWS credentials required?'
+                  ' Set to False if using AWS roles or ~/.aws/credentials.'))
+        AWS_ACCESS_KEY_ID = environ.var(None)
+        AWS_SECRET_ACCESS_KEY = environ.var(None)
+        AWS_REGION = environ.var(None)
+
+        # we could do
+        #   @environ.config
+        #   class DB
+        # here, but from the user perspective it doesn't matter
+        # and not having a nested class makes requirement checking
+        # simpler in resources.py
+        ODBC_UID = environ.var(None, help='UID value for odbc_connect query parameter.')
+        ODBC_PWD = environ.var(None, help='PWD value for odbc_connect query parameter.')
+        ODBC_DSN = environ.var(None, help='DSN value for odbc_connect query parameter.')
+        ODBC_SERVER = environ.var(None, help='Server value for odbc_connect query parameter.')
+        ODBC_PORT = environ.var(None, help='Port value for odbc_connect query parameter.')
+        ODBC_DRIVER = environ.var(None, help='The ODBC connection driver, e.g. "{ODBC Driver 17 for SQL Server}"')
+        ODBC_FLAVOR = environ.var('mssql', help='The SQL flavor, or dialect.')
+
+        TEMP_DIR = environ.var(
+            None, help='Directory for temporary files, defaults to the system temp directory.')
+
+        OUTPUT_MEMORY_LIMIT = environ.var(
+            None, converter=_optional_int,
+            help=('Size in bytes of task outputs kept in memory, larger outputs are '
+                  'spilled to disk. Unlimited by default.'))
+
+        WATERMARK_FILE = environ.var(
+            None, help=('JSON file storing the watermarks of incremental tasks, '
+                        'see bigrays.watermarks.'))
+
+        HOOKS = environ.var(
+            None, converter=_comma_separated,
+            help=('Comma separated "module:callable" references creating hooks '
+                  'registered for every run, see bigrays.hooks.'))
 
+        # S3 transfer settings, unset values default to those of
+        # boto3.s3.transfer.TransferConfig
+        S3_MULTIPART_THRESHOLD = environ.var(
+            None, converter=_optional_int,
+            help='Size in bytes above which S3 transfers are made in multiple parts.')
+        S3_MULTIPART_CHUNKSIZE = environ.var(
+            None, converter=_optional_int,
+            help='Size in bytes of each part of a multipart S3 transfer.')
+        S3_MAX_CONCURRENCY = environ.var(
+            None, converter=_optional_int,
+            help='Maximum number of threads transferring parts of an S3 object.')
+
+        ODBC_CONNECT_PARAMS = environ.var('SERVER,PORT,DRIVER,UID,PWD', converter=_odbc_connect_params)
+        _connect_string = '{flavor}+pyodbc:///?odbc_connect={odbc_connect}'
+
+        @property
+        def ODBC_CONNECT_URL(self):
+            odbc_connect = ';'.join(
+                '%s=%s' % (k.replace('ODBC_', ''), getattr(self, k))
+                for k in self.ODBC_CONNECT_PARAMS)
+            connect_url = self._connect_string.format(
+                flavor=self.ODBC_FLAVOR,
+                odbc_connect=urllib.parse.quote_plus(odbc_connect)
+            )
+            return connect_url
+
+    return Config
+
+
+class _LazyConfig:
+    """Proxy for the `Config` read from the environment when an attribute is
+    first accessed. Attributes are read from, assigned to and deleted from the
+    `Config` instance.
+    """
+    __slots__ = ('_config',)
+
+    def __init__(self):
+        object.__setattr__(self, '_config', None)
+
+    def _load(self):
+        config = object.__getattribute__(self, '_config')
+        if config is None:
+            with _lock:
+                config = object.__getattribute__(self, '_config')
+                if config is None:
+                    config = _define_config().from_environ()
+                    object.__setattr__(self, '_config', config)
+        return config
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        return repr(self._load())
+
+
+class _ConfigModule(types.ModuleType):
     @property
-    def ODBC_CONNECT_URL(self):
-        odbc_connect = ';'.join(
-            '%s=%s' % (k.replace('ODBC_', ''), getattr(self, k))
-            for k in self.ODBC_CONNECT_PARAMS)
-        connect_url = self._connect_string.format(
-            flavor=self.ODBC_FLAVOR,
-            odbc_connect=urllib.parse.quote_plus(odbc_connect)
-        )
-        return connect_url
-
-BigRaysConfig = Config.from_environ()
+    def Config(self):
+        """The environ-config class of `BigRaysConfig`."""
+        return _define_config()
+
+
+# exposes `Config` lazily, a module level __getattr__ requires Python 3.7
+sys.modules[__name__].__class__ = _ConfigModule
+
+BigRaysConfig = _LazyConfig()
 
 
 if __name__ == '__main__':
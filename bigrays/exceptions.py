@@ -1,3 +1,6 @@
+import traceback
+
+
 class BigRaysError(Exception):
     """Base Exception class for all bigrays custom exceptions to inherit from."""
 
@@ -16,3 +19,69 @@ class TaskError(BigRaysError):
 
 class TaskInterfaceError(TaskError):
     """Exception raised when a defined task fails to define the proper interface."""
+
+
+def _format_failure(i, n, name, err):
+    lines = ['', '+-- %s/%s: %s' % (i, n, name)]
+    formatted = traceback.format_exception(type(err), err, err.__traceback__)
+    lines.extend('| ' + line for line in ''.join(formatted).rstrip('\n').split('\n'))
+    return lines
+
+
+class MapError(TaskError):
+    """Exception raised when one or more items of a map task fail.
+
+    The message lists the traceback of the first `max_tracebacks` failures.
+
+    Attributes:
+        failures: List of `(item, exception)` pairs for each failed item.
+        results: List of results in the order of the task's input, failed
+            items hold their exception.
+    """
+    max_tracebacks = 10
+
+    def __init__(self, message, failures, results):
+        super().__init__(message)
+        self.message = message
+        self.failures = failures
+        self.results = results
+
+    def __str__(self):
+        lines = [self.message]
+        shown = self.failures[:self.max_tracebacks]
+        for i, (item, err) in enumerate(shown, 1):
+            lines.extend(_format_failure(i, len(self.failures), 'item %r' % (item,), err))
+        if len(self.failures) > len(shown):
+            lines.append('')
+            lines.append('... %s more failed items, see `failures`'
+                         % (len(self.failures) - len(shown)))
+        return '\n'.join(lines)
+
+
+class TaskErrors(BigRaysError):
+    """Exception raised at the end of a run in which one or more tasks failed,
+    grouping the exceptions raised by each failed task.
+
+    The message lists the traceback of every exception, so that all errors
+    are reported when this exception is printed, however many tasks failed.
+
+    Attributes:
+        failures: List of `(task, exception)` pairs in the order the tasks
+            failed.
+    """
+
+    def __init__(self, message, failures):
+        super().__init__(message)
+        self.message = message
+        self.failures = failures
+
+    @property
+    def exceptions(self):
+        """The exceptions raised by the failed tasks."""
+        return [err for _, err in self.failures]
+
+    def __str__(self):
+        lines = ['%s (%s failed)' % (self.message, len(self.failures))]
+        for i, (task, err) in enumerate(self.failures, 1):
+            lines.extend(_format_failure(i, len(self.failures), getattr(task, '__name__', task), err))
+        return '\n'.join(lines)
@@ -1,39 +1,60 @@
-import types
+"""Module exposing a function for each task class.
+
+Each function takes the attributes of the task class as keyword arguments
+and returns the task's output:
+
+    >>> df = sql_query(query='select * from my_table')
+
+Calls don't define task classes (which would be registered and kept in
+`TASK_REGISTER` forever) or go through `bigrays_run()`. The task is
+instantiated, the keyword arguments are set on the instance and its `run()`
+method is called directly, with the task's resource opened by the current
+`bigrays.session.Session` (see `bigrays.session()`). Hooks, metrics and
+retries therefore don't apply to these calls.
+"""
 
 from . import exceptions as exc
 from . import tasks
-from .run import bigrays_run
+from .session import run_task
 
 
 def wrap_task(fn_name, base_task):
     def wrapper(**kwargs):
-        sub_task = _create_subtask(fn_name, base_task, **kwargs)
-        bigrays_run(sub_task)
-        return sub_task.output
+        task = _create_task(fn_name, base_task, **kwargs)
+        return run_task(task)
+    wrapper.__name__ = wrapper.__qualname__ = fn_name
+    wrapper.__doc__ = base_task.__doc__
     return wrapper
 
 
-def _create_subtask(fn_name, base_task, **kwargs):
+def _create_task(fn_name, base_task, **kwargs):
+    """Return an instance of `base_task` with `kwargs` set as instance
+    attributes.
+    """
     try:
-        return types.new_class(name=fn_name, bases=(base_task,),
-                               exec_body=_exec_body(**kwargs))
+        tasks.Register._check_interface(fn_name, (base_task,), kwargs)
     except exc.TaskInterfaceError as err:
         raise ValueError(
             'All required attributes for the task {base_task} '
             'must be provided as keyword arguments') from err
-
-def _exec_body(**kwargs):
-    def exec_body(ns):
-        ns.update(kwargs)
-        return ns
-    return exec_body
+    task = base_task()
+    for name, value in kwargs.items():
+        # placeholders are resolved by the class when set as class
+        # attributes, which doesn't apply to instance attributes
+        if isinstance(value, tasks.Placeholder):
+            value = value.value
+        setattr(task, name, value)
+    return task
 
 
 sql_execute = wrap_task('sql_execute', tasks.SQLExecute)
 sql_query = wrap_task('sql_query', tasks.SQLQuery)
 sql_write = wrap_task('sql_write', tasks.SQLWrite)
+sql_upsert = wrap_task('sql_upsert', tasks.SQLUpsert)
+sql_to_s3 = wrap_task('sql_to_s3', tasks.SQLToS3)
 to_s3 = wrap_task('to_s3', tasks.ToS3)
 from_s3 = wrap_task('from_s3', tasks.FromS3)
+from_s3_map = wrap_task('from_s3_map', tasks.FromS3Map)
 list_s3_objects = wrap_task('list_s3_objects', tasks.ListS3Objects)
 sns_task = wrap_task('sns_task', tasks.SNSTask)
 sns_publish = wrap_task('sns_publish', tasks.SNSPublish)
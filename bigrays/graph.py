@@ -0,0 +1,227 @@
+"""Module for computing the dependencies between tasks.
+
+A task depends on another task if
+
+1. It references the other task's output, e.g. `input = OtherTask.output`
+    or `format_kws = {'date': OtherTask.output}`.
+2. It explicitly lists the other task in its `depends_on` attribute.
+3. It sets `run_with_exceptions = True`, in which case it depends on every
+    task preceding it in the task list. These tasks are typically used for
+    cleanup or notification and are expected to run last. They act as
+    barriers: a barrier directly depends on the previous barrier and the
+    tasks since it only, and on the tasks before that transitively.
+
+Note:
+    Dependencies that are only visible inside of a task's `run()` method
+    (e.g. `run()` reads `OtherTask.output` directly) cannot be detected and
+    must be declared with `depends_on`.
+"""
+
+import heapq
+
+from . import exceptions as exc
+
+
+class TaskGraph:
+    """Directed acyclic graph of tasks.
+
+    Args:
+        tasks: An ordered iterable of `bigrays` tasks. Dependencies on tasks
+            not in `tasks` are ignored, i.e. they are assumed to be satisfied.
+    """
+
+    def __init__(self, tasks):
+        self.tasks = list(tasks)
+        self.dependencies = {}
+        members = set(self.tasks)
+        # the last `run_with_exceptions` task and the tasks since
+        since_barrier = []
+        for task in self.tasks:
+            if getattr(task, 'run_with_exceptions', False) is True:
+                dependencies = set(since_barrier)
+                since_barrier = []
+            else:
+                dependencies = set(task_dependencies(task))
+            since_barrier.append(task)
+            dependencies.discard(task)
+            self.dependencies[task] = dependencies & members
+        self._dependants = {task: [] for task in self.tasks}
+        for task, deps in self.dependencies.items():
+            for dependency in deps:
+                self._dependants[dependency].append(task)
+        self._check_acyclic()
+
+    def __contains__(self, task):
+        return task in self.dependencies
+
+    def dependants(self, task):
+        """Return the tasks depending on `task`, in task list order."""
+        return list(self._dependants[task])
+
+    def resource_order(self):
+        """Return the tasks reordered so that tasks requiring the same
+        resource (and resource config) run consecutively, minimizing how
+        often a `ResourceManager` has to close and reopen resources.
+
+        Dependencies are never broken and tasks sharing a resource keep
+        their relative order. Tasks without a required resource (e.g.
+        custom tasks which may read outputs or update format keywords in
+        `run()`) are treated as barriers that no task is moved across.
+        """
+        # barriers are placed along a topological order rather than the task
+        # list, which may list a task before one of its dependencies, so that
+        # a barrier edge never reverses a dependency path
+        scheduler = TaskScheduler(self)
+        tasks = []
+        while scheduler.pending:
+            task = scheduler.pop_ready()
+            tasks.append(task)
+            scheduler.finished(task)
+        # as with `run_with_exceptions`, a barrier depends on the previous
+        # barrier and the tasks since it, and later tasks on the barrier
+        remaining = {task: len(deps) for task, deps in self.dependencies.items()}
+        barrier_dependants = {task: [] for task in tasks}
+        barrier, since_barrier = None, []
+        for task in tasks:
+            if resource_key(task)[0] is None:
+                preceding = since_barrier if barrier is None else [barrier] + since_barrier
+                barrier, since_barrier = task, []
+            else:
+                preceding = [] if barrier is None else [barrier]
+                since_barrier.append(task)
+            for dependency in preceding:
+                if dependency not in self.dependencies[task]:
+                    barrier_dependants[dependency].append(task)
+                    remaining[task] += 1
+        index = {task: i for i, task in enumerate(tasks)}
+        # indices of the ready tasks, and of the ready tasks by resource key,
+        # tasks handed out from one heap are skipped when popped from the other
+        ready, ready_by_key = [], {}
+
+        def push(task):
+            heapq.heappush(ready, index[task])
+            heapq.heappush(ready_by_key.setdefault(resource_key(task), []), index[task])
+
+        for task in tasks:
+            if not remaining[task]:
+                push(task)
+        order, done = [], [False] * len(tasks)
+        current = None
+        while ready:
+            same = ready_by_key.get(current)
+            while same and done[same[0]]:
+                heapq.heappop(same)
+            if same:
+                i = heapq.heappop(same)
+            else:
+                i = heapq.heappop(ready)
+                if done[i]:
+                    continue
+            done[i] = True
+            task = tasks[i]
+            current = resource_key(task)
+            order.append(task)
+            for dependant in self._dependants[task] + barrier_dependants[task]:
+                remaining[dependant] -= 1
+                if not remaining[dependant]:
+                    push(dependant)
+        if len(order) != len(tasks):
+            unplanned = [task for task in tasks if not done[index[task]]]
+            raise exc.TaskError('could not reorder tasks %s' % unplanned)
+        return order
+
+    def _check_acyclic(self):
+        # Kahn's algorithm, if any task is never freed of its dependencies
+        # then it is part of (or depends on) a cycle.
+        remaining = {task: len(deps) for task, deps in self.dependencies.items()}
+        ready = [task for task, n in remaining.items() if n == 0]
+        while ready:
+            task = ready.pop()
+            for dependant in self._dependants[task]:
+                remaining[dependant] -= 1
+                if remaining[dependant] == 0:
+                    ready.append(dependant)
+        cyclic = [task for task in self.tasks if remaining[task]]
+        if cyclic:
+            raise exc.TaskError('circular dependency detected between tasks %s' % cyclic)
+
+
+class TaskScheduler:
+    """Hand out the tasks of a `TaskGraph` once all of their dependencies
+    have finished, in task list order. Each call costs time proportional to
+    the tasks handed out or finished rather than to the size of the graph.
+
+    Args:
+        graph: A `TaskGraph`.
+    """
+
+    def __init__(self, graph):
+        self._graph = graph
+        self._index = {task: i for i, task in enumerate(graph.tasks)}
+        self._remaining = {task: len(deps) for task, deps in graph.dependencies.items()}
+        self._ready = [i for i, task in enumerate(graph.tasks) if not self._remaining[task]]
+        self._pending = len(graph.tasks)
+
+    @property
+    def pending(self):
+        """The number of tasks which have not been handed out."""
+        return self._pending
+
+    def pop_ready(self):
+        """Remove and return the next task whose dependencies have all
+        finished, or `None` if there is none.
+        """
+        if not self._ready:
+            return None
+        self._pending -= 1
+        return self._graph.tasks[heapq.heappop(self._ready)]
+
+    def finished(self, task):
+        """Record that `task` has finished (or was skipped)."""
+        for dependant in self._graph._dependants[task]:
+            self._remaining[dependant] -= 1
+            if not self._remaining[dependant]:
+                heapq.heappush(self._ready, self._index[dependant])
+
+
+def resource_key(task):
+    """Return the `(resource, config id)` pair `task` runs with. Configs are
+    compared by identity, as in `bigrays.resources.ResourceManager`.
+    """
+    return (getattr(task, 'required_resource', None),
+            id(getattr(task, 'resource_config', None)))
+
+
+def count_resource_opens(tasks):
+    """Return the number of times a `ResourceManager` opens a resource when
+    running `tasks` in order.
+    """
+    opens, current = 0, None
+    for task in tasks:
+        key = resource_key(task)
+        if key != current and key[0] is not None:
+            opens += 1
+        current = key
+    return opens
+
+
+def task_dependencies(task):
+    """Return the tasks that `task` depends on.
+
+    Only task classes are inspected, any other object (e.g. a mock) is
+    treated as having no dependencies.
+    """
+    # avoid circular import
+    from .tasks import Placeholder
+    if not isinstance(task, type):
+        return []
+    dependencies = list(task.depends_on or ())
+    # inspect the class namespaces rather than using getattr() since
+    # Placeholder is a descriptor and accessing it would return its value
+    # (or raise an error if it has not been set).
+    values = [val for klass in task.__mro__ for val in vars(klass).values()]
+    values.extend((task.format_kws or {}).values())
+    for val in values:
+        if isinstance(val, Placeholder) and val.task is not None:
+            dependencies.append(val.task)
+    return dependencies
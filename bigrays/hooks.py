@@ -0,0 +1,139 @@
+"""Module implementing hooks into the lifecycle of tasks and resources.
+
+A hook is an object implementing one or more of the methods of `Hook`, which
+are called when the corresponding event occurs during a run:
+
+- `before_task(task)`: Before `task` runs (or its output is served from
+    the output cache).
+- `after_task(task, seconds)`: After `task` succeeded.
+- `task_failed(task, error)`: After `task` raised `error`.
+- `retry(task, attempt, error)`: Before `task` is run again after raising
+    `error`, see `BaseTask.retries`. `attempt` counts from 2.
+- `resource_opened(resource, seconds)`: After `resource` was opened.
+- `resource_closed(resource)`: After `resource` was closed.
+- `chunk_processed(source, rows)`: After a chunk of `rows` rows was read
+    or written by a streaming operation, `source` is one of 'read_query',
+    'write', 'upload' or 'to_csv'.
+
+Hooks are registered for a run with `bigrays_run(..., hooks=[...])`, with
+`BigRays.hooks` or by setting `BIGRAYS_HOOKS` to a comma separated list of
+"module:callable" references which are called without arguments to create
+the hooks. Hooks may be called from several threads at once when tasks run
+concurrently. Exceptions raised by hooks are logged and otherwise ignored.
+
+Hooks are installed for the thread running `bigrays_run()` and the worker
+threads it (or a `MapTask`) starts, so runs in other threads don't receive
+each other's events.
+
+    >>> class Timer(Hook):
+    ...     def after_task(self, task, seconds):
+    ...         print(task.__name__, seconds)
+    >>> bigrays_run(hooks=[Timer()])
+
+Events are only dispatched to the methods a hook implements, and when no
+hook is registered emitting an event costs a single dictionary lookup.
+"""
+
+import contextlib
+import importlib
+import logging
+import threading
+
+_logger = logging.getLogger(__name__)
+
+EVENTS = ('before_task', 'after_task', 'task_failed', 'retry',
+          'resource_opened', 'resource_closed', 'chunk_processed')
+
+# the listeners of each thread, a mapping of event name -> tuple of
+# listeners replaced (never mutated) when hooks are installed so that it can
+# be shared with worker threads without a lock
+_local = threading.local()
+
+
+class Hook:
+    """Base class for hooks, all methods do nothing. See the module
+    documentation for the arguments of each event.
+    """
+
+    def before_task(self, task):
+        pass
+
+    def after_task(self, task, seconds):
+        pass
+
+    def task_failed(self, task, error):
+        pass
+
+    def retry(self, task, attempt, error):
+        pass
+
+    def resource_opened(self, resource, seconds):
+        pass
+
+    def resource_closed(self, resource):
+        pass
+
+    def chunk_processed(self, source, rows):
+        pass
+
+
+def current():
+    """Return the listeners of the hooks installed in this thread, a mapping
+    of event names to tuples of listeners.
+    """
+    return getattr(_local, 'listeners', {})
+
+
+def activate(listeners):
+    """Dispatch the events emitted in this thread to `listeners` (as returned
+    by `current()`), e.g. in a worker thread started by a task. Returns the
+    previously active listeners.
+    """
+    previous = current()
+    _local.listeners = listeners
+    return previous
+
+
+def emit(event, *args):
+    """Call the listeners of `event` installed in this thread with `args`."""
+    listeners = current().get(event)
+    if listeners:
+        for listener in listeners:
+            try:
+                listener(*args)
+            except Exception:
+                _logger.exception('hook %r failed on %s', listener, event)
+
+
+@contextlib.contextmanager
+def installed(hooks):
+    """Context manager registering `hooks` in this thread, in addition to
+    hooks already registered (e.g. by an enclosing run), until the context
+    exits.
+    """
+    previous = current()
+    listeners = {event: list(previous.get(event, ())) for event in EVENTS}
+    for hook in hooks:
+        for event in EVENTS:
+            method = getattr(hook, event, None)
+            # skip methods inherited from `Hook`, which do nothing
+            if method is None or getattr(type(hook), event, None) is getattr(Hook, event):
+                continue
+            listeners[event].append(method)
+    activate({event: tuple(methods) for event, methods in listeners.items() if methods})
+    try:
+        yield
+    finally:
+        activate(previous)
+
+
+def load(references):
+    """Return the hooks created by calling each "module:callable" reference
+    in `references`.
+    """
+    hooks = []
+    for reference in references:
+        module_name, _, name = reference.strip().partition(':')
+        factory = getattr(importlib.import_module(module_name), name)
+        hooks.append(factory())
+    return hooks
@@ -0,0 +1,122 @@
+"""Module for releasing task outputs once no task left to run needs them.
+
+Task outputs are otherwise kept (by `Register.output` and the placeholders
+referencing them) until the process exits, so a job with many large
+intermediate `DataFrame`s holds all of them in memory at once. The consumers
+of an output are the tasks depending on it through placeholders or
+`depends_on` (see `bigrays.graph.task_dependencies()`). Once every consumer
+of an output has finished the output is released.
+
+Releasing outputs is enabled with `bigrays_run(release_outputs=True)` (or
+`BigRays.release_outputs`). Outputs without consumers in the run, and
+outputs of tasks setting `keep_output = True`, are never released. Set
+`keep_output` on a task whose output is read after `bigrays_run()` returns,
+or on a task whose output is read inside another task's `run()` without
+being declared as a dependency.
+
+Sizes are measured shallowly, so the strings held by object columns are not
+counted, and spilled outputs count with their size on disk.
+"""
+
+import logging
+import threading
+
+from .graph import task_dependencies
+from .utils import ReprMixin, max_rss_bytes
+
+_logger = logging.getLogger(__name__)
+
+
+class MemoryStats(ReprMixin):
+    """Memory used by task outputs during a run.
+
+    Attributes:
+        peak_output_bytes: The largest total size of the outputs held at
+            the same time.
+        released_outputs: The number of outputs released.
+        released_bytes: The total size of the released outputs.
+        max_rss_bytes: The peak resident set size of the process (not just
+            the run), if available on this platform.
+    """
+
+    def __init__(self):
+        self.peak_output_bytes = 0
+        self.released_outputs = 0
+        self.released_bytes = 0
+        self.max_rss_bytes = None
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.as_dict())
+
+    def as_dict(self):
+        return {'peak_output_bytes': self.peak_output_bytes,
+                'released_outputs': self.released_outputs,
+                'released_bytes': self.released_bytes,
+                'max_rss_bytes': self.max_rss_bytes}
+
+
+class OutputLiveness:
+    """Track the consumers of each task's output and release the output
+    once they have all finished.
+
+    Args:
+        tasks: The tasks of the run.
+        restored: The tasks whose outputs were restored by
+            `BigRays.resume()`, in the order they ran. They are treated as
+            finished, so that their outputs are released once their
+            consumers among `tasks` have finished.
+    """
+
+    def __init__(self, tasks, restored=()):
+        tasks, restored = list(tasks), list(restored)
+        members = set(tasks) | set(restored)
+        self._consumers = {task: set() for task in members}
+        for task in restored + tasks:
+            for dependency in task_dependencies(task):
+                if dependency in members and dependency is not task:
+                    self._consumers[dependency].add(task)
+        self._sizes = {}
+        self._live_bytes = 0
+        self.stats = MemoryStats()
+        self._lock = threading.Lock()
+        for task in restored:
+            self.task_finished(task)
+
+    def task_finished(self, task):
+        """Record that `task` has produced its output, and release the
+        outputs which are no longer needed.
+        """
+        # a shallow size read from the output store, measuring the strings
+        # of a large DataFrame or loading a spilled output would cost more
+        # than the task itself
+        size = task.output_nbytes()
+        with self._lock:
+            self._sizes[task] = size
+            self._live_bytes += size
+            self.stats.peak_output_bytes = max(self.stats.peak_output_bytes,
+                                               self._live_bytes)
+            released = []
+            for dependency in task_dependencies(task):
+                consumers = self._consumers.get(dependency)
+                if not consumers or task not in consumers:
+                    continue
+                consumers.discard(task)
+                if not consumers and not getattr(dependency, 'keep_output', False):
+                    released.append(dependency)
+            for dependency in released:
+                self._release(dependency)
+
+    def finish(self):
+        """Return the run's `MemoryStats`."""
+        self.stats.max_rss_bytes = max_rss_bytes()
+        _logger.info('task output memory: %s', self.stats)
+        return self.stats
+
+    def _release(self, task):
+        _logger.debug('releasing output of %s', task)
+        task.release_output()
+        size = self._sizes.pop(task, 0)
+        self._live_bytes -= size
+        self.stats.released_outputs += 1
+        self.stats.released_bytes += size
+
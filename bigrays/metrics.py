@@ -0,0 +1,211 @@
+"""Module implementing per-task instrumentation.
+
+While a task runs `BigRays.run()` records its wall time and memory, and the
+library records the following counters for it by calling `record()`
+
+- resource_open_seconds: Time spent opening resources (see
+    `bigrays.resources.ResourceManager`).
+- rows_read: Rows returned by `SQLMixin.read_query()`.
+- rows_written: Rows written by `SQLMixin.write()`.
+- bytes_uploaded / bytes_downloaded: Bytes transferred by `S3Mixin`.
+
+Counters are attributed to the task running in the current thread (or, for
+`MapMixin` worker threads and chunk iterators, to the task which started
+them). Custom tasks can record their own counters with
+`bigrays.metrics.record(name, value)`, which does nothing when called
+outside of a run.
+
+At the end of the run the metrics are logged as a table and returned as
+`RunSummary.metrics`, a `RunMetrics` which can be serialized with
+`to_json()`.
+"""
+
+import contextlib
+import json
+import threading
+import time
+import tracemalloc
+
+from .utils import ReprMixin, max_rss_bytes
+
+COUNTERS = ('resource_open_seconds', 'rows_read', 'rows_written',
+            'bytes_uploaded', 'bytes_downloaded')
+
+_local = threading.local()
+
+
+def current():
+    """Return the `TaskMetrics` of the task running in this thread, or
+    `None`.
+    """
+    return getattr(_local, 'metrics', None)
+
+
+def activate(task_metrics):
+    """Attribute counters recorded in this thread to `task_metrics`, e.g. in
+    a worker thread started by a task. Returns the previously active
+    `TaskMetrics`.
+    """
+    previous = current()
+    _local.metrics = task_metrics
+    return previous
+
+
+def record(counter, value, task_metrics=None):
+    """Add `value` to `counter` of `task_metrics`, defaulting to those of the
+    task running in this thread. Does nothing if there are none.
+    """
+    task_metrics = current() if task_metrics is None else task_metrics
+    if task_metrics is not None:
+        task_metrics.add(counter, value)
+
+
+class TaskMetrics(ReprMixin):
+    """Metrics of a single task.
+
+    Attributes:
+        task: The name of the task.
+        status: 'succeeded', 'failed' or 'cached'.
+        wall_seconds: Wall time of the task, including opening resources.
+        max_rss_bytes: Peak resident set size of the process when the task
+            finished.
+        traced_memory_bytes: Net memory allocated by the task (e.g. its
+            output) according to `tracemalloc`, if memory tracing is enabled.
+        traced_peak_bytes: Peak memory traced while the task ran, if memory
+            tracing is enabled and the Python version supports resetting the
+            peak (3.9+).
+        counters: Mapping of counter names (see `COUNTERS`) to values.
+    """
+
+    def __init__(self, task):
+        self.task = task
+        self.status = None
+        self.wall_seconds = None
+        self.max_rss_bytes = None
+        self.traced_memory_bytes = None
+        self.traced_peak_bytes = None
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.as_dict())
+
+    def add(self, counter, value):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def as_dict(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return dict(task=self.task, status=self.status, wall_seconds=self.wall_seconds,
+                    max_rss_bytes=self.max_rss_bytes,
+                    traced_memory_bytes=self.traced_memory_bytes,
+                    traced_peak_bytes=self.traced_peak_bytes, **counters)
+
+
+class RunMetrics(ReprMixin):
+    """Metrics of all tasks run by a call to `BigRays.run()`, in the order
+    they started.
+
+    Args:
+        trace_memory: Measure the memory allocated by each task with
+            `tracemalloc`. Note that tracing memory slows down Python code
+            considerably.
+    """
+
+    _columns = (
+        ('task', 'task', '{}'),
+        ('status', 'status', '{}'),
+        ('wall_seconds', 'wall s', '{:.3f}'),
+        ('resource_open_seconds', 'open s', '{:.3f}'),
+        ('rows_read', 'rows read', '{:,}'),
+        ('rows_written', 'rows written', '{:,}'),
+        ('bytes_downloaded', 'MiB down', '{:.1f}'),
+        ('bytes_uploaded', 'MiB up', '{:.1f}'),
+        ('max_rss_bytes', 'max RSS MiB', '{:.1f}'),
+        ('traced_memory_bytes', 'traced MiB', '{:.1f}'),
+    )
+    _mebibytes = {'bytes_downloaded', 'bytes_uploaded', 'max_rss_bytes', 'traced_memory_bytes'}
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.tasks = []
+        self._lock = threading.Lock()
+        self._started_tracing = False
+
+    def __repr__(self):
+        return '%s(%s tasks)' % (self.__class__.__name__, len(self.tasks))
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextlib.contextmanager
+    def measure(self, task):
+        """Context manager measuring `task`, which runs in the current
+        thread. Yields the task's `TaskMetrics`.
+        """
+        task_metrics = TaskMetrics(getattr(task, '__name__', str(task)))
+        with self._lock:
+            self.tasks.append(task_metrics)
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+        previous = activate(task_metrics)
+        start = time.perf_counter()
+        try:
+            yield task_metrics
+        except Exception:
+            task_metrics.status = 'failed'
+            raise
+        else:
+            if task_metrics.status is None:
+                task_metrics.status = 'succeeded'
+        finally:
+            task_metrics.wall_seconds = time.perf_counter() - start
+            activate(previous)
+            task_metrics.max_rss_bytes = max_rss_bytes()
+            if tracing:
+                traced, peak = tracemalloc.get_traced_memory()
+                task_metrics.traced_memory_bytes = traced - traced_before
+                if hasattr(tracemalloc, 'reset_peak'):
+                    task_metrics.traced_peak_bytes = peak - traced_before
+
+    def as_dict(self):
+        return {'tasks': [task_metrics.as_dict() for task_metrics in self.tasks]}
+
+    def to_json(self, **kwargs):
+        """Return the metrics as a JSON string, `kwargs` are passed to
+        `json.dumps()`.
+        """
+        return json.dumps(self.as_dict(), **kwargs)
+
+    def table(self):
+        """Return the metrics as a plain text table."""
+        header = [title for _, title, _ in self._columns]
+        rows = [header]
+        for task_metrics in self.as_dict()['tasks']:
+            row = []
+            for name, _, fmt in self._columns:
+                value = task_metrics[name]
+                if value is None:
+                    row.append('-')
+                    continue
+                if name in self._mebibytes:
+                    value = value / 1024 ** 2
+                row.append(fmt.format(value))
+            rows.append(row)
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        lines = ['  '.join(cell.ljust(width) if i < 2 else cell.rjust(width)
+                           for i, (cell, width) in enumerate(zip(row, widths)))
+                 for row in rows]
+        lines.insert(1, '  '.join('-' * width for width in widths))
+        return '\n'.join(lines)
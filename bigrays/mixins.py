@@ -1,33 +1,556 @@
+import concurrent.futures
+import datetime
+import functools
+import gzip
 import io
+import itertools
 import json
 import logging
-
-import botocore
-import pandas as pd
+import tempfile
+import threading
+import time
+import uuid
 
 from . import exceptions as exc
-from .resources import S3Client, SNSClient, SQLSession
-from .utils import ReprMixin
+from . import hooks
+from . import metrics
+from . import watermarks
+from .config import BigRaysConfig
+from .resources import BaseResource, S3Client, SNSClient, SQLSession
+from .utils import (IterStream, ReprMixin, apply_dtypes, import_pandas,
+                    is_chunked, is_dataframe)
+
+
+# Write engines are passed to `DataFrame.to_sql()` as `method` and are called
+# with the signature (pandas_table, connection, keys, data_iter).
+
+# maximum number of bound parameters per statement
+_PARAMETER_LIMITS = {
+    'mssql': 2099,
+    'sqlite': 999,
+    'postgresql': 32767,
+    'mysql': 65535,
+}
+_DEFAULT_PARAMETER_LIMIT = 2099
+# maximum number of rows in a single VALUES clause
+_ROW_LIMITS = {
+    'mssql': 1000,
+}
+
+
+def _rows_per_statement(dialect, n_columns):
+    limit = _PARAMETER_LIMITS.get(dialect, _DEFAULT_PARAMETER_LIMIT)
+    rows = max(1, limit // max(1, n_columns))
+    return min(rows, _ROW_LIMITS.get(dialect, rows))
+
+
+def _insert_multi_values(pd_table, conn, keys, data_iter):
+    """Insert rows with multi-row `INSERT ... VALUES` statements, each sized
+    to stay within the dialect's limit on bound parameters.
+    """
+    rows_per_statement = _rows_per_statement(conn.dialect.name, len(keys))
+    insert = pd_table.table.insert()
+    if not conn.dialect.positional:
+        while True:
+            # rows are tuples in the order of the table's columns
+            rows = list(itertools.islice(data_iter, rows_per_statement))
+            if not rows:
+                break
+            conn.execute(insert.values(rows))
+        return
+    # For positional paramstyles the statement is built from the compiled
+    # single row insert, rather than compiling `insert.values(rows)` for
+    # every batch which is far slower than executing the statement itself.
+    compiled = insert.compile(dialect=conn.dialect)
+    positions = [keys.index(name) for name in compiled.positiontup]
+    head, values = str(compiled).rsplit(' VALUES ', 1)
+    statements = {}
+    cursor = conn.connection.cursor()
+    try:
+        while True:
+            rows = list(itertools.islice(data_iter, rows_per_statement))
+            if not rows:
+                break
+            if len(rows) not in statements:
+                statements[len(rows)] = '%s VALUES %s' % (head, ', '.join([values] * len(rows)))
+            params = [row[i] for row in rows for i in positions]
+            cursor.execute(statements[len(rows)], params)
+    finally:
+        cursor.close()
+
+
+def _insert_executemany(pd_table, conn, keys, data_iter):
+    """Insert rows with a single `executemany()` call on the DBAPI cursor,
+    enabling `fast_executemany` if the driver (pyodbc) supports it.
+    """
+    statement = pd_table.table.insert().compile(dialect=conn.dialect)
+    if conn.dialect.positional:
+        positions = [keys.index(name) for name in statement.positiontup]
+        rows = [tuple(row[i] for i in positions) for row in data_iter]
+    else:
+        rows = [dict(zip(keys, row)) for row in data_iter]
+    cursor = conn.connection.cursor()
+    try:
+        if hasattr(cursor, 'fast_executemany'):
+            cursor.fast_executemany = True
+        cursor.executemany(str(statement), rows)
+    finally:
+        cursor.close()
+
+
+def _insert_copy(pd_table, conn, keys, data_iter):
+    """Insert rows with PostgreSQL's `COPY ... FROM STDIN`."""
+    buffer = io.StringIO()
+    for row in data_iter:
+        buffer.write(','.join(_copy_field(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    preparer = conn.dialect.identifier_preparer
+    table = preparer.format_table(pd_table.table)
+    columns = ', '.join(preparer.quote(k) for k in keys)
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert("COPY %s (%s) FROM STDIN WITH CSV NULL '%s'"
+                           % (table, columns, _COPY_NULL), buffer)
+    finally:
+        cursor.close()
+
+
+# `COPY ... CSV` reads unquoted empty fields as NULL, so NULL is written as
+# an unquoted marker and every other value is quoted, which keeps empty
+# strings (and strings equal to the marker) from being read as NULL
+_COPY_NULL = r'\N'
+
+
+def _copy_field(value):
+    if value is None:
+        return _COPY_NULL
+    return '"%s"' % str(value).replace('"', '""')
+
+
+def _insert_bulk(pd_table, conn, keys, data_iter):
+    """Insert rows with the fastest bulk path available for the dialect."""
+    dialect = conn.dialect.name
+    if dialect == 'postgresql':
+        insert = _insert_copy
+    elif dialect == 'mssql':
+        insert = _insert_executemany
+    else:
+        insert = _insert_multi_values
+    insert(pd_table, conn, keys, data_iter)
+
+
+def _strip_query(query):
+    # the query is nested as a subquery, where a trailing ; is a syntax error
+    return query.strip().rstrip(';')
+
+
+def _range_boundaries(low, high, n_partitions):
+    """Return the inner boundaries splitting [`low`, `high`] into
+    `n_partitions` ranges of equal width.
+
+    Bounds returned by the database as strings (e.g. dates in SQLite) are
+    parsed as timestamps and the boundaries formatted back as strings.
+    """
+    as_string = isinstance(low, str)
+    if as_string:
+        pd = import_pandas()
+        low, high = pd.Timestamp(low), pd.Timestamp(high)
+    is_date = isinstance(low, datetime.date) and not isinstance(low, datetime.datetime)
+    if is_date:
+        low = datetime.datetime.combine(low, datetime.time())
+        high = datetime.datetime.combine(high, datetime.time())
+    boundaries = []
+    for i in range(1, n_partitions):
+        boundary = low + (high - low) * i / n_partitions
+        if isinstance(low, int):
+            boundary = int(boundary)
+        elif is_date:
+            boundary = datetime.datetime.combine(boundary.date(), datetime.time())
+        if boundary > low and (not boundaries or boundary > boundaries[-1]):
+            boundaries.append(boundary)
+    if is_date:
+        boundaries = [boundary.date() for boundary in boundaries]
+    if as_string:
+        boundaries = [str(boundary) for boundary in boundaries]
+    return boundaries
+
+
+FETCH_ENGINES = ('pandas', 'arrow')
 
+# rows fetched per Arrow batch when reading a whole result set
+_ARROW_BATCH_ROWS = 10000
 
-pd.set_option('precision', 15)
-# TODO: this should technically patched per call, a global patch
-#       alters the users pandas library and assumes they are using
-#       SQL Server.
-# Faster inserting for sql server
-def _execute_insert(self, conn, keys, data_iter):
-    data = [dict((k, v) for k, v in zip(keys, row)) for row in data_iter]
-    conn.execute(self.insert_statement().values(data))
-pd.io.sql.SQLTable._execute_insert = _execute_insert
+
+def _check_fetch_engine(fetch_engine):
+    if fetch_engine not in FETCH_ENGINES:
+        raise ValueError('unrecognized fetch engine %r, expected one of %s'
+                         % (fetch_engine, FETCH_ENGINES))
+
+
+def _check_dtype_plan(chunksize, dtype_plan):
+    # decided from the values of each chunk, so chunks of the same result
+    # set could get different dtypes, e.g. int8 and int64
+    if chunksize is not None and (dtype_plan.get('categorize') is not None
+                                  or dtype_plan.get('downcast')):
+        raise ValueError('`categorize` and `downcast` cannot be used with `chunksize`, '
+                         'convert columns with explicit `dtypes` instead')
+
+
+def _iter_frames(query, connection, chunksize, fetch_engine='pandas', dtype_plan=None):
+    """Yield the result set of `query` as `DataFrame`s of at most
+    `chunksize` rows, or as a single `DataFrame` if `chunksize` is `None`.
+
+    An empty result set yields a single empty `DataFrame` with the columns
+    of the result set, so that consumers of chunks create the same tables
+    and files as for an empty `DataFrame`.
+    """
+    if fetch_engine == 'arrow':
+        frames = (_arrow_to_pandas(table, dtype_plan)
+                  for table in _iter_arrow_tables(query, connection, chunksize))
+    elif chunksize is None:
+        frames = [import_pandas().read_sql(query, con=connection)]
+    else:
+        frames = _iter_pandas_chunks(query, connection, chunksize)
+    for df in frames:
+        yield apply_dtypes(df, **dtype_plan) if dtype_plan else df
+
+
+def _iter_pandas_chunks(query, connection, chunksize):
+    # as `pandas.read_sql(chunksize=...)`, which yields nothing for an empty
+    # result set
+    pd = import_pandas()
+    result = connection.execute(query)
+    try:
+        columns = list(result.keys())
+        empty = True
+        while True:
+            rows = result.fetchmany(chunksize)
+            if not rows:
+                break
+            empty = False
+            yield pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+        if empty:
+            yield pd.DataFrame.from_records([], columns=columns)
+    finally:
+        result.close()
+
+
+def _iter_arrow_tables(query, connection, chunksize):
+    """Yield the result set of `query` as `pyarrow.Table`s of at most
+    `chunksize` rows, or as a single table if `chunksize` is `None`.
+
+    Rows are fetched and converted to Arrow arrays in batches, so that at
+    most one batch of rows is held as Python objects at a time.
+    """
+    import pyarrow as pa
+    result = connection.execute(query)
+    try:
+        columns = list(result.keys())
+        batches = []
+        empty = True
+        while True:
+            rows = result.fetchmany(chunksize or _ARROW_BATCH_ROWS)
+            if not rows:
+                break
+            empty = False
+            arrays = [_arrow_array(values) for values in zip(*rows)]
+            del rows
+            if chunksize is not None:
+                yield pa.Table.from_arrays(arrays, columns)
+            else:
+                batches.append(arrays)
+        if chunksize is not None and empty:
+            yield pa.Table.from_arrays([pa.array([]) for _ in columns], columns)
+        elif chunksize is None:
+            chunks = zip(*batches) if batches else [[pa.array([])] for _ in columns]
+            yield pa.Table.from_arrays([_chunked_array(list(c)) for c in chunks], columns)
+    finally:
+        result.close()
+
+
+def _arrow_array(values):
+    """Return the column `values` as a `pyarrow.Array`. DECIMAL values are
+    converted to float64, as by the `coerce_float` option of the pandas
+    engine, rather than to object columns of `decimal.Decimal`.
+    """
+    import pyarrow as pa
+    array = pa.array(values)
+    if pa.types.is_decimal(array.type):
+        array = pa.array([None if v is None else float(v) for v in values], pa.float64())
+    return array
+
+
+def _chunked_array(arrays):
+    """Combine the arrays of a column fetched in separate batches, whose
+    inferred types differ if a batch is all NULL or mixes integers and
+    floats.
+    """
+    import pyarrow as pa
+    types = {array.type for array in arrays} - {pa.null()}
+    if len(types) > 1 and all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+        types = {pa.float64()}
+    if len(types) != 1:
+        return pa.chunked_array(arrays)
+    type_, = types
+    return pa.chunked_array([pa.nulls(len(array), type_) if array.type == pa.null()
+                             else array.cast(type_) for array in arrays], type_)
+
+
+def _arrow_to_pandas(table, dtype_plan=None):
+    """Convert `table` to a `DataFrame`, dictionary encoding the string
+    columns to be categorized by `dtype_plan` first so that they are
+    converted to categoricals directly.
+    """
+    import pyarrow as pa
+    dtype_plan = dtype_plan or {}
+    categorize = dtype_plan.get('categorize')
+    explicit = dtype_plan.get('dtypes') or {}
+    if categorize is not None and table.num_rows:
+        for i, name in enumerate(table.column_names):
+            column = table.column(i)
+            if (name not in explicit and pa.types.is_string(column.type)
+                    and len(column.unique()) <= categorize * table.num_rows):
+                column = pa.chunked_array([chunk.dictionary_encode() for chunk in column.chunks])
+                table = table.set_column(i, name, column)
+    return table.to_pandas()
+
+
+WRITE_ENGINES = {
+    # pandas' own row by row insert
+    'default': None,
+    'multi_values': _insert_multi_values,
+    'fast_executemany': _insert_executemany,
+    'bulk': _insert_bulk,
+}
+
+
+def _merge_statements(dialect, target, staging, columns, keys):
+    """Return the statements merging the rows of the table `staging` into
+    the table `target`, updating rows matching on the `keys` columns and
+    inserting the others. Names must be quoted.
+    """
+    values = [c for c in columns if c not in keys]
+    column_list = ', '.join(columns)
+
+    def matching(target_alias):
+        return ' AND '.join('{0}.{1} = s.{1}'.format(target_alias, k) for k in keys)
+
+    if dialect in ('mssql', 'oracle'):
+        # oracle doesn't accept AS before table aliases
+        alias = ' AS ' if dialect == 'mssql' else ' '
+        statement = 'MERGE INTO {target}{alias}t USING {staging}{alias}s ON ({on})'.format(
+            target=target, staging=staging, alias=alias, on=matching('t'))
+        if values:
+            statement += ' WHEN MATCHED THEN UPDATE SET {}'.format(
+                ', '.join('t.{0} = s.{0}'.format(c) for c in values))
+        statement += ' WHEN NOT MATCHED THEN INSERT ({}) VALUES ({})'.format(
+            column_list, ', '.join('s.' + c for c in columns))
+        # mssql requires MERGE to be terminated
+        return [statement + (';' if dialect == 'mssql' else '')]
+    insert = 'INSERT INTO {target} ({columns}) SELECT {columns} FROM {staging} s'.format(
+        target=target, columns=column_list, staging=staging)
+    if dialect in ('postgresql', 'sqlite'):
+        update = ('DO UPDATE SET ' + ', '.join('{0} = excluded.{0}'.format(c) for c in values)
+                  if values else 'DO NOTHING')
+        # sqlite requires a WHERE clause to parse ON CONFLICT after a SELECT
+        return ['{} WHERE true ON CONFLICT ({}) {}'.format(insert, ', '.join(keys), update)]
+    if dialect == 'mysql':
+        assignments = values or keys[:1]
+        return ['{} ON DUPLICATE KEY UPDATE {}'.format(
+            insert, ', '.join('{0} = VALUES({0})'.format(c) for c in assignments))]
+    # other dialects update the matching rows and insert the rest
+    match = 'SELECT 1 FROM {} s WHERE {}'.format(staging, matching(target))
+    statements = []
+    if values:
+        assignments = ', '.join('{0} = (SELECT s.{0} FROM {1} s WHERE {2})'.format(
+            c, staging, matching(target)) for c in values)
+        statements.append('UPDATE {} SET {} WHERE EXISTS ({})'.format(target, assignments, match))
+    statements.append('{} WHERE NOT EXISTS ({})'.format(
+        insert, 'SELECT 1 FROM {} t WHERE {}'.format(target, matching('t'))))
+    return statements
 
 
 class SQLMixin:
     _logger = logging.getLogger(__name__)
-    def read_query(self, query):
+    def read_query(self, query, chunksize=None, fetch_engine='pandas', **dtype_plan):
+        """Return the result set of `query` as a `DataFrame`, or if
+        `chunksize` is given as an iterator of `DataFrame`s with at most
+        `chunksize` rows each.
+
+        Args:
+            fetch_engine: How rows are converted to a `DataFrame`, one of
+
+                - 'pandas': `pandas.read_sql()`.
+                - 'arrow': Rows are fetched in batches, each converted to
+                    Arrow arrays, and converted to pandas once. Requires
+                    `pyarrow`. Uses far less memory than 'pandas' while
+                    reading, and with `categorize` string columns are
+                    converted to categoricals without creating a Python
+                    string per value.
+
+            **dtype_plan: `dtypes`, `categorize` and `downcast`, see
+                `bigrays.utils.apply_dtypes()`. Only `dtypes` can be given
+                with `chunksize`, it is applied to each chunk.
+
+        Raises:
+            ValueError: If `fetch_engine` is not recognized, or if
+                `categorize` or `downcast` is given with `chunksize`.
+
+        Note:
+            Chunks are fetched lazily, using a server side cursor where
+            supported, on a dedicated connection that is closed once the
+            iterator is exhausted. The query is therefore not executed until
+            the first chunk is requested, it does not see temporary tables
+            created on the task's connection, and it can only be iterated
+            once.
+        """
+        _check_fetch_engine(fetch_engine)
+        _check_dtype_plan(chunksize, dtype_plan)
         self._logger.debug('running query: %s', query)
         connection = SQLSession.resource()
-        df = pd.read_sql(query, con=connection)
+        if chunksize is not None:
+            # rows are attributed to this task although they are read while
+            # a downstream task consumes the chunks
+            return self._read_query_chunks(query, connection.engine, chunksize,
+                                           metrics.current(), fetch_engine, dtype_plan)
+        df, = _iter_frames(query, connection, None, fetch_engine, dtype_plan)
         self._logger.debug('%s records retrieved' % len(df))
+        metrics.record('rows_read', len(df))
+        return df
+
+    def _read_query_chunks(self, query, engine, chunksize, task_metrics=None,
+                           fetch_engine='pandas', dtype_plan=None):
+        connection = engine.connect().execution_options(stream_results=True)
+        try:
+            records = 0
+            for chunk in _iter_frames(query, connection, chunksize, fetch_engine, dtype_plan):
+                records += len(chunk)
+                metrics.record('rows_read', len(chunk), task_metrics)
+                hooks.emit('chunk_processed', 'read_query', len(chunk))
+                yield chunk
+            self._logger.debug('%s records retrieved' % records)
+        finally:
+            connection.close()
+
+    def partition_predicates(self, query, column, n_partitions):
+        """Return `n_partitions` predicates splitting the result set of
+        `query` into ranges of `column`, a numeric or date(time) column, of
+        equal width between its minimum and maximum.
+
+        The first range also includes rows where `column` is NULL, so that
+        together the predicates select every row exactly once. Fewer
+        predicates are returned if `column` has fewer distinct boundaries
+        (e.g. a narrow integer range).
+
+        Returns:
+            A list of (clause, parameters) pairs as taken by
+            `read_query_partitioned()`.
+        """
+        import sqlalchemy as sa
+        connection = SQLSession.resource()
+        bounds = sa.text('select min({col}), max({col}) from ({query}) bigrays_partition'.format(
+            col=column, query=_strip_query(query)))
+        low, high = connection.execute(bounds).fetchone()
+        if low is None:
+            # empty result set
+            return [('1 = 1', {})]
+        boundaries = _range_boundaries(low, high, n_partitions)
+        predicates = []
+        for i in range(len(boundaries) + 1):
+            clauses, params = [], {}
+            if i > 0:
+                clauses.append('{col} >= :low'.format(col=column))
+                params['low'] = boundaries[i - 1]
+            if i < len(boundaries):
+                clauses.append('{col} < :high'.format(col=column))
+                params['high'] = boundaries[i]
+            clause = ' and '.join(clauses) or '1 = 1'
+            if i == 0:
+                clause = '({clause}) or {col} is null'.format(clause=clause, col=column)
+            predicates.append((clause, params))
+        self._logger.debug('partitioned %s between %s and %s into %s ranges',
+                           column, low, high, len(predicates))
+        return predicates
+
+    def read_query_partitioned(self, query, predicates, max_connections=4, chunksize=None,
+                               fetch_engine='pandas', **dtype_plan):
+        """Return the result set of `query` restricted by each of
+        `predicates` in turn, reading up to `max_connections` partitions
+        concurrently.
+
+        Each partition is read on its own connection checked out from the
+        engine of the task's connection. Partitions are concatenated in the
+        order of `predicates`, the order of rows within a partition is the
+        order returned by the database.
+
+        Args:
+            predicates: SQL conditions on the columns of `query`'s result
+                set, either strings or (clause, parameters) pairs with
+                `:name` style parameters (see `partition_predicates()`).
+                They should select every row exactly once.
+            chunksize: If given, return an iterator of `DataFrame`s with at
+                most `chunksize` rows each instead of a single `DataFrame`.
+                Partitions are read ahead of the consumer, so at most
+                `max_connections` partitions are held in memory at once.
+            fetch_engine, **dtype_plan: See `read_query()`.
+        """
+        _check_fetch_engine(fetch_engine)
+        _check_dtype_plan(chunksize, dtype_plan)
+        predicates = [(p, {}) if isinstance(p, str) else p for p in predicates]
+        read_partition = functools.partial(
+            self._read_partition, query, engine=SQLSession.resource().engine,
+            task_metrics=metrics.current(), fetch_engine=fetch_engine, dtype_plan=dtype_plan)
+        if chunksize is not None:
+            return self._read_partition_chunks(read_partition, predicates, max_connections,
+                                               chunksize)
+        pd = import_pandas()
+        with concurrent.futures.ThreadPoolExecutor(max_connections) as executor:
+            frames = list(executor.map(read_partition, predicates))
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        if dtype_plan:
+            # categoricals with different categories are concatenated as objects
+            apply_dtypes(df, **dtype_plan)
+        self._logger.debug('%s records retrieved from %s partitions', len(df), len(frames))
+        return df
+
+    def _read_partition_chunks(self, read_partition, predicates, max_connections, chunksize):
+        executor = concurrent.futures.ThreadPoolExecutor(max_connections)
+        pending, futures = iter(predicates), []
+        try:
+            futures = [executor.submit(read_partition, predicate)
+                       for predicate in itertools.islice(pending, max_connections)]
+            empty, rows = None, 0
+            while futures:
+                df = futures.pop(0).result()
+                # keep `max_connections` partitions in flight
+                for predicate in itertools.islice(pending, 1):
+                    futures.append(executor.submit(read_partition, predicate))
+                if empty is None:
+                    empty = df.iloc[:0]
+                rows += len(df)
+                for start in range(0, len(df), chunksize):
+                    chunk = df.iloc[start:start + chunksize]
+                    hooks.emit('chunk_processed', 'read_query', len(chunk))
+                    yield chunk
+            if not rows and empty is not None:
+                # every partition was empty, see `_iter_frames()`
+                yield empty
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
+
+    def _read_partition(self, query, predicate, engine, task_metrics=None,
+                        fetch_engine='pandas', dtype_plan=None):
+        import sqlalchemy as sa
+        clause, params = predicate
+        statement = sa.text('select * from ({query}) bigrays_partition where {clause}'.format(
+            query=_strip_query(query), clause=clause)).bindparams(**params)
+        self._logger.debug('reading partition: %s %s', clause, params)
+        with engine.connect() as connection:
+            df, = _iter_frames(statement, connection, None, fetch_engine, dtype_plan)
+        metrics.record('rows_read', len(df), task_metrics)
         return df
 
     def execute(self, statement):
@@ -37,41 +560,233 @@ class SQLMixin:
         with connection.begin() as txn:
             connection.execute(statement)
 
-    def write(self, table, dataframe, **kwargs):
-        self._logger.debug('writing %s rows to to table %s', len(dataframe), table)
+    def write(self, table, dataframe, write_engine='multi_values', **kwargs):
+        """Write `dataframe`, or an iterator of `DataFrame` chunks, to
+        `table`.
+
+        Args:
+            write_engine: The name of the insert method used, one of
+
+                - 'multi_values': Multi-row `INSERT ... VALUES` statements
+                    sized to the dialect's bound parameter limit.
+                - 'fast_executemany': A single DBAPI `executemany()` call,
+                    with pyodbc's `fast_executemany` enabled.
+                - 'bulk': `COPY` for PostgreSQL, 'fast_executemany' for SQL
+                    Server and 'multi_values' otherwise.
+                - 'default': The pandas default.
+
+            **kwargs: Passed to `DataFrame.to_sql()`.
+
+        Raises:
+            ValueError: If `write_engine` is not recognized.
+        """
+        if write_engine not in WRITE_ENGINES:
+            raise ValueError('unrecognized write engine %r, expected one of %s'
+                             % (write_engine, sorted(WRITE_ENGINES)))
+        kwargs.setdefault('method', WRITE_ENGINES[write_engine])
         connection = SQLSession.resource()
+        if is_chunked(dataframe):
+            return self._write_chunks(table, dataframe, connection, **kwargs)
+        self._logger.debug('writing %s rows to to table %s', len(dataframe), table)
         dataframe.to_sql(name=table, con=connection, **kwargs)
+        metrics.record('rows_written', len(dataframe))
+
+    def _write_chunks(self, table, chunks, connection, if_exists='fail', **kwargs):
+        rows = 0
+        for chunk in chunks:
+            chunk.to_sql(name=table, con=connection, if_exists=if_exists, **kwargs)
+            # the first chunk creates/replaces the table (depending on
+            # `if_exists`), the rest append to it
+            if_exists = 'append'
+            rows += len(chunk)
+            metrics.record('rows_written', len(chunk))
+            hooks.emit('chunk_processed', 'write', len(chunk))
+        self._logger.debug('wrote %s rows to to table %s', rows, table)
+
+
+    def upsert(self, table, dataframe, keys, write_engine='multi_values', schema=None):
+        """Insert the rows of `dataframe`, or an iterator of `DataFrame`
+        chunks, into the existing table `table`, updating the rows of `table`
+        whose `keys` columns match a row of `dataframe` instead.
+
+        The rows are bulk loaded into a staging table with `write()` and
+        merged into `table` with a single set-based statement (`MERGE` for
+        SQL Server and Oracle, `INSERT ... ON CONFLICT` for PostgreSQL and
+        SQLite, `INSERT ... ON DUPLICATE KEY UPDATE` for MySQL, and an
+        `UPDATE` followed by an `INSERT` otherwise), all in one transaction.
+        The staging table is dropped afterwards, also if anything fails.
+
+        Args:
+            keys: The names of the columns identifying a row. Except with
+                `MERGE` they must be the columns of a primary key or unique
+                constraint of `table`. Each key should occur only once in
+                `dataframe`.
+            write_engine: The insert method used to load the staging table,
+                see `write()`.
+            schema: The schema of `table`, the staging table is created in
+                the same schema.
+
+        Returns:
+            A dict with the number of rows 'inserted' and 'updated', counted
+            before the rows are merged.
+        """
+        import sqlalchemy as sa
+        connection = SQLSession.resource()
+        preparer = connection.dialect.identifier_preparer
+        staging = '{}_staging_{}'.format(table, uuid.uuid4().hex[:8])
+
+        def qualified(name):
+            name = preparer.quote(name)
+            return name if schema is None else preparer.quote_schema(schema) + '.' + name
+
+        target, staged = qualified(table), qualified(staging)
+        counts = {'inserted': 0, 'updated': 0}
+        try:
+            with connection.begin():
+                self.write(staging, dataframe, write_engine=write_engine, index=False,
+                           schema=schema, if_exists='fail')
+                # no rows (and no chunks to create the table)
+                if not connection.dialect.has_table(connection, staging, schema=schema):
+                    return counts
+                columns = connection.execute(
+                    sa.text('SELECT * FROM {} WHERE 1 = 0'.format(staged))).keys()
+                quoted_keys = [preparer.quote(k) for k in keys]
+                total = connection.execute(
+                    sa.text('SELECT count(*) FROM {}'.format(staged))).scalar()
+                counts['updated'] = connection.execute(sa.text(
+                    'SELECT count(*) FROM {staged} s WHERE EXISTS '
+                    '(SELECT 1 FROM {target} t WHERE {on})'.format(
+                        staged=staged, target=target, on=' AND '.join(
+                            't.{0} = s.{0}'.format(k) for k in quoted_keys)))).scalar()
+                counts['inserted'] = total - counts['updated']
+                for statement in _merge_statements(
+                        connection.dialect.name, target, staged,
+                        [preparer.quote(c) for c in columns], quoted_keys):
+                    self._logger.debug('executing sql statement: %s', statement)
+                    connection.execute(sa.text(statement))
+                connection.execute(sa.text('DROP TABLE {}'.format(staged)))
+        except Exception:
+            # the rollback doesn't remove the staging table on databases where
+            # creating a table commits the transaction (e.g. MySQL, Oracle, and
+            # SQLite through pysqlite)
+            self._drop_staging_table(connection, staging, staged, schema)
+            raise
+        self._logger.info('upserted into %s: %s rows inserted, %s rows updated',
+                          table, counts['inserted'], counts['updated'])
+        metrics.record('rows_inserted', counts['inserted'])
+        metrics.record('rows_updated', counts['updated'])
+        return counts
+
+    def _drop_staging_table(self, connection, staging, staged, schema):
+        import sqlalchemy as sa
+        try:
+            if connection.dialect.has_table(connection, staging, schema=schema):
+                connection.execute(sa.text('DROP TABLE {}'.format(staged)))
+        except Exception:
+            self._logger.exception('could not drop staging table %s', staged)
 
 
 class S3Mixin:
     _logger = logging.getLogger(__name__)
 
+    # transfer settings, see `transfer_config()`
+    multipart_threshold = None
+    multipart_chunksize = None
+    max_concurrency = None
+
     def upload(self, obj, bucket, key):
         """High-level upload method that attempts to convert `obj` to a byte
         stream and upload to s3://`bucket`/`key`.
 
+        `obj` may be an iterator of `DataFrame` chunks in which case the
+        chunks are encoded and uploaded incrementally.
+
         Raises:
             ValueError: If `obj` cannot be converted.
         """
         stream = self._format_object(obj)
         self.upload_byte_stream(stream, bucket, key)
 
-    def list_objects(self, bucket, prefix, suffix):
+    def list_objects(self, bucket, prefix, suffix, modified_since=None,
+                     min_size=None, max_size=None, metadata=False, lazy=False):
+        """List the objects in `bucket`, paginating through all results.
+
+        Args:
+            prefix: Only list keys starting with `prefix` (if not `None`).
+            suffix: Only list keys ending with `suffix` (if not `None`).
+            modified_since: Only list objects last modified at or after this
+                `datetime`. Naive datetimes are assumed to be in UTC.
+            min_size: Only list objects of at least `min_size` bytes.
+            max_size: Only list objects of at most `max_size` bytes.
+            metadata: If `True` list a dict with the keys 'Key', 'Size',
+                'ETag' and 'LastModified' for each object instead of its key.
+            lazy: If `True` return an iterator fetching pages of results as
+                it is consumed instead of a list.
+        """
         client = S3Client.resource()
+        if modified_since is not None and modified_since.tzinfo is None:
+            modified_since = modified_since.replace(tzinfo=datetime.timezone.utc)
+        objects = self._iter_objects(client, bucket, prefix, suffix, modified_since,
+                                     min_size, max_size, metadata)
+        return objects if lazy else list(objects)
+
+    def _iter_objects(self, client, bucket, prefix, suffix, modified_since,
+                      min_size, max_size, metadata):
         params = {}
         if prefix is not None:
             params['Prefix'] = prefix
-        response = client.list_objects(Bucket=bucket, **params)
-        keys = [obj['Key'] for obj in response['Contents']]
-        if suffix is not None:
-            keys = [k for k in keys if k.endswith(suffix)]
-        return keys
+        paginator = client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, **params):
+            for obj in page.get('Contents', []):
+                if suffix is not None and not obj['Key'].endswith(suffix):
+                    continue
+                if modified_since is not None and obj['LastModified'] < modified_since:
+                    continue
+                if min_size is not None and obj['Size'] < min_size:
+                    continue
+                if max_size is not None and obj['Size'] > max_size:
+                    continue
+                if metadata:
+                    yield {k: obj[k] for k in ('Key', 'Size', 'ETag', 'LastModified')}
+                else:
+                    yield obj['Key']
 
     def download(self, bucket, key):
+        stream = io.BytesIO()
+        self._download_fileobj(bucket, key, stream)
+        stream.seek(0)
+        return stream
+
+    def download_to_file(self, bucket, key, filename=None):
+        """Download s3://`bucket`/`key` to disk rather than memory and return
+        the opened file, positioned at its start.
+
+        Args:
+            filename: The path to download to. If `None` the object is
+                downloaded to an anonymous temporary file (in
+                `BigRaysConfig.TEMP_DIR`) which is deleted once closed.
+        """
+        if filename is None:
+            file = tempfile.TemporaryFile(dir=BigRaysConfig.TEMP_DIR)
+        else:
+            file = open(filename, 'w+b')
+        try:
+            self._download_fileobj(bucket, key, file)
+        except Exception:
+            file.close()
+            raise
+        file.seek(0)
+        return file
+
+    def _download_fileobj(self, bucket, key, fileobj):
+        import botocore
         client = S3Client.resource()
+        progress = _TransferProgress()
+        start = time.perf_counter()
         try:
-            stream = io.BytesIO()
-            _ = client.download_fileobj(bucket, key, stream)
+            _ = client.download_fileobj(bucket, key, fileobj,
+                                        Config=self.transfer_config(),
+                                        Callback=progress)
         except botocore.exceptions.ClientError as err:
             if err.response['Error']['Code'] == "404":  # not found
                 raise Exception(
@@ -79,10 +794,11 @@ class S3Mixin:
                     % (bucket, key))
             else:
                 raise err
-        stream.seek(0)
-        return stream
+        _log_throughput('downloaded', progress.bytes, time.perf_counter() - start, bucket, key)
+        metrics.record('bytes_downloaded', progress.bytes)
 
     def delete_object(self, bucket, key):
+        import botocore
         client = S3Client.resource()
         try:
             client.delete_object(Bucket=bucket, Key=key)
@@ -99,13 +815,69 @@ class S3Mixin:
             ValueError: If `obj` cannot be converted.
         """
         client = S3Client.resource()
+        self._check_overwrite(bucket, key)
+        self._logger.debug('loading data to %s/%s', bucket, key)
+        progress = _TransferProgress()
+        start = time.perf_counter()
+        client.upload_fileobj(data, bucket, key,
+                              ExtraArgs={'ServerSideEncryption': 'AES256'},
+                              Config=self.transfer_config(),
+                              Callback=progress)
+        _log_throughput('uploaded', progress.bytes, time.perf_counter() - start, bucket, key)
+        metrics.record('bytes_uploaded', progress.bytes)
+
+    def transfer_config(self):
+        """Return the `boto3.s3.transfer.TransferConfig` used for uploads and
+        downloads.
+
+        Each of `multipart_threshold`, `multipart_chunksize` and
+        `max_concurrency` that is not set on the task falls back to the
+        corresponding `BigRaysConfig.S3_*` value, then to the boto3 default.
+        """
+        from boto3.s3.transfer import TransferConfig
+        kwargs = {}
+        for attr in ('multipart_threshold', 'multipart_chunksize', 'max_concurrency'):
+            value = getattr(self, attr)
+            if value is None:
+                value = getattr(BigRaysConfig, 'S3_' + attr.upper(), None)
+            if value is not None:
+                kwargs[attr] = value
+        return TransferConfig(**kwargs)
+
+    def upload_chunks(self, chunks, bucket, key, format='csv', part_size=None):
+        """Encode the `DataFrame`s in `chunks` as `format` and upload them to
+        s3://`bucket`/`key` with a multipart upload as they are encoded, so
+        that at most one chunk and one part are held in memory at a time.
+
+        Args:
+            chunks: An iterable of `DataFrame`s.
+            format: One of 'csv', 'csv.gz' or 'parquet'.
+            part_size: Size of each uploaded part in bytes, see
+                `MultipartUpload`. Defaults to the `multipart_chunksize` of
+                `transfer_config()`.
+
+        Raises:
+            ValueError: If `format` is not supported.
+        """
+        if format not in _CHUNK_WRITERS:
+            raise ValueError('unsupported format %r, expected one of %s'
+                             % (format, sorted(_CHUNK_WRITERS)))
+        self._check_overwrite(bucket, key)
+        if part_size is None:
+            part_size = self.transfer_config().multipart_chunksize
+        self._logger.debug('streaming %s data to %s/%s', format, bucket, key)
+        upload = MultipartUpload(S3Client.resource(), bucket, key, part_size)
+        start = time.perf_counter()
+        with upload:
+            _CHUNK_WRITERS[format](chunks, upload)
+        _log_throughput('uploaded', upload.tell(), time.perf_counter() - start, bucket, key)
+        metrics.record('bytes_uploaded', upload.tell())
+
+    def _check_overwrite(self, bucket, key):
         if not self.overwrite_if_exists:
             if self.object_exists(bucket, key):
                 raise exc.TaskError('the object %s exists in the bucket %s'
                                      % ( key, bucket))
-        self._logger.debug('loading data to %s/%s', bucket, key)
-        client.upload_fileobj(data, bucket, key,
-                              ExtraArgs={'ServerSideEncryption': 'AES256'})
 
     def object_exists(self, bucket, key):
         """Return `True` if object exists on S3, otherwise return False."""
@@ -131,8 +903,10 @@ class S3Mixin:
         Raises:
             ValueError: If `obj` cannot be converted.
         """
+        if is_chunked(obj):
+            return io.BufferedReader(IterStream(_iter_csv_bytes(obj)))
         stream = io.BytesIO()
-        if isinstance(obj, pd.DataFrame):
+        if is_dataframe(obj):
             stream.write(obj.to_csv(index=False).encode())
         elif isinstance(obj, str):
             stream.write(obj.encode())
@@ -144,6 +918,356 @@ class S3Mixin:
         return stream
 
 
+class _TransferProgress:
+    """Thread safe callback counting the bytes transferred by boto3."""
+
+    def __init__(self):
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, bytes_transferred):
+        with self._lock:
+            self.bytes += bytes_transferred
+
+
+def _log_throughput(action, n_bytes, seconds, bucket, key):
+    rate = n_bytes / seconds / 1024 ** 2 if seconds > 0 else float('inf')
+    S3Mixin._logger.info('%s %s/%s: %s bytes in %.3fs (%.2f MiB/s)',
+                         action, bucket, key, n_bytes, seconds, rate)
+
+
+def read_file(file, format, **kwargs):
+    """Return the `DataFrame` parsed from `file`.
+
+    Args:
+        file: An open binary file.
+        format: 'csv' or 'parquet'.
+        **kwargs: Passed to `pandas.read_csv()` or `pandas.read_parquet()`.
+
+    Raises:
+        ValueError: If `format` is not supported.
+    """
+    if format == 'csv':
+        return import_pandas().read_csv(file, **kwargs)
+    if format == 'parquet':
+        return import_pandas().read_parquet(file, **kwargs)
+    raise ValueError("unsupported format %r, expected 'csv' or 'parquet'" % format)
+
+
+def read_file_chunks(file, format, chunksize, **kwargs):
+    """Return an iterator of `DataFrame`s with at most `chunksize` rows each
+    parsed from `file`, which is closed once the iterator is exhausted.
+
+    Args:
+        file: An open binary file.
+        format: 'csv' or 'parquet'.
+        **kwargs: Passed to `pandas.read_csv()` or
+            `pyarrow.parquet.ParquetFile.iter_batches()`.
+
+    Raises:
+        ValueError: If `format` is not supported.
+    """
+    if format not in ('csv', 'parquet'):
+        file.close()
+        raise ValueError("unsupported format %r, expected 'csv' or 'parquet'" % format)
+    return _iter_file_chunks(file, format, chunksize, **kwargs)
+
+
+def _iter_file_chunks(file, format, chunksize, **kwargs):
+    try:
+        if format == 'csv':
+            for chunk in import_pandas().read_csv(file, chunksize=chunksize, **kwargs):
+                yield chunk
+        else:
+            import pyarrow.parquet as pq
+            for batch in pq.ParquetFile(file).iter_batches(batch_size=chunksize, **kwargs):
+                yield batch.to_pandas()
+    finally:
+        file.close()
+
+
+def _iter_csv_bytes(chunks):
+    """Yield each `DataFrame` in `chunks` encoded as CSV, with the header
+    included in the first chunk only.
+    """
+    for i, chunk in enumerate(chunks):
+        yield chunk.to_csv(index=False, header=(i == 0)).encode()
+        hooks.emit('chunk_processed', 'upload', len(chunk))
+
+
+def _write_csv(chunks, fileobj):
+    for data in _iter_csv_bytes(chunks):
+        fileobj.write(data)
+
+
+def _write_csv_gz(chunks, fileobj):
+    with gzip.GzipFile(fileobj=fileobj, mode='wb') as gzip_file:
+        _write_csv(chunks, gzip_file)
+
+
+def _write_parquet(chunks, fileobj):
+    """Write each chunk as a row group of a single parquet file. The schema
+    is inferred from the first chunk.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer = None
+    try:
+        for chunk in chunks:
+            schema = None if writer is None else writer.schema
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(fileobj, table.schema)
+            writer.write_table(table)
+            hooks.emit('chunk_processed', 'upload', len(chunk))
+        if writer is None:
+            # a valid parquet file rather than an empty object
+            pq.write_table(pa.Table.from_arrays([], []), fileobj)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+_CHUNK_WRITERS = {
+    'csv': _write_csv,
+    'csv.gz': _write_csv_gz,
+    'parquet': _write_parquet,
+}
+
+
+class MultipartUpload:
+    """Writable file-like object uploading the data written to it to
+    s3://`bucket`/`key` in parts of (at least) `part_size` bytes.
+
+    `MultipartUpload` must be used as a context manager. The upload is
+    completed when the context exits, or aborted if an exception occurred.
+    If less than `part_size` bytes are written the object is uploaded with a
+    single `put_object` request instead.
+
+    Note:
+        S3 requires every part but the last to be at least 5 MiB.
+    """
+    _logger = logging.getLogger(__name__)
+
+    default_part_size = 8 * 1024 ** 2
+    extra_args = {'ServerSideEncryption': 'AES256'}
+
+    def __init__(self, client, bucket, key, part_size=None):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = self.default_part_size if part_size is None else part_size
+        self.closed = False
+        self._buffer = bytearray()
+        self._position = 0
+        self._parts = []
+        self._upload_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.complete()
+        else:
+            self.abort()
+        return False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        if len(self._buffer) >= self.part_size:
+            self._upload_part()
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        # writers such as `gzip.GzipFile` may close the file they write to,
+        # the upload itself is finished when the context exits
+        pass
+
+    def complete(self):
+        """Upload any buffered data and complete the upload."""
+        if self._upload_id is None:
+            self.client.put_object(Bucket=self.bucket, Key=self.key,
+                                   Body=bytes(self._buffer), **self.extra_args)
+        else:
+            if self._buffer:
+                self._upload_part()
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                MultipartUpload={'Parts': self._parts})
+        self._buffer = bytearray()
+        self.closed = True
+
+    def abort(self):
+        """Abort the upload, discarding any uploaded parts."""
+        if self._upload_id is not None:
+            self._logger.warning('aborting upload to %s/%s', self.bucket, self.key)
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+        self._buffer = bytearray()
+        self.closed = True
+
+    def _upload_part(self):
+        if self._upload_id is None:
+            response = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, **self.extra_args)
+            self._upload_id = response['UploadId']
+        part_number = len(self._parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+            PartNumber=part_number, Body=bytes(self._buffer))
+        self._parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self._buffer = bytearray()
+
+
+class MapMixin:
+    """Mixin running `run_item()` for every item of an iterable concurrently.
+
+    Resources opened for the task are shared with the worker threads, so
+    `run_item()` should only use resources which are thread safe (e.g. the
+    boto3 client of `S3Client`).
+    """
+    _logger = logging.getLogger(__name__)
+
+    max_workers = 8
+    allow_failures = False
+
+    def map(self, items):
+        """Return the results of `run_item()` for each of `items`, in order,
+        running at most `max_workers` items at a time.
+
+        A failing item does not stop the remaining items from running.
+
+        Raises:
+            `bigrays.exceptions.MapError`: If any item failed and
+                `allow_failures` is `False`. Otherwise failures are logged
+                and the failed items' results are the exceptions raised.
+        """
+        register_resources = BaseResource.share_opened_resources()
+        task_metrics = metrics.current()
+        listeners = hooks.current()
+
+        def run_item(item):
+            register_resources()
+            metrics.activate(task_metrics)
+            hooks.activate(listeners)
+            return self.run_item(item)
+
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+            futures = [(item, executor.submit(run_item, item)) for item in items]
+            results, failures = [], []
+            for item, future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as err:
+                    self._logger.warning('item %r failed: %s', item, err)
+                    failures.append((item, err))
+                    results.append(err)
+        self._logger.debug('%s of %s items succeeded', len(results) - len(failures), len(results))
+        if failures and not self.allow_failures:
+            # the items are listed in full in `failures`
+            failed = ', '.join(repr(item) for item, _ in failures[:exc.MapError.max_tracebacks])
+            if len(failures) > exc.MapError.max_tracebacks:
+                failed += ', ...'
+            raise exc.MapError('%s of %s items failed: [%s]' % (len(failures), len(results), failed),
+                               failures, results)
+        return results
+
+    def run_item(self, item):
+        raise NotImplementedError
+
+
+class WatermarkMixin:
+    """Mixin keeping the highest value of `watermark_column` a task has
+    output, its watermark, in `watermark_store` (see `bigrays.watermarks`).
+
+    `track_watermark()` records the watermark reached as pending. It is
+    committed once the run finishes, and only if the task and every task
+    depending on it succeeded, so a failed run is read again by the next run.
+    With an iterator of chunks the watermark is recorded once the iterator
+    is exhausted.
+    """
+    watermark_column = None
+    # the watermark before the first run
+    initial_watermark = None
+    # defaults to `bigrays.watermarks.default_store()`
+    watermark_store = None
+    # defaults to the qualified name of the task
+    watermark_name = None
+    # the bound parameter the watermark is passed to the query as
+    watermark_param = 'bigrays_watermark'
+
+    def current_watermark(self):
+        """Return the watermark stored by the previous run, or
+        `initial_watermark`.
+
+        Raises:
+            ValueError: If there is no watermark and no `initial_watermark`.
+        """
+        task = type(self)
+        value = watermarks.store_of(task).get(watermarks.name_of(task))
+        if value is None:
+            value = self.initial_watermark
+        if value is None:
+            raise ValueError('%s has no watermark yet, set initial_watermark' % task.__name__)
+        return value
+
+    def bind_watermark(self, query):
+        """Return `query` as a `sqlalchemy.text()` clause binding the current
+        watermark to the parameter `:<watermark_param>`, if `query` uses it.
+
+        The watermark is bound rather than rendered as a literal so that the
+        driver converts it to the column's type, e.g. datetimes with
+        fractional seconds or a UTC offset. Other colons in `query` followed
+        by a name must be escaped as `\\:`.
+        """
+        param = ':' + self.watermark_param
+        if param not in query:
+            return query
+        import sqlalchemy as sa
+        value = watermarks.to_python(self.current_watermark())
+        return sa.text(query).bindparams(**{self.watermark_param: value})
+
+    def track_watermark(self, output):
+        """Record the highest value of `watermark_column` in `output`, a
+        `DataFrame` or an iterator of `DataFrame`s, as the pending watermark.
+        Returns `output` (wrapped if it is an iterator).
+        """
+        if is_chunked(output):
+            return self._track_chunks(output)
+        value = self._max_watermark(output)
+        if value is not None:
+            watermarks.set_pending(type(self), value)
+        return output
+
+    def _track_chunks(self, chunks):
+        value = None
+        for chunk in chunks:
+            chunk_value = self._max_watermark(chunk)
+            if chunk_value is not None:
+                value = chunk_value if value is None else max(value, chunk_value)
+            yield chunk
+        if value is not None:
+            watermarks.set_pending(type(self), value)
+
+    def _max_watermark(self, df):
+        value = df[self.watermark_column].max() if len(df) else None
+        # NaN if the column is all NULL
+        if value is None or value != value:
+            return None
+        return value
+
+
 class SNSMixin:
     _logger = logging.getLogger(__name__)
 
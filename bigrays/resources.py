@@ -3,6 +3,8 @@
 This Module exposes the following classes
 
 - ResourceManager
+- PooledResourceManager
+- ResourceStats
 - SQLSession (Resource)
 - S3Client (Resource)
 
@@ -13,10 +15,14 @@ Note:
 """
 
 import logging
+import threading
+import time
 
 from .config import BigRaysConfig
 from . import exceptions
-from .utils import ReprMixin
+from . import hooks
+from . import metrics
+from .utils import ReprMixin, classproperty
 
 
 class ResourceManager(ReprMixin):
@@ -47,15 +53,19 @@ class ResourceManager(ReprMixin):
     #     <object at 0x...>
     class _none: pass
 
-    def __init__(self, default_config):
+    def __init__(self, default_config, stats=None):
         """Intialize an instance of `ResourceManager` with the config needed
         to open resources.
 
         Args:
             config: A simple namespace exposing configurations needed by
                 resources to be managed.
+            stats: An instance of `ResourceStats` to record opened and
+                reused resources to. Useful for sharing stats between
+                several managers.
         """
         self.default_config = default_config
+        self.stats = ResourceStats() if stats is None else stats
         self._init_state()
 
     def __enter__(self):
@@ -83,10 +93,32 @@ class ResourceManager(ReprMixin):
                 # opened the cleanup method will take appropriate action.
                 self.resource, self.config = resource, config
                 self._open_resource(resource, config)
+        elif resource is not None:
+            self.stats.record_reuse(resource)
+
+    def reopen_resource(self, resource, config=None):
+        """Close `resource` if it is open and open it again, e.g. to replace
+        a broken connection. Errors raised while closing are logged and
+        ignored.
+
+        Args:
+            resource: An object implementing the `BaseResource` protocol.
+        """
+        if resource is None:
+            return
+        config = self.default_config if config is None else config
+        if resource is self.resource and config is self.config:
+            try:
+                self._cleanup()
+            except Exception:
+                self._logger.warning('could not close resource %s', resource.__name__)
+                self._init_state()
+        self.open_resource(resource, config)
 
     def _open_resource(self, resource, config):
         """Open `resource` with `config`."""
         self._opening_resource = True
+        start = time.perf_counter()
         try:
             resource.open(config)
         except Exception as err:
@@ -96,6 +128,10 @@ class ResourceManager(ReprMixin):
             raise err
         else:
             self._opening_resource = False
+            self.stats.record_open(resource)
+            hooks.emit('resource_opened', resource, time.perf_counter() - start)
+        finally:
+            metrics.record('resource_open_seconds', time.perf_counter() - start)
 
     def _cleanup(self, *exc):
         """Close the existing resource (if exists)."""
@@ -107,6 +143,7 @@ class ResourceManager(ReprMixin):
                 exc = (None, None, None)  # mimic the Python call to __exit__()
             if not self._opening_resource:
                 ignore_exception = self.resource.close(*exc)
+                hooks.emit('resource_closed', self.resource)
             self._init_state()
         return ignore_exception
 
@@ -120,6 +157,117 @@ class ResourceManager(ReprMixin):
         self._opening_resource = False
 
 
+class PooledResourceManager(ResourceManager):
+    """Context manager that keeps every resource it opens open until the end
+    of its context.
+
+    Unlike `ResourceManager`, opening a different resource does not close
+    the current resource. Each distinct pair of resource and config is
+    opened once and reused by every subsequent request to open it.
+
+    Note:
+        Since resources are never closed during a run, state such as
+        temporary tables in a database session is kept across tasks
+        requiring other resources.
+    """
+
+    def open_resource(self, resource, config=None):
+        """Open a resource, or reuse it if it has already been opened.
+
+        Args:
+            resource: An object implementing the `BaseResource` protocol.
+        """
+        if resource is None:
+            return
+        config = self.default_config if config is None else config
+        # configs are compared by identity (as in `ResourceManager`) and
+        # are not necessarily hashable
+        key = (resource, id(config))
+        if key in self._pool:
+            self.stats.record_reuse(resource)
+            _, opened = self._pool[key]
+            resource._register_resource(opened)
+        else:
+            self._open_resource(resource, config)
+            self._pool[key] = (config, resource.resource())
+        self.resource, self.config = resource, config
+
+    def reopen_resource(self, resource, config=None):
+        """Close `resource` if it is pooled and open it again, e.g. to
+        replace a broken connection. Errors raised while closing are logged
+        and ignored.
+
+        Args:
+            resource: An object implementing the `BaseResource` protocol.
+        """
+        if resource is None:
+            return
+        config = self.default_config if config is None else config
+        pooled = self._pool.pop((resource, id(config)), None)
+        if pooled is not None:
+            resource._register_resource(pooled[1])
+            try:
+                resource.close()
+                hooks.emit('resource_closed', resource)
+            except Exception:
+                self._logger.warning('could not close resource %s', resource.__name__)
+        self.open_resource(resource, config)
+
+    def _cleanup(self, *exc):
+        """Close all pooled resources."""
+        if not exc:
+            exc = (None, None, None)  # mimic the Python call to __exit__()
+        ignore_exception = False
+        errors = []
+        for (resource, _), (_, opened) in self._pool.items():
+            try:
+                resource._register_resource(opened)
+                ignore_exception = resource.close(*exc) or ignore_exception
+                hooks.emit('resource_closed', resource)
+            except Exception as err:
+                self._logger.warning('could not close resource %s', resource.__name__)
+                errors.append(err)
+        self._init_state()
+        self._logger.info('resource stats: %s', self.stats)
+        if errors:
+            raise errors[0]
+        return ignore_exception
+
+    def _init_state(self):
+        super()._init_state()
+        self._pool = {}
+
+
+class ResourceStats(ReprMixin):
+    """Thread safe count of the resources opened and reused by one or more
+    `ResourceManager` instances.
+    """
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.as_dict())
+
+    def record_open(self, resource):
+        self._increment(resource, 'opens')
+
+    def record_reuse(self, resource):
+        self._increment(resource, 'reuses')
+
+    def as_dict(self):
+        """Return a mapping of resource names to their open/reuse counts."""
+        with self._lock:
+            return {name: dict(counts) for name, counts in self._counts.items()}
+
+    def _increment(self, resource, stat):
+        name = getattr(resource, '__name__', str(resource))
+        with self._lock:
+            counts = self._counts.setdefault(name, {'opens': 0, 'reuses': 0})
+            counts[stat] += 1
+
+
 class BaseResource(ReprMixin):
     """Base class defining the interface for resources.
 
@@ -131,7 +279,12 @@ class BaseResource(ReprMixin):
         1. A resource stores and exposes its state on itself (the class). This
             is intential for that reason that accessing `Resource.resource()`
             returns the same reference no matter where the call is made in the'
-            code.
+            code. The state is stored per thread however, so that tasks run
+            concurrently (see `BigRays.run(..., max_workers=n)`) each access
+            the resource opened by their own `ResourceManager`. Within a
+            thread a resource may be open with several configs at once (see
+            `PooledResourceManager`), `resource(config)` returns the one
+            opened with `config`.
         2. Resources cannot be instantiated. While it is true that the point
             above is satisfied by accessing the classmethod on an instance -
             `Resource().resource()` - `ResourceManager` opens and closes
@@ -151,7 +304,8 @@ class BaseResource(ReprMixin):
     using a tuple for its immutability over mutable objects such as a list.
     """
 
-    _resource = None
+    # opened resources keyed by resource class, one mapping per thread
+    _opened = threading.local()
 
     _logger = logging.getLogger(__name__)
 
@@ -173,7 +327,7 @@ class BaseResource(ReprMixin):
             msg = 'could not open resource %s, cause: %s' \
                     % (cls.__name__, err)
             raise exceptions.ResourceError(msg)
-        cls._register_resource(resource)
+        cls._register_resource(resource, config)
         return cls
 
     @classmethod
@@ -189,26 +343,81 @@ class BaseResource(ReprMixin):
                 or not.
         """
         cls._logger.info('closing resource: %s', cls.__name__)
-        if cls._resource is None:
+        if cls._opened_resources().get(cls) is None:
             raise exceptions.ResourceError(
                 'attempted to close an unopened resource on %s' % cls.__name__)
         ignore_exception = cls._close(*exc)
-        cls._resource = None
+        closed = cls._opened_resources().pop(cls)
+        by_config = cls._opened_by_config()
+        for key in [key for key, (_, opened) in by_config.items()
+                    if key[0] is cls and opened is closed]:
+            del by_config[key]
         return ignore_exception
 
     @classmethod
-    def resource(cls):
-        if cls._resource is None:
+    def resource(cls, config=None):
+        """Return the opened resource.
+
+        Args:
+            config: Return the resource opened with this config (compared by
+                identity) rather than the one opened or reused last.
+        """
+        if config is None:
+            resource = cls._opened_resources().get(cls)
+        else:
+            _, resource = cls._opened_by_config().get((cls, id(config)), (None, None))
+        if resource is None:
             raise RuntimeError('no opened resource for %s' % cls.__name__)
-        return cls._resource
+        return resource
 
     @classmethod
-    def _register_resource(cls, resource):
+    def _register_resource(cls, resource, config=None):
         """Save a reference to an opened resource (the raw resource, not a
         subclass of BaseResource) so that users can access it from
-        `cls.resource()`
+        `cls.resource()`, and from `cls.resource(config)` if `config` is given.
+        """
+        cls._opened_resources()[cls] = resource
+        if config is not None:
+            # the config is kept so that its id is not reused
+            cls._opened_by_config()[(cls, id(config))] = (config, resource)
+
+    @classmethod
+    def share_opened_resources(cls):
+        """Return a function which, when called from another thread, makes
+        the resources opened in the current thread available there.
+
+        Only resources which are safe to use concurrently (e.g. boto3
+        clients) should be accessed by more than one thread.
+        """
+        opened = dict(cls._opened_resources())
+        by_config = dict(cls._opened_by_config())
+
+        def register_shared_resources():
+            cls._opened.resources = dict(opened)
+            cls._opened.by_config = dict(by_config)
+        return register_shared_resources
+
+    @classmethod
+    def _opened_resources(cls):
+        """Return the mapping of resources opened (or reused) last in the
+        current thread.
         """
-        cls._resource = resource
+        try:
+            return cls._opened.resources
+        except AttributeError:
+            cls._opened.resources = {}
+            return cls._opened.resources
+
+    @classmethod
+    def _opened_by_config(cls):
+        """Return the mapping of `(resource, config id)` to `(config, opened
+        resource)` of the resources opened in the current thread.
+        """
+        try:
+            return cls._opened.by_config
+        except AttributeError:
+            cls._opened.by_config = {}
+            return cls._opened.by_config
 
     @classmethod
     def _open(cls, config):
@@ -233,36 +442,98 @@ class BaseResource(ReprMixin):
 
 
 class SQLSession(BaseResource):
-    required_configs = BigRaysConfig.ODBC_CONNECT_PARAMS
+    # properties since `BigRaysConfig` is only read from the environment
+    # when first accessed
+    @classproperty
+    def required_configs(cls):
+        return BigRaysConfig.ODBC_CONNECT_PARAMS
+
+    # engines are cached by connection url so that an engine is created once
+    # per url. Connections opened as the resource are closed when the
+    # resource is closed rather than returned to the engine's pool, so that
+    # session state (e.g. temporary tables) never outlives the resource.
+    # Connections checked out with `engine()` (e.g. to fetch chunks) are
+    # pooled, the engines are disposed of once every run and session using
+    # them (see `acquire_engines()`) has finished.
+    _engines = {}
+    _engines_lock = threading.Lock()
+    _engine_users = 0
 
     @classmethod
     def _open(cls, config):
         """Create and return a `sqlalchemy.engine.Connection`."""
-        cls._resource = cls._create_engine(config.ODBC_CONNECT_URL).connect()
-        return cls._resource
+        return cls.engine(config).connect()
 
     @classmethod
     def _close(cls, *exc):
-        cls._resource.close()
+        connection = cls.resource()
+        # closes the DBAPI connection instead of returning it to the pool
+        connection.invalidate()
+        connection.close()
         return False
 
+    @classmethod
+    def engine(cls, config):
+        """Return the (cached) `sqlalchemy.engine.Engine` for `config`.
+
+        Useful for tasks which need a database connection in addition to
+        their `required_resource`.
+        """
+        return cls._create_engine(config.ODBC_CONNECT_URL)
+
     @classmethod
     def _create_engine(cls, connect_url):
-        import sqlalchemy as sa
-        return sa.create_engine(connect_url)
+        """Return the (cached) engine for `connect_url`."""
+        with cls._engines_lock:
+            if connect_url not in cls._engines:
+                import sqlalchemy as sa
+                cls._engines[connect_url] = sa.create_engine(connect_url)
+            return cls._engines[connect_url]
+
+    @classmethod
+    def acquire_engines(cls):
+        """Record a user (e.g. a run or session) of the cached engines. The
+        engines are kept until every user has called `release_engines()`,
+        so that a run finishing in one thread doesn't dispose of the engines
+        used by a run in another.
+        """
+        with cls._engines_lock:
+            cls._engine_users += 1
+
+    @classmethod
+    def release_engines(cls):
+        """Release the engines acquired with `acquire_engines()`, disposing
+        of them if no other user remains.
+        """
+        with cls._engines_lock:
+            cls._engine_users -= 1
+            if cls._engine_users:
+                return
+        cls.dispose_engines()
+
+    @classmethod
+    def dispose_engines(cls):
+        """Close all pooled connections and discard the cached engines."""
+        with cls._engines_lock:
+            for engine in cls._engines.values():
+                engine.dispose()
+            cls._engines.clear()
 
 
 class BaseAWSClient:
-    if BigRaysConfig.AWS_REQUIRE_SECRETS:
-        required_configs = {
-            'AWS_ACCESS_KEY_ID': 'aws_access_key_id',
-            'AWS_SECRET_ACCESS_KEY': 'aws_secret_access_key',
-        }
-    else:
-        required_configs = {}
+    # configs required if `BigRaysConfig.AWS_REQUIRE_SECRETS`, mapped to the
+    # keyword arguments of `boto3.client()`
+    _secret_configs = {
+        'AWS_ACCESS_KEY_ID': 'aws_access_key_id',
+        'AWS_SECRET_ACCESS_KEY': 'aws_secret_access_key',
+    }
 
     _client_name = None
 
+    @classproperty
+    def required_configs(cls):
+        return cls._secret_configs if BigRaysConfig.AWS_REQUIRE_SECRETS else {}
+
     def __init_subclass__(cls):
         if cls._client_name is None:
             raise exceptions.BigRaysError(
@@ -285,10 +556,9 @@ class S3Client(BaseAWSClient, BaseResource):
 
 
 class SNSClient(BaseAWSClient, BaseResource):
-    if BigRaysConfig.AWS_REQUIRE_SECRETS:
-        required_configs = {
-            'AWS_ACCESS_KEY_ID': 'aws_access_key_id',
-            'AWS_SECRET_ACCESS_KEY': 'aws_secret_access_key',
-            'AWS_REGION': 'region_name',
-        }
+    _secret_configs = {
+        'AWS_ACCESS_KEY_ID': 'aws_access_key_id',
+        'AWS_SECRET_ACCESS_KEY': 'aws_secret_access_key',
+        'AWS_REGION': 'region_name',
+    }
     _client_name = 'sns'
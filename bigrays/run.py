@@ -1,37 +1,276 @@
 """Module implementing the functionality for running user defined tasks."""
 
-import collections
 import logging
+import queue
+import threading
+import time
 
 from . import exceptions as exc
+from . import hooks as bigrays_hooks
+from .checkpoint import Checkpoint
 from .config import BigRaysConfig
-from .resources import ResourceManager
+from .graph import TaskGraph, TaskScheduler, count_resource_opens
+from .liveness import OutputLiveness
+from .metrics import RunMetrics
+from .resources import PooledResourceManager, ResourceManager, SQLSession
 from . import tasks as bigrays_tasks
+from . import watermarks
+from .utils import ReprMixin
+
+
+class RunSummary(ReprMixin):
+    """Statistics collected during a call to `BigRays.run()`.
+
+    Attributes:
+        resource_stats: `bigrays.resources.ResourceStats` of all resources
+            opened and reused during the run.
+        cache_stats: `bigrays.cache.CacheStats` of the run's output cache, or
+            `None` if no cache was used.
+        memory_stats: `bigrays.liveness.MemoryStats` of the task outputs, or
+            `None` if outputs were not released.
+        metrics: `bigrays.metrics.RunMetrics` of the tasks run, or `None` if
+            metrics were not collected.
+    """
+
+    def __init__(self, resource_stats, cache_stats=None, memory_stats=None, metrics=None):
+        self.resource_stats = resource_stats
+        self.cache_stats = cache_stats
+        self.memory_stats = memory_stats
+        self.metrics = metrics
+
+
+class RunContext(ReprMixin):
+    """Options of a call to `BigRays.run()` applying to every task.
+
+    Attributes:
+        cache: An optional `bigrays.cache.OutputCache`.
+        checkpoint: An optional `bigrays.checkpoint.Checkpoint`.
+        liveness: An optional `bigrays.liveness.OutputLiveness`.
+        metrics: An optional `bigrays.metrics.RunMetrics`.
+        succeeded: The set of tasks which succeeded so far.
+    """
+
+    def __init__(self, cache=None, checkpoint=None, liveness=None, metrics=None):
+        self.cache = cache
+        self.checkpoint = checkpoint
+        self.liveness = liveness
+        self.metrics = metrics
+        self.succeeded = set()
 
 
 class BigRays:
     _logger = logging.getLogger(__name__)
 
+    max_workers = 1
+    """Default number of tasks which may run concurrently. With a value
+    greater than 1 tasks are scheduled according to their dependencies (see
+    `bigrays.graph`) rather than strictly in order.
+    """
+
+    pool_resources = False
+    """Default for whether resources are kept open for the whole run (see
+    `bigrays.resources.PooledResourceManager`) rather than closed whenever
+    a task requires a different resource.
+    """
+
+    reorder_tasks = False
+    """Default for whether tasks are reordered to group tasks requiring the
+    same resource (see `bigrays.graph.TaskGraph.resource_order()`).
+    """
+
+    output_cache = None
+    """Default `bigrays.cache.OutputCache` consulted before running cacheable
+    tasks, `None` disables caching.
+    """
+
+    release_outputs = False
+    """Default for whether task outputs are released once all the tasks
+    consuming them have finished (see `bigrays.liveness`).
+    """
+
+    collect_metrics = True
+    """Whether the timing, memory and I/O of each task are measured and
+    reported at the end of a run (see `bigrays.metrics`).
+    """
+
+    trace_memory = False
+    """Default for whether the memory allocated by each task is measured
+    with `tracemalloc`, which slows down tasks considerably.
+    """
+
+    hooks = ()
+    """Default hooks registered for every run (see `bigrays.hooks`), in
+    addition to those configured with `BIGRAYS_HOOKS`.
+    """
+
+    @classmethod
+    def run(cls, *tasks, max_workers=None, pool_resources=None, reorder_tasks=None,
+            output_cache=None, checkpoint_dir=None, release_outputs=None,
+            trace_memory=None, hooks=None):
+        """Run `tasks` (or all registered tasks if none are given).
+
+        Args:
+            *tasks: `bigrays` tasks to run.
+            max_workers: The number of tasks which may run concurrently,
+                defaults to `BigRays.max_workers`.
+            pool_resources: Keep all resources open until the run completes,
+                defaults to `BigRays.pool_resources`.
+            reorder_tasks: Reorder tasks to minimize opening and closing of
+                resources, defaults to `BigRays.reorder_tasks`.
+            output_cache: A `bigrays.cache.OutputCache` serving the outputs
+                of unchanged tasks instead of running them, defaults to
+                `BigRays.output_cache`.
+            checkpoint_dir: Directory to checkpoint the output of each task
+                to as it succeeds, allowing the run to be resumed with
+                `BigRays.resume()` if it fails. Any previous checkpoint in
+                the directory is removed.
+            release_outputs: Release each task output once all the tasks
+                consuming it have finished, defaults to
+                `BigRays.release_outputs`. Tasks setting `keep_output = True`
+                are never released.
+            trace_memory: Measure the memory allocated by each task with
+                `tracemalloc`, defaults to `BigRays.trace_memory`.
+            hooks: Hooks to call on task and resource events (see
+                `bigrays.hooks`), defaults to `BigRays.hooks`. Hooks
+                configured with `BIGRAYS_HOOKS` are registered in addition.
+
+        Returns:
+            `RunSummary`
+        """
+        checkpoint = None
+        if checkpoint_dir is not None:
+            checkpoint = Checkpoint(checkpoint_dir)
+            checkpoint.clear()
+        return cls._run(tasks, checkpoint, max_workers=max_workers,
+                        pool_resources=pool_resources, reorder_tasks=reorder_tasks,
+                        output_cache=output_cache, release_outputs=release_outputs,
+                        trace_memory=trace_memory, hooks=hooks)
+
+    @classmethod
+    def resume(cls, checkpoint_dir, *tasks, **kwargs):
+        """Resume a run which was started with `checkpoint_dir` and failed.
+
+        The outputs of the tasks preceding the first task which failed (or
+        never ran) are restored from the checkpoint and the tasks from that
+        task on are run, checkpointing to `checkpoint_dir` as they succeed.
+        `tasks` (and `reorder_tasks`) must be the same as in the original run.
+
+        Args:
+            checkpoint_dir: The `checkpoint_dir` of the original run.
+            *tasks: `bigrays` tasks, see `BigRays.run()`.
+            **kwargs: Keyword arguments to `BigRays.run()`, other than
+                `checkpoint_dir`.
+
+        Returns:
+            `RunSummary`
+        """
+        return cls._run(tasks, Checkpoint(checkpoint_dir), resume=True, **kwargs)
+
     @classmethod
-    def run(cls, *tasks):
-        tasks = cls._define_task_list(tasks if tasks else None)
+    def _run(cls, tasks, checkpoint=None, resume=False, max_workers=None,
+             pool_resources=None, reorder_tasks=None, output_cache=None,
+             release_outputs=None, trace_memory=None, hooks=None):
+        max_workers = cls.max_workers if max_workers is None else max_workers
+        pool_resources = cls.pool_resources if pool_resources is None else pool_resources
+        reorder_tasks = cls.reorder_tasks if reorder_tasks is None else reorder_tasks
+        output_cache = cls.output_cache if output_cache is None else output_cache
+        release_outputs = cls.release_outputs if release_outputs is None else release_outputs
+        trace_memory = cls.trace_memory if trace_memory is None else trace_memory
+        hooks = list(cls.hooks if hooks is None else hooks)
+        hooks.extend(bigrays_hooks.load(getattr(BigRaysConfig, 'HOOKS', None) or ()))
+        tasks = cls._define_task_list(tasks if tasks else None, reorder_tasks)
+        all_tasks = tasks
+        if resume:
+            tasks = checkpoint.restore(tasks)
         required_resources = cls._define_required_resources(tasks)
         cls._check_configs(BigRaysConfig, required_resources)
+        for task in tasks:
+            cls._check_additional_configs(task, BigRaysConfig)
+        remaining = set(tasks)
+        restored = [task for task in all_tasks if task not in remaining]
+        liveness = OutputLiveness(tasks, restored) if release_outputs else None
+        run_metrics = RunMetrics(trace_memory) if cls.collect_metrics else None
+        context = RunContext(cache=output_cache, checkpoint=checkpoint, liveness=liveness,
+                             metrics=run_metrics)
+        # restored tasks succeeded in the run being resumed
+        context.succeeded.update(restored)
         cls._logger.info('running tasks')
-        with ResourceManager(BigRaysConfig) as resource_manager:
-            cls._run_tasks(tasks, resource_manager)
+        manager_class = PooledResourceManager if pool_resources else ResourceManager
+        if run_metrics is not None:
+            run_metrics.start()
+        SQLSession.acquire_engines()
+        failed = True
+        try:
+            with bigrays_hooks.installed(hooks), manager_class(BigRaysConfig) as resource_manager:
+                if max_workers > 1:
+                    cls._run_tasks_in_parallel(tasks, resource_manager, max_workers, context)
+                else:
+                    cls._run_tasks(tasks, resource_manager, context)
+            failed = False
+        finally:
+            try:
+                # watermarks of the tasks which succeeded along with their
+                # dependants are advanced even if the run failed
+                cls._commit_watermarks(all_tasks, context.succeeded, failed)
+            finally:
+                # close the connections left in the engines' pools, unless
+                # another run or session is still using them
+                SQLSession.release_engines()
+                if run_metrics is not None:
+                    run_metrics.stop()
+                    # reported even if the run failed
+                    cls._report_metrics(run_metrics)
         cls._logger.info('all tasks complete')
+        if output_cache is not None:
+            cls._logger.info('output cache: %s', output_cache.stats)
+        return RunSummary(resource_manager.stats,
+                          cache_stats=output_cache.stats if output_cache is not None else None,
+                          memory_stats=liveness.finish() if liveness is not None else None,
+                          metrics=run_metrics)
 
     @classmethod
-    def _define_task_list(cls, tasks):
+    def _commit_watermarks(cls, tasks, succeeded, failed):
+        """Commit the pending watermarks of `tasks`. If the run `failed` an
+        error committing them is logged rather than raised, so that it
+        doesn't replace the error of the run.
+        """
+        try:
+            watermarks.commit_pending(tasks, succeeded)
+        except Exception:
+            if not failed:
+                raise
+            cls._logger.exception('could not commit the watermarks of the failed run')
+
+    @classmethod
+    def _report_metrics(cls, run_metrics):
+        cls._logger.info('task metrics:\n%s', run_metrics.table())
+        cls._logger.info('task metrics json: %s', run_metrics.to_json())
+
+    @classmethod
+    def _define_task_list(cls, tasks, reorder=False):
         message = 'using {} task list'
         if tasks is not None:
             cls._logger.info(message.format('custom'))
         else:
-            tasks = bigrays_tasks.TASK_REGISTER
+            # copied since tasks defined during the run are appended to the
+            # register
+            tasks = list(bigrays_tasks.TASK_REGISTER)
             cls._logger.info(message.format('default'))
+        if reorder:
+            tasks = cls._reorder_tasks(tasks)
         return tasks
 
+    @classmethod
+    def _reorder_tasks(cls, tasks):
+        """Reorder `tasks` to group tasks requiring the same resource."""
+        planned = TaskGraph(tasks).resource_order()
+        opens_before = count_resource_opens(tasks)
+        opens_after = count_resource_opens(planned)
+        cls._logger.info('planned task order: %s', [getattr(t, '__name__', t) for t in planned])
+        cls._logger.info('reordering tasks reduced resource opens from %s to %s (%s saved)',
+                         opens_before, opens_after, opens_before - opens_after)
+        return planned
+
     @classmethod
     def _define_required_resources(cls, tasks):
         requirements = {task.required_resource
@@ -56,39 +295,29 @@ class BigRays:
             raise exc.ConfigurationError(err_msg)
 
     @classmethod
-    def _run_tasks(cls, tasks, resource_manager):
+    def _check_additional_configs(cls, task, default_config):
+        """Check the configs of the resources `task`, a task class or
+        instance, uses besides its `required_resource` (see
+        `BaseTask.additional_resources()`).
+        """
+        if not (isinstance(task, bigrays_tasks.BaseTask)
+                or isinstance(task, type) and issubclass(task, bigrays_tasks.BaseTask)):
+            return
+        for resource, config in task.additional_resources():
+            cls._check_configs(default_config if config is None else config, [resource])
+
+    @classmethod
+    def _run_tasks(cls, tasks, resource_manager, context=None):
         """Run all `tasks` in order.
 
         Args:
             tasks: An iterable of `bigrays` tasks.
             resource_manager: An instance of `bigrays.resources.ResourceManager`.
+            context: An optional `RunContext`.
 
         Raises:
-            `bigrays.exceptions.BigRaysError`: If one or more errors occurred
+            `bigrays.exceptions.TaskErrors`: If one or more errors occurred
                 inside of a task (or tasks).
-        """
-        failed_tasks = []
-        # convert this to something we can .popleft() from
-        tasks = collections.deque(tasks)
-        try:
-            cls._run_tasks_with_error_harness(tasks, resource_manager, failed_tasks)
-        except Exception as err:
-            raise exc.BigRaysError(
-                'exceptions occurred while running tasks (includes failure to open '
-                f'resources): {failed_tasks}') from err
-            
-
-    @classmethod
-    def _run_tasks_with_error_harness(cls, tasks, resource_manager, failed_tasks):
-        """
-        Run all `tasks` with proper error handling.
-
-        Args:
-            tasks: An iterable of `bigrays` tasks.
-            resource_manager: An instance of `bigrays.resources.ResourceManager`.
-            failed_tasks: An empty `list` which failed tasks will be
-                appended to. Note that the mutability of lists implies that
-                the caller will be able to see the tasks appended to the list.
 
         Note: Proper error handling requires the following features:
 
@@ -98,108 +327,222 @@ class BigRays:
             Even when a previous task that set `run_with_exceptions = True`
             has raised an exception.
         3. A traceback from all errors occurring while a task is executed
-            is printed (see note below on recursion on how this is
-            implemented). This is to complements the previous requirement
-            which allows more than one exception to be raised in a single
-            pass through the task list which makes how to simply use the
-            `raise ... from ...` construct less clear.
-
-        On the implementation:
-        To satisify the requirement 3 recursion is used to take advantage of how
-        Python handles an exception during finally as demonstrated by the code
-        snippet.
-
-            >>> try:
-            ...     raise Exception('foo')
-            ... finally:
-            ...     raise Exception('bar')
-            ... 
-            Traceback (most recent call last):
-              File "<stdin>", line 2, in <module>
-            Exception: foo
-
-            During handling of the above exception, another exception occurred:
-
-            Traceback (most recent call last):
-              File "<stdin>", line 4, in <module>
-            Exception: bar
-
-        You can find more information on exception contexts here
-
-            https://docs.python.org/3.6/reference/compound_stmts.html#finally
-
-        Note that while the first exception gets swallowed and only the last
-        exception propogates through we still get a traceback from the first.
-        To gain some intuition on how we use recurrence in this method to
-        leverage the Python implementation take a look at the simpler example
-        below. Additionally the script "examples/running_with_exceptions_tb.py"
-        demonstrates how all of this error handling looks in practice.
-
-            >>> def f(x):       
-            ...        if not x:   
-            ...            return          
-            ...        y = x.pop()
-            ...        try:
-            ...            raise Exception(y)
-            ...        finally:
-            ...            f(x)
-            ... 
-            >>> f([1, 2, 3])
-            Traceback (most recent call last):
-              File "<stdin>", line 6, in f
-            Exception: 3
-
-            During handling of the above exception, another exception occurred:
-
-            Traceback (most recent call last):
-              File "<stdin>", line 6, in f
-            Exception: 2
-
-            During handling of the above exception, another exception occurred:
-
-            Traceback (most recent call last):
-              File "<stdin>", line 1, in <module>
-              File "<stdin>", line 8, in f
-              File "<stdin>", line 8, in f
-              File "<stdin>", line 6, in f
-            Exception: 1
+            is printed. This is to complement the previous requirement which
+            allows more than one exception to be raised in a single pass
+            through the task list. The exceptions are collected as tasks fail
+            and raised together as a `bigrays.exceptions.TaskErrors` once
+            every task has been run (or skipped), whose message contains the
+            traceback of each exception.
+
+        Tasks are run in a flat loop so that neither the stack depth nor the
+        cost of reporting errors grows with the number of tasks.
         """
-        # Note that we don't actually intend to iterate through all of the tasks here.
-        # Using "while" here is convenient because it allows us to isolate our code
-        # for running a single task to one line with the "continue" statement.
-        while tasks:
-            task = tasks.popleft()
+        failures = []
+        for task in tasks:
+            if failures:
+                if not task.run_with_exceptions:
+                    cls._logger.warning('skipping %s due to the occurrence of an exception', task)
+                    continue
+                cls._logger.warning('running %(task)s after the occurrence of an exception '
+                                    'since `%(task)s.run_with_exceptions is True`',
+                                    dict(task=task))
             try:
-                if failed_tasks:
-                    if not task.run_with_exceptions:
-                        cls._logger.warning('skipping %s due to the occurrence of an exception', task)
-                        continue
-                    else:
+                cls._run_task(task, resource_manager, context)
+            except Exception as err:
+                cls._log_failure(task, err)
+                failures.append((task, err))
+        if failures:
+            cls._raise_failures(failures)
+
+    @classmethod
+    def _log_failure(cls, task, err):
+        if isinstance(err, exc.ResourceError):
+            cls._logger.warning('could not open resource for task %s', task)
+        else:
+            cls._logger.warning('could not run task %s', task)
+
+    @staticmethod
+    def _raise_failures(failures):
+        raise exc.TaskErrors(
+            'exceptions occurred while running tasks (includes failure to open '
+            f'resources): {[task for task, _ in failures]}', failures)
+
+    @classmethod
+    def _run_tasks_in_parallel(cls, tasks, resource_manager, max_workers, context=None):
+        """Run `tasks` on a pool of `max_workers` threads, starting each task
+        as soon as all of the tasks it depends on have finished.
+
+        Each worker thread opens resources with its own resource manager of
+        the same type, and sharing the stats, of `resource_manager`. Error
+        handling follows the rules documented in `_run_tasks()`, except that
+        tasks already running when an exception occurs are allowed to finish.
+
+        Args:
+            tasks: An iterable of `bigrays` tasks.
+            resource_manager: An instance of `bigrays.resources.ResourceManager`.
+            max_workers: The number of worker threads.
+            context: An optional `RunContext`.
+
+        Raises:
+            `bigrays.exceptions.TaskErrors`: If one or more errors occurred
+                inside of a task (or tasks).
+        """
+        scheduler = TaskScheduler(TaskGraph(tasks))
+        failures = []
+        work_queue, done_queue = queue.Queue(), queue.Queue()
+        workers = [threading.Thread(target=cls._worker,
+                                    args=(work_queue, done_queue, resource_manager, context,
+                                          bigrays_hooks.current()),
+                                    name='bigrays-worker-%s' % i,
+                                    daemon=True)
+                   for i in range(max_workers)]
+        for worker in workers:
+            worker.start()
+        running = 0
+        try:
+            while scheduler.pending or running:
+                task = scheduler.pop_ready()
+                while task is not None:
+                    if failures:
+                        if not task.run_with_exceptions:
+                            cls._logger.warning('skipping %s due to the occurrence of an exception', task)
+                            # skipped tasks are finished as far as their
+                            # dependants are concerned
+                            scheduler.finished(task)
+                            task = scheduler.pop_ready()
+                            continue
                         cls._logger.warning('running %(task)s after the occurrence of an exception '
                                             'since `%(task)s.run_with_exceptions is True`',
                                             dict(task=task))
-                cls._run_task(task, resource_manager)
-            except Exception as err:
-                if isinstance(err, exc.ResourceError):
-                    cls._logger.warning('could not open resource for task %s', task)
+                    work_queue.put(task)
+                    running += 1
+                    task = scheduler.pop_ready()
+                if not running:
+                    break
+                task, err = done_queue.get()
+                running -= 1
+                scheduler.finished(task)
+                if err is not None:
+                    cls._log_failure(task, err)
+                    failures.append((task, err))
+        finally:
+            for _ in workers:
+                work_queue.put(None)
+            for worker in workers:
+                worker.join()
+        if failures:
+            cls._raise_failures(failures)
+
+    @classmethod
+    def _worker(cls, work_queue, done_queue, parent_manager, context=None, listeners=None):
+        """Run tasks from `work_queue` until `None` is received, reporting
+        each task along with the exception it raised (if any) to
+        `done_queue`. Events are dispatched to the hook `listeners` of the
+        run (see `bigrays.hooks.current()`).
+        """
+        if listeners is not None:
+            bigrays_hooks.activate(listeners)
+        manager_class = type(parent_manager)
+        with manager_class(parent_manager.default_config,
+                           stats=parent_manager.stats) as resource_manager:
+            while True:
+                task = work_queue.get()
+                if task is None:
+                    break
+                try:
+                    cls._run_task(task, resource_manager, context)
+                except Exception as err:
+                    done_queue.put((task, err))
                 else:
-                    cls._logger.warning('could not run task %s', task)
-                failed_tasks.append(task)
-                # re-raise error so that the traceback is printed
-                raise err
-            finally:
-                cls._run_tasks_with_error_harness(tasks, resource_manager, failed_tasks)
+                    done_queue.put((task, None))
 
     @classmethod
-    def _run_task(cls, task, resource_manager):
-        config = getattr(task, 'resource_config', None)
-        resource_manager.open_resource(task.required_resource, config)
+    def _run_task(cls, task, resource_manager, context=None):
+        if context is None:
+            context = RunContext()
+        if context.metrics is None:
+            cls._execute_task(task, resource_manager, context)
+            return
+        with context.metrics.measure(task) as task_metrics:
+            if cls._execute_task(task, resource_manager, context):
+                task_metrics.status = 'cached'
+
+    @classmethod
+    def _execute_task(cls, task, resource_manager, context):
+        """Run `task`, or set its output from `context.cache`, calling hooks
+        before and after. Returns `True` if the output was cached.
+        """
+        bigrays_hooks.emit('before_task', task)
+        start = time.perf_counter()
+        try:
+            cached = cls._execute_task_with_cache(task, resource_manager, context)
+        except Exception as err:
+            bigrays_hooks.emit('task_failed', task, err)
+            raise
+        bigrays_hooks.emit('after_task', task, time.perf_counter() - start)
+        return cached
+
+    @classmethod
+    def _execute_task_with_cache(cls, task, resource_manager, context):
         # classes are instantiated here so that the Task protocol doesn't
         # require users to write classmethods i.e. the following works
         # >>> def (self, ...):
         task_instance = task()
-        # actually execute the task now by calling the instance
-        task_instance()
+        key = None
+        if context.cache is not None:
+            key = context.cache.key(task_instance, resource_manager.default_config)
+            if key is not None:
+                hit, output = context.cache.get(key)
+                if hit:
+                    cls._logger.info('using cached output for task %s', task)
+                    task.output = output
+                    cls._task_succeeded(task, context)
+                    return True
+        try:
+            config = getattr(task, 'resource_config', None)
+            resource_manager.open_resource(task.required_resource, config)
+            cls._call_with_retries(task, task_instance, resource_manager)
+        except Exception:
+            if context.checkpoint is not None:
+                context.checkpoint.record_failure(task)
+            raise
+        if key is not None:
+            context.cache.put(key, task.output)
+        cls._task_succeeded(task, context)
+        return False
+
+    @classmethod
+    def _call_with_retries(cls, task, task_instance, resource_manager):
+        # only task classes are retried, any other object (e.g. a mock) runs
+        # once
+        retries = task.retries if isinstance(task, type) else 0
+        attempt = 1
+        while True:
+            try:
+                # actually execute the task now by calling the instance
+                return task_instance()
+            except Exception as err:
+                if attempt > retries:
+                    raise
+                attempt += 1
+                cls._logger.warning('task %s failed (%s), retrying (attempt %s of %s)',
+                                    task, err, attempt, retries + 1)
+                bigrays_hooks.emit('retry', task, attempt, err)
+                time.sleep(task.retry_delay)
+                # the error may have left the resource (e.g. a connection)
+                # or the instance in a broken state
+                resource_manager.reopen_resource(task.required_resource,
+                                                 getattr(task, 'resource_config', None))
+                task_instance = task()
+
+    @staticmethod
+    def _task_succeeded(task, context):
+        context.succeeded.add(task)
+        if context.checkpoint is not None:
+            context.checkpoint.record_success(task, task.output)
+        if context.liveness is not None:
+            context.liveness.task_finished(task)
 
 
 bigrays_run = BigRays.run
+bigrays_resume = BigRays.resume
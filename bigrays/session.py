@@ -0,0 +1,104 @@
+"""Module keeping resources open across calls to the functional interface.
+
+Each call to a function of `bigrays.functional_interface` (e.g.
+`sql_query()`) runs its task directly, without defining a task class or
+going through `bigrays_run()`. Outside of a session the resource the task
+requires is opened and closed for every call. Inside of a session it is
+opened by the first call requiring it and kept open until the session ends:
+
+    >>> import bigrays
+    >>> with bigrays.session():
+    ...     frames = [bigrays.sql_query(query=query, format_kws={'day': day})
+    ...               for day in days]
+
+Sessions apply to the thread which entered them, calls made from other
+threads open their own resources.
+"""
+
+import logging
+import threading
+
+from .config import BigRaysConfig
+from .resources import PooledResourceManager, ResourceStats, SQLSession
+from .run import BigRays
+from .utils import ReprMixin
+
+_local = threading.local()
+
+
+def current():
+    """Return the `Session` active in this thread, or `None`."""
+    return getattr(_local, 'session', None)
+
+
+class Session(ReprMixin):
+    """Context manager keeping the resources opened by the functional
+    interface open until it exits.
+
+    Args:
+        config: The config to open resources with (unless a task sets
+            `resource_config`), defaults to `BigRaysConfig`.
+
+    Attributes:
+        stats: `bigrays.resources.ResourceStats` of the resources opened and
+            reused during the session.
+    """
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self, config=None):
+        self.config = config
+        self.stats = ResourceStats()
+        self._manager = None
+        self._checked = set()
+        self._previous = None
+
+    def __repr__(self):
+        return '%s(open=%s)' % (self.__class__.__name__, self._manager is not None)
+
+    def __enter__(self):
+        config = BigRaysConfig if self.config is None else self.config
+        self._manager = PooledResourceManager(config, stats=self.stats).__enter__()
+        SQLSession.acquire_engines()
+        self._previous = current()
+        _local.session = self
+        return self
+
+    def __exit__(self, *exc):
+        _local.session = self._previous
+        manager, self._manager = self._manager, None
+        self._checked.clear()
+        try:
+            return manager.__exit__(*exc)
+        finally:
+            SQLSession.release_engines()
+
+    def run(self, task):
+        """Open (or reuse) the resource required by the task instance `task`
+        and return the output of `task.run()`.
+        """
+        resource = getattr(task, 'required_resource', None)
+        config = getattr(task, 'resource_config', None)
+        if resource is not None and (resource, id(config)) not in self._checked:
+            BigRays._check_configs(self._manager.default_config if config is None else config,
+                                   [resource])
+            self._checked.add((resource, id(config)))
+        # the instance, since keyword arguments (e.g. `sql_config`) are set
+        # on it rather than on the class
+        BigRays._check_additional_configs(task, self._manager.default_config)
+        self._manager.open_resource(resource, config)
+        self._logger.debug('running task: %s', type(task).__name__)
+        return task.run()
+
+
+session = Session
+
+
+def run_task(task):
+    """Run the task instance `task` in the current session, or in a session
+    of its own if there is none.
+    """
+    active = current()
+    if active is not None:
+        return active.run(task)
+    with Session() as temporary:
+        return temporary.run(task)
@@ -0,0 +1,193 @@
+"""Module implementing the stores backing task outputs.
+
+`Task.output` (see `bigrays.tasks.TaskOutput`) keeps the output of each task
+in an output store. The default `MemoryStore` keeps every output in memory.
+`SpillStore` keeps outputs in memory up to a byte budget and spills the
+least recently used `DataFrame`s and byte streams to local disk beyond
+that, loading them again when a downstream task accesses `.output` (or the
+value of a placeholder referencing it). This allows jobs whose outputs
+don't all fit in memory at once to complete.
+
+The store is configured with `bigrays.tasks.set_output_store()`, or by
+setting `BIGRAYS_OUTPUT_MEMORY_LIMIT` which uses a `SpillStore` with that
+budget.
+
+    >>> from bigrays.store import SpillStore
+    >>> from bigrays.tasks import set_output_store
+    >>> set_output_store(SpillStore(max_bytes=4 * 1024 ** 3))
+"""
+
+import collections
+import io
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+from .cache import dump_output, load_output
+from .config import BigRaysConfig
+from .utils import ReprMixin, is_dataframe, output_nbytes
+
+_logger = logging.getLogger(__name__)
+
+
+class OutputStore(ReprMixin):
+    """Interface of output stores. Keys are task classes."""
+
+    def __contains__(self, key):
+        raise NotImplementedError
+
+    def get(self, key):
+        """Return the output stored for `key`, raising `KeyError` if there
+        is none.
+        """
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def discard(self, key):
+        """Remove the output stored for `key`, if any."""
+        raise NotImplementedError
+
+    def nbytes(self, key):
+        """Return the approximate size of the output stored for `key`,
+        without loading it, raising `KeyError` if there is none.
+        """
+        raise NotImplementedError
+
+
+class MemoryStore(OutputStore):
+    """Store keeping all outputs in memory."""
+
+    def __init__(self):
+        self._values = {}
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def get(self, key):
+        return self._values[key]
+
+    def set(self, key, value):
+        self._values[key] = value
+
+    def discard(self, key):
+        self._values.pop(key, None)
+
+    def nbytes(self, key):
+        return output_nbytes(self._values[key], deep=False)
+
+
+class SpillStore(OutputStore):
+    """Store keeping outputs in memory up to `max_bytes` and spilling
+    `DataFrame`s and `io.BytesIO` streams to disk beyond that.
+
+    A spilled output is loaded back into memory (as a new object) when it
+    is accessed, and counts towards the budget again until it is evicted.
+    Other outputs (e.g. scalars or iterators) always stay in memory.
+
+    Args:
+        max_bytes: The in memory budget in bytes. As in `MemoryStore`
+            outputs are measured shallowly, i.e. without the strings held
+            by object columns.
+        directory: Directory spilled outputs are written to. Defaults to a
+            new temporary directory in `BigRaysConfig.TEMP_DIR`, removed by
+            `close()`.
+    """
+
+    def __init__(self, max_bytes, directory=None):
+        self.max_bytes = max_bytes
+        self._owns_directory = directory is None
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix='bigrays-outputs-', dir=BigRaysConfig.TEMP_DIR)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        # in memory outputs in least recently used order
+        self._memory = collections.OrderedDict()
+        self._sizes = {}
+        self._spilled = {}
+        self._memory_bytes = 0
+        self._counter = itertools.count()
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return '%s(max_bytes=%s, directory=%r)' % (
+            self.__class__.__name__, self.max_bytes, self.directory)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._memory or key in self._spilled
+
+    @property
+    def memory_bytes(self):
+        """The number of bytes of outputs currently held in memory."""
+        return self._memory_bytes
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            path = self._spilled[key]
+            _logger.debug('loading spilled output of %s', key)
+            value = load_output(path)
+            self._keep(key, value)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self.discard(key)
+            self._keep(key, value)
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._memory:
+                del self._memory[key]
+                self._memory_bytes -= self._sizes.pop(key)
+            path = self._spilled.pop(key, None)
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+    def nbytes(self, key):
+        with self._lock:
+            if key in self._memory:
+                return self._sizes[key]
+            # the size on disk, not the size once loaded
+            return os.path.getsize(self._spilled[key])
+
+    def close(self):
+        """Remove all outputs, and the spill directory if it was created by
+        this store.
+        """
+        with self._lock:
+            for key in list(self._memory) + list(self._spilled):
+                self.discard(key)
+            if self._owns_directory:
+                shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _keep(self, key, value):
+        size = output_nbytes(value, deep=False)
+        self._memory[key] = value
+        self._sizes[key] = size
+        self._memory_bytes += size
+        self._evict()
+
+    def _evict(self):
+        for key in list(self._memory):
+            if self._memory_bytes <= self.max_bytes:
+                break
+            value = self._memory[key]
+            if not (is_dataframe(value) or isinstance(value, io.BytesIO)):
+                continue
+            if key not in self._spilled:
+                name = '%s-%s' % (getattr(key, '__name__', 'output'), next(self._counter))
+                path = dump_output(value, os.path.join(self.directory, name))
+                if path is None:
+                    continue
+                _logger.info('spilled output of %s (%s bytes) to %s', key, self._sizes[key], path)
+                self._spilled[key] = path
+            del self._memory[key]
+            self._memory_bytes -= self._sizes.pop(key)
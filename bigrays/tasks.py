@@ -8,13 +8,18 @@ methods require a particular resource it should set the attribute
 `bigrays.resources.SQLSession`).
 """
 
+import atexit
 import logging
+import mmap
 import os
 
 from . import exceptions as exc
+from . import hooks
 from . import mixins
 from . import utils
+from .config import BigRaysConfig
 from .resources import S3Client, SNSClient, SQLSession
+from .store import MemoryStore, SpillStore
 
 UNSET = object()
 
@@ -22,8 +27,10 @@ UNSET = object()
 class Placeholder:
     """Useful for referencing data that is not known until Runtime, e.g. Task output."""
 
-    def __init__(self, name):
+    def __init__(self, name, task=None):
         self.name = name
+        # the task producing the value (if any), used to infer dependencies
+        self.task = task
         self._value = UNSET
 
     def __repr__(self):
@@ -44,27 +51,88 @@ class Placeholder:
         return self.value
 
 
+class _OutputPlaceholder(Placeholder):
+    """Placeholder for the output of `task`, reading the value from the
+    output store rather than holding a reference to it.
+    """
+
+    def __init__(self, task_output, task):
+        super().__init__(task.__name__, task=task)
+        self._task_output = task_output
+
+    @property
+    def value(self):
+        try:
+            return self._task_output.store.get(self.task)
+        except KeyError:
+            raise AttributeError(
+                "Tried to access an unset placeholder value on %s" % self) from None
+
+    @value.setter
+    def value(self, val):
+        self._task_output.store.set(self.task, val)
+
+
 class TaskOutput(utils.ReprMixin):
-    def __init__(self):
-        self._values = {}
+    """Descriptor exposing the output of each task, kept in an output store
+    (see `bigrays.store`). Unless `store` is given the store configured by
+    `BigRaysConfig.OUTPUT_MEMORY_LIMIT` is created when first used.
+    """
+
+    def __init__(self, store=None):
+        self._store = store
         self._placeholders = {}
 
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = _default_output_store()
+        return self._store
+
+    @store.setter
+    def store(self, store):
+        self._store = store
+
     def __get__(self, instance, owner):
         key = instance if isinstance(instance, Register) else owner
-        if not key in self._values:
+        try:
+            return self.store.get(key)
+        except KeyError:
             if not key in self._placeholders:
-                self._placeholders[key] = Placeholder(key.__name__)
+                self._placeholders[key] = _OutputPlaceholder(self, key)
             return self._placeholders[key]
-        return self._values[key]
 
     def __set__(self, instance, value):
         key = instance if isinstance(instance, Register) else instance.__class__
-        if key in self._placeholders:
-            self._placeholders[key].value = value
-        self._values[key] = value
+        self.store.set(key, value)
+
+    def release(self, key):
+        """Drop the output of task `key` so that its memory can be freed."""
+        self.store.discard(key)
+
+    def nbytes(self, key):
+        """Return the approximate size of the output of task `key`, or 0 if
+        it has none.
+        """
+        try:
+            return self.store.nbytes(key)
+        except KeyError:
+            return 0
 
 
-TASK_REGISTER = tuple()
+def _default_output_store():
+    if BigRaysConfig.OUTPUT_MEMORY_LIMIT is not None:
+        store = SpillStore(BigRaysConfig.OUTPUT_MEMORY_LIMIT)
+        # outputs may be read after a run, so the spill directory is only
+        # removed when the process exits
+        atexit.register(store.close)
+        return store
+    return MemoryStore()
+
+
+# tasks in the order they were defined, appended to (rather than rebuilt) as
+# each task is defined
+TASK_REGISTER = []
 
 class Register(type):
     """Metaclass that providing registration of subclasses of this type."""
@@ -73,7 +141,6 @@ class Register(type):
     _defined_base_task = False
 
     def __new__(metacls, name, bases, namespace):
-        global TASK_REGISTER
         cls = super(Register, metacls).__new__(metacls, name, bases, namespace)
         # this is BaseTask
         if not metacls._defined_base_task:
@@ -88,7 +155,7 @@ class Register(type):
             metacls._check_interface(name, bases, namespace)
             # this may look a bit mysterious, note that cls.register is looked
             # up on the superclass.
-            TASK_REGISTER += (cls,)
+            TASK_REGISTER.append(cls)
         return cls
 
     @staticmethod
@@ -101,6 +168,10 @@ class Register(type):
         if missing:
             raise exc.TaskInterfaceError(
                 '%s must define the attribute(s) %s' % (name, missing))
+        retries = namespace.get('retries', 0)
+        if isinstance(retries, bool) or not isinstance(retries, int) or retries < 0:
+            raise exc.TaskInterfaceError(
+                '%s.retries must be a non-negative integer, got %r' % (name, retries))
 
 
 class BaseTask(utils.ReprMixin, metaclass=Register):
@@ -114,6 +185,20 @@ class BaseTask(utils.ReprMixin, metaclass=Register):
     # config used by bigrays
     resource_config = None
     run_with_exceptions = False
+    # tasks which must complete before this task runs, in addition to those
+    # inferred from placeholder attributes (see `bigrays.graph`)
+    depends_on = ()
+    # keep the output after the last task consuming it has run, set this
+    # if the output is read after `bigrays_run()` returns (see
+    # `bigrays.liveness`)
+    keep_output = False
+    # number of times the task is run again if it raises an exception, and
+    # the seconds to wait before each retry. The resource is reopened and a
+    # new instance run, but work done by the failed attempt (e.g. rows
+    # already written by `SQLWrite`) is not undone, so only set this on
+    # tasks which are safe to run again.
+    retries = 0
+    retry_delay = 0
     input = UNSET
 
     def __call__(self):
@@ -124,6 +209,38 @@ class BaseTask(utils.ReprMixin, metaclass=Register):
     def run(self):
         raise NotImplementedError
 
+    @utils.hybridmethod
+    def additional_resources(self):
+        """Return `(resource, config)` pairs of the resources the task uses
+        besides `required_resource`, e.g. through `SQLSession.engine()`, so
+        that their configs are checked before running. A `None` config is
+        the config of the run.
+
+        Called on the task class, or on the instance created by the
+        functional interface so that attributes passed as keyword arguments
+        are taken into account.
+        """
+        return ()
+
+    def cache_fingerprint(self):
+        """Return a JSON serializable value identifying the output of this
+        task, besides its class, resource config and `input`, or `None` if
+        the output must not be cached (the default). See `bigrays.cache`.
+        """
+        return None
+
+    @classmethod
+    def release_output(cls):
+        """Drop the reference to this task's output."""
+        vars(Register)['output'].release(cls)
+
+    @classmethod
+    def output_nbytes(cls):
+        """Return the approximate size of this task's output, without
+        loading it if it was spilled to disk.
+        """
+        return vars(Register)['output'].nbytes(cls)
+
     def reformat_keywords(self):
         if self.format_kws is not None:
             return {k: v.value if isinstance(v, Placeholder) else v
@@ -143,6 +260,14 @@ class BaseTask(utils.ReprMixin, metaclass=Register):
 update_format_kws = BaseTask.update_format_kws
 
 
+def set_output_store(store):
+    """Set the `bigrays.store.OutputStore` keeping task outputs. Outputs
+    kept by the previous store are discarded, so this should be called
+    before running any tasks.
+    """
+    vars(Register)['output'].store = store
+
+
 REQUIRED_ATTRIBUTE = object()
 
 
@@ -150,6 +275,28 @@ class Task(BaseTask):
     """An extendable class for creating custom tasks."""
 
 
+class MapTask(BaseTask, mixins.MapMixin):
+    """An extendable class for fanning out work over the items of `input`.
+
+    Subclasses define `run_item(item)`, which is called for every item of
+    `input` on a pool of `max_workers` threads. The output is the list of
+    results in the order of `input`. Failing items do not stop the others,
+    once all items have run a `bigrays.exceptions.MapError` listing the
+    failed items is raised, unless `allow_failures = True` in which case the
+    failed items' results are the exceptions they raised.
+
+        >>> class ParseFiles(MapTask):
+        ...     input = ListFiles.output
+        ...     max_workers = 4
+        ...     def run_item(self, filename):
+        ...         return pd.read_csv(filename)
+    """
+    input = REQUIRED_ATTRIBUTE
+
+    def run(self):
+        return self.map(self.input)
+
+
 ###########
 # SQL stuff
 ###########
@@ -171,26 +318,164 @@ class SQLExecute(BaseTask, mixins.SQLMixin):
 
 
 class SQLQuery(BaseTask, mixins.SQLMixin):
-    """A task providing basic funtionality for retrieving SQL query results."""
+    """A task providing basic funtionality for retrieving SQL query results.
+
+    If `chunksize` is set the output is an iterator of `DataFrame`s, each
+    with at most `chunksize` rows, which `ToCSV`, `ToS3` and `SQLWrite`
+    consume incrementally. See `SQLMixin.read_query()`.
+
+    A large result set can be read over several connections at once by
+    setting `partitions`, either to a list of SQL predicates on the columns
+    of the query's result set, or to a number of ranges of
+    `partition_column` (a numeric or date column) of equal width. Up to
+    `max_connections` partitions are read concurrently and the output is
+    concatenated (or streamed if `chunksize` is set) in partition order. See
+    `SQLMixin.read_query_partitioned()`.
+
+        >>> class Sales(tasks.SQLQuery):
+        ...     query = 'select * from sales where year = {year}'
+        ...     partition_column = 'sale_date'
+        ...     partitions = 8
+
+    `fetch_engine = 'arrow'` fetches rows through Arrow arrays, and
+    `dtypes`, `categorize` and `downcast` convert the output to more compact
+    dtypes. See `SQLMixin.read_query()` and `bigrays.utils.apply_dtypes()`.
+    """
     required_resource = SQLSession
     query = REQUIRED_ATTRIBUTE
+    chunksize = None
+    partition_column = None
+    partitions = None
+    max_connections = 4
+    fetch_engine = 'pandas'
+    dtypes = None
+    categorize = None
+    downcast = False
     _dry_run = False
 
     def run(self):
         # format_kws is an argument for backwards compatability
         format_kws = self.reformat_keywords()
-        return self.read_query(self.query.format(**format_kws))
+        query = self.query.format(**format_kws)
+        options = self._read_options()
+        if self.partitions is not None:
+            return self.read_query_partitioned(
+                query, self._partition_predicates(query, format_kws),
+                max_connections=self.max_connections, chunksize=self.chunksize, **options)
+        if self.chunksize is not None:
+            return self.read_query(query, chunksize=self.chunksize, **options)
+        return self.read_query(query, **options)
+
+    def _read_options(self):
+        # only options which differ from the defaults are passed
+        options = {}
+        if self.fetch_engine != 'pandas':
+            options['fetch_engine'] = self.fetch_engine
+        for name in ('dtypes', 'categorize', 'downcast'):
+            if getattr(self, name):
+                options[name] = getattr(self, name)
+        return options
+
+    def _partition_predicates(self, query, format_kws):
+        if isinstance(self.partitions, int):
+            if self.partition_column is None:
+                raise ValueError('partition_column must be set when partitions is a number')
+            return self.partition_predicates(query, self.partition_column, self.partitions)
+        return [p.format(**format_kws) if isinstance(p, str) else p for p in self.partitions]
+
+    def cache_fingerprint(self):
+        # chunk iterators are consumed downstream and can't be cached
+        if self.chunksize is not None:
+            return None
+        fingerprint = {'query': self.query.format(**self.reformat_keywords())}
+        if self.partitions is not None:
+            # partitions determine the order of rows
+            fingerprint['partitions'] = [self.partition_column, self.partitions]
+        options = self._read_options()
+        if options:
+            fingerprint['options'] = options
+        return fingerprint
+
+
+class SQLIncrementalQuery(BaseTask, mixins.WatermarkMixin, mixins.SQLMixin):
+    """A task retrieving only the rows of a SQL query added since its
+    previous run.
+
+    The query is formatted with the format keyword `watermark`, a bound
+    parameter passing the highest value of `watermark_column` read by the
+    previous run (or `initial_watermark` on the first run), see
+    `WatermarkMixin.bind_watermark()`. See `WatermarkMixin` for when the
+    watermark is advanced.
+
+        >>> class NewEvents(tasks.SQLIncrementalQuery):
+        ...     query = 'select * from events where id > {watermark}'
+        ...     watermark_column = 'id'
+        ...     initial_watermark = 0
+
+    `chunksize`, `fetch_engine`, `dtypes`, `categorize` and `downcast` are
+    as for `SQLQuery`. The output is never cached.
+    """
+    required_resource = SQLSession
+    query = REQUIRED_ATTRIBUTE
+    watermark_column = REQUIRED_ATTRIBUTE
+    chunksize = None
+    fetch_engine = 'pandas'
+    dtypes = None
+    categorize = None
+    downcast = False
+
+    def run(self):
+        query = self.bind_watermark(self.query.format(**self.reformat_keywords()))
+        output = self.read_query(query, chunksize=self.chunksize, fetch_engine=self.fetch_engine,
+                                 dtypes=self.dtypes, categorize=self.categorize,
+                                 downcast=self.downcast)
+        return self.track_watermark(output)
+
+    def reformat_keywords(self):
+        format_kws = super().reformat_keywords()
+        format_kws['watermark'] = ':' + self.watermark_param
+        return format_kws
 
 
 class SQLWrite(BaseTask, mixins.SQLMixin):
-    """A task providing basic functionality for writing a table to a DB."""
+    """A task providing basic functionality for writing a table to a DB.
+
+    `write_engine` selects how rows are inserted, see `SQLMixin.write()`.
+    """
     required_resource = SQLSession
     tablename = REQUIRED_ATTRIBUTE
     input = REQUIRED_ATTRIBUTE
     params = {'index': False}
+    write_engine = 'multi_values'
+
+    def run(self):
+        return self.write(self.tablename, self.input,
+                          write_engine=self.write_engine, **self.params)
+
+
+class SQLUpsert(BaseTask, mixins.SQLMixin):
+    """A task inserting `input` into an existing table, updating the rows
+    whose `keys` columns match a row of `input` instead.
+
+    `input` is bulk loaded into a staging table and merged into the table
+    with a single statement in one transaction, see `SQLMixin.upsert()`.
+    The output is a dict with the number of rows 'inserted' and 'updated'.
+
+        >>> class SyncCustomers(tasks.SQLUpsert):
+        ...     input = ExtractCustomers.output
+        ...     tablename = 'customers'
+        ...     keys = ['customer_id']
+    """
+    required_resource = SQLSession
+    tablename = REQUIRED_ATTRIBUTE
+    input = REQUIRED_ATTRIBUTE
+    keys = REQUIRED_ATTRIBUTE
+    schema = None
+    write_engine = 'multi_values'
 
     def run(self):
-        return self.write(self.tablename, self.input, **self.params)
+        return self.upsert(self.tablename, self.input, self.keys,
+                           write_engine=self.write_engine, schema=self.schema)
 
 
 ##########
@@ -218,29 +503,153 @@ class ToS3(BaseTask, mixins.S3Mixin):
 
 
 class FromS3(BaseTask, mixins.S3Mixin):
+    """Task downloading an object from S3.
+
+    By default the object is downloaded into memory and the output is an
+    `io.BytesIO`. For objects too large to hold in memory
+
+    - `filename` (formatted with `format_kws`) downloads the object to that
+        path, or `spill_to_disk = True` to an anonymous temporary file,
+        and the output is the opened file.
+    - `memory_map = True` additionally memory maps the downloaded file and the
+        output is a read-only `mmap.mmap`.
+    - `read_as = 'csv'` or `'parquet'` downloads to disk and parses the file
+        lazily, the output is an iterator of `DataFrame`s with at most
+        `chunksize` rows each. `read_kws` are passed to the parser.
+    """
     required_resource = S3Client
     bucket = REQUIRED_ATTRIBUTE
     key = REQUIRED_ATTRIBUTE
+    filename = None
+    spill_to_disk = False
+    memory_map = False
+    read_as = None
+    chunksize = 100000
+    read_kws = {}
 
     def run(self):
         format_kws = self.reformat_keywords()
         bucket = self.bucket.format(**format_kws)
         key = self.key.format(**format_kws)
-        return self.download(bucket, key)
+        filename = None if self.filename is None else self.filename.format(**format_kws)
+        if filename is None and not (self.spill_to_disk or self.memory_map or self.read_as):
+            return self.download(bucket, key)
+        file = self.download_to_file(bucket, key, filename)
+        if self.read_as is not None:
+            return mixins.read_file_chunks(file, self.read_as, self.chunksize, **self.read_kws)
+        if self.memory_map:
+            with file:
+                # the map remains valid after the file is closed (and in the
+                # case of a temporary file, deleted)
+                return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return file
+
+    def cache_fingerprint(self):
+        # only objects downloaded into memory are cached
+        if self.filename is not None or self.spill_to_disk or self.memory_map or self.read_as:
+            return None
+        format_kws = self.reformat_keywords()
+        return {'bucket': self.bucket.format(**format_kws),
+                'key': self.key.format(**format_kws)}
+
+
+class FromS3Map(BaseTask, mixins.MapMixin, mixins.S3Mixin):
+    """Task downloading the objects for every key in `input` concurrently.
+
+    `input` is typically the output of `ListS3Objects` (keys or metadata
+    dicts). The output is a list, in the order of `input`, of `io.BytesIO`
+    objects or, if `read_as` is 'csv' or 'parquet', `DataFrame`s parsed
+    with `read_kws`. See `MapTask` for concurrency and error handling.
+    """
+    required_resource = S3Client
+    input = REQUIRED_ATTRIBUTE
+    bucket = REQUIRED_ATTRIBUTE
+    read_as = None
+    read_kws = {}
+
+    def run(self):
+        return self.map(self.input)
+
+    def run_item(self, item):
+        format_kws = self.reformat_keywords()
+        bucket = self.bucket.format(**format_kws)
+        key = item['Key'] if isinstance(item, dict) else item
+        stream = self.download(bucket, key)
+        if self.read_as is not None:
+            return mixins.read_file(stream, self.read_as, **self.read_kws)
+        return stream
 
 
 class ListS3Objects(BaseTask, mixins.S3Mixin):
+    """Task listing the keys of the objects in an S3 bucket.
+
+    Results are filtered by `prefix`, `suffix`, `modified_since`, `min_size`
+    and `max_size` while being paginated. With `include_metadata = True` the
+    output contains a dict of 'Key', 'Size', 'ETag' and 'LastModified' per
+    object, and with `lazy = True` the output is an iterator fetching pages
+    as it is consumed. See `S3Mixin.list_objects()`.
+    """
     required_resource = S3Client
     bucket = REQUIRED_ATTRIBUTE
     prefix = None
     suffix = None
+    modified_since = None
+    min_size = None
+    max_size = None
+    include_metadata = False
+    lazy = False
 
     def run(self):
         format_kws = self.reformat_keywords()
         bucket = self.bucket.format(**format_kws)
         prefix = None if self.prefix is None else self.prefix.format(**format_kws)
         suffix = None if self.suffix is None else self.suffix.format(**format_kws)
-        return self.list_objects(bucket, prefix, suffix)
+        return self.list_objects(bucket, prefix, suffix,
+                                 modified_since=self.modified_since,
+                                 min_size=self.min_size,
+                                 max_size=self.max_size,
+                                 metadata=self.include_metadata,
+                                 lazy=self.lazy)
+
+
+class SQLToS3(BaseTask, mixins.SQLMixin, mixins.S3Mixin):
+    """Task streaming the result set of a SQL query to S3 without holding the
+    full result set in memory.
+
+    The result set is fetched in chunks of `chunksize` rows, encoded as
+    `format` ('csv', 'csv.gz' or 'parquet') and uploaded with an S3 multipart
+    upload in parts of `part_size` bytes as it is encoded.
+
+    `query`, `bucket` and `key` are formatted with `format_kws`. S3 is the
+    task's `required_resource`, the query runs on a connection from the
+    engine configured by `sql_config` (defaults to `BigRaysConfig`).
+    """
+    required_resource = S3Client
+    query = REQUIRED_ATTRIBUTE
+    bucket = REQUIRED_ATTRIBUTE
+    key = REQUIRED_ATTRIBUTE
+    format = 'csv'
+    chunksize = 100000
+    part_size = None
+    sql_config = None
+    overwrite_if_exists = False
+
+    @utils.hybridmethod
+    def additional_resources(self):
+        return [(SQLSession, self.sql_config)]
+
+    def run(self):
+        format_kws = self.reformat_keywords()
+        query = self.query.format(**format_kws)
+        bucket = self.bucket.format(**format_kws)
+        key = self.key.format(**format_kws)
+        sql_config = BigRaysConfig if self.sql_config is None else self.sql_config
+        self._logger.debug('running query: %s', query)
+        engine = SQLSession.engine(sql_config)
+        # an empty result set is read as an empty frame with the columns of
+        # the query, and uploaded as a file rather than an empty object
+        chunks = self._read_query_chunks(query, engine, self.chunksize)
+        self.upload_chunks(chunks, bucket, key, format=self.format, part_size=self.part_size)
 
 
 class SNSTask(BaseTask, mixins.SNSMixin):
@@ -282,9 +691,22 @@ class ToCSV(BaseTask):
         file = self.filename.format(**format_kws)
         if os.path.exists(file) and not self.overwrite_if_exists:
             raise exc.TaskError('the file %s exists on disk' % file)
+        if utils.is_chunked(self.input):
+            return self._write_chunks(file)
         self.logger.debug('writing %s rows to %s' % (len(self.input), file))
         self.input.to_csv(file, **self.params)
 
+    def _write_chunks(self, file):
+        rows = 0
+        for i, chunk in enumerate(self.input):
+            params = dict(self.params, mode='w' if i == 0 else 'a')
+            if i > 0:
+                params['header'] = False
+            chunk.to_csv(file, **params)
+            rows += len(chunk)
+            hooks.emit('chunk_processed', 'to_csv', len(chunk))
+        self.logger.debug('wrote %s rows to %s' % (rows, file))
+
 
 ###############
 # compatability
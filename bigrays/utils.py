@@ -1,6 +1,52 @@
+import collections.abc
 import io
+import sys
+import types
 
-import pandas as pd
+
+def import_pandas():
+    """Import and return `pandas`.
+
+    pandas (like boto3 and sqlalchemy) is imported when first needed rather
+    than when `bigrays` is imported, to keep start up fast.
+    """
+    import pandas as pd
+    if not getattr(import_pandas, '_configured', False):
+        pd.set_option('precision', 15)
+        import_pandas._configured = True
+    return pd
+
+
+def is_dataframe(obj):
+    """Return `True` if `obj` is a `pandas.DataFrame`, without importing
+    pandas (if pandas hasn't been imported `obj` can't be a `DataFrame`).
+    """
+    pd = sys.modules.get('pandas')
+    return pd is not None and isinstance(obj, pd.DataFrame)
+
+
+class classproperty:
+    """Decorator for a class attribute computed by `fget(cls)` each time it is
+    accessed.
+    """
+
+    def __init__(self, fget):
+        self.fget = fget
+
+    def __get__(self, instance, owner):
+        return self.fget(owner)
+
+
+class hybridmethod:
+    """Decorator for a method bound to the instance it is accessed on, or
+    to the class when accessed on the class (like a `classmethod`).
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def __get__(self, instance, owner):
+        return types.MethodType(self.func, owner if instance is None else instance)
 
 
 def _public_attrs(obj):
@@ -22,7 +68,7 @@ class ReprMixin:
 
 def _obj_to_byte_stream(obj):
     stream = io.BytesIO()
-    if isinstance(obj, pd.DataFrame):
+    if is_dataframe(obj):
         stream.write(obj.to_csv(index=False).encode())
     elif isinstance(obj, str):
         stream.write(obj.encode())
@@ -32,3 +78,98 @@ def _obj_to_byte_stream(obj):
         raise ValueError(f'unrecognized data type {type(obj)}')
     stream.seek(0)
     return stream
+
+
+def is_chunked(obj):
+    """Return `True` if `obj` is an iterator of chunks, e.g. the `DataFrame`s
+    yielded by `SQLQuery` when `chunksize` is set, rather than a single
+    object. File-like objects are not considered chunked.
+    """
+    return (isinstance(obj, collections.abc.Iterator)
+            and not isinstance(obj, io.IOBase))
+
+
+def output_nbytes(obj, deep=True):
+    """Return the approximate number of bytes of memory held by `obj`.
+
+    With `deep=False` the strings held by object columns of a `DataFrame`
+    are not measured, which is much faster for large string columns.
+    """
+    if is_dataframe(obj):
+        return int(obj.memory_usage(index=False, deep=deep).sum()
+                   + obj.index.memory_usage(deep=deep))
+    if isinstance(obj, io.BytesIO):
+        return obj.getbuffer().nbytes
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj)
+    return sys.getsizeof(obj)
+
+
+def apply_dtypes(df, dtypes=None, categorize=None, downcast=False):
+    """Convert the columns of `df` to more compact dtypes, in place, and
+    return it.
+
+    Args:
+        dtypes: Mapping of column names to the dtype they are converted to
+            (e.g. 'category', 'int32' or 'float32'). Other arguments don't
+            apply to these columns.
+        categorize: Convert string (object) columns with at most this
+            fraction of distinct values (e.g. 0.5) to 'category'.
+        downcast: Convert integer columns to the smallest integer dtype
+            holding their values.
+    """
+    dtypes = dtypes or {}
+    pd = import_pandas()
+    for column in df.columns:
+        if column in dtypes:
+            continue
+        values = df[column]
+        if categorize is not None and values.dtype == object and len(values):
+            if values.nunique() <= categorize * len(values):
+                df[column] = values.astype('category')
+        elif downcast and pd.api.types.is_integer_dtype(values.dtype):
+            df[column] = pd.to_numeric(values, downcast='integer')
+    if dtypes:
+        for column, dtype in dtypes.items():
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def max_rss_bytes():
+    """Return the peak resident set size of the process, or `None` if it
+    cannot be determined on this platform.
+    """
+    try:
+        import resource
+    except ImportError:  # e.g. on Windows
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS and kilobytes on Linux
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class IterStream(io.RawIOBase):
+    """Read-only file-like object reading from an iterable of `bytes`.
+
+    Only a single item of `iterable` is held in memory at a time, which
+    allows passing a stream of data to APIs expecting a file, e.g.
+    `boto3.client('s3').upload_fileobj()`.
+    """
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self._buffer = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = memoryview(next(self._iterator))
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
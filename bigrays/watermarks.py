@@ -0,0 +1,270 @@
+"""Module persisting the watermarks of incremental tasks.
+
+A watermark is the highest value of a column (e.g. a timestamp or an
+increasing id) an incremental task such as `bigrays.tasks.SQLIncrementalQuery`
+has read. The next run only reads rows beyond it. Watermarks are kept in a
+`WatermarkStore`, either a JSON file (`FileWatermarkStore`) or a database
+table (`SQLWatermarkStore`).
+
+A task records the watermark it reached as pending. Pending watermarks are
+committed by `BigRays.run()` once the run finishes, and only for tasks which
+succeeded along with every task depending on them, directly or not. A
+pending watermark is checkpointed with the task's output, so that it is
+committed by `BigRays.resume()` if the task's output is restored. The
+watermarks committed to a store are written together, so either all of them
+advance or none do. If a downstream task fails the watermark is not
+advanced and the next run reads the same rows again.
+"""
+
+import datetime
+import decimal
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from .config import BigRaysConfig
+from .exceptions import ConfigurationError
+from .graph import TaskGraph
+from .resources import SQLSession
+from .utils import ReprMixin
+
+_logger = logging.getLogger(__name__)
+
+# attribute of the task class holding its pending watermark
+_PENDING = '_pending_watermark'
+
+
+class WatermarkStore(ReprMixin):
+    """Base class for stores of watermarks keyed by name."""
+
+    def get(self, name):
+        """Return the watermark stored under `name`, or `None`."""
+        raise NotImplementedError
+
+    def update(self, watermarks):
+        """Store the mapping of names to values `watermarks` atomically."""
+        raise NotImplementedError
+
+
+class FileWatermarkStore(WatermarkStore):
+    """Watermarks stored in the JSON file at `path`.
+
+    The file is replaced atomically on every update, so a crash never leaves
+    it partially written.
+    """
+    _locks = {}
+    _locks_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.path)
+
+    @property
+    def _lock(self):
+        with self._locks_lock:
+            return self._locks.setdefault(os.path.abspath(self.path), threading.Lock())
+
+    def get(self, name):
+        with self._lock:
+            record = self._read().get(name)
+        return None if record is None else load_value(record)
+
+    def update(self, watermarks):
+        with self._lock:
+            records = self._read()
+            records.update({name: dump_value(value) for name, value in watermarks.items()})
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(records, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+
+class SQLWatermarkStore(WatermarkStore):
+    """Watermarks stored in the table `table` of the database `config`
+    (defaulting to `BigRaysConfig`) connects `SQLSession` to. The table is
+    created if it does not exist, and updated in a single transaction.
+    """
+
+    def __init__(self, table='bigrays_watermarks', config=None):
+        self.table = table
+        self.config = config
+        # the `sqlalchemy.Table`, built and created in the database once
+        self._sa_table = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.table)
+
+    def get(self, name):
+        table, engine = self._table()
+        with engine.connect() as connection:
+            row = connection.execute(
+                table.select().where(table.c.name == name)).fetchone()
+        return None if row is None else load_value(json.loads(row['value']))
+
+    def update(self, watermarks):
+        table, engine = self._table()
+        with engine.begin() as connection:
+            connection.execute(table.delete().where(table.c.name.in_(list(watermarks))))
+            connection.execute(table.insert(), [
+                {'name': name, 'value': json.dumps(dump_value(value)),
+                 'updated_at': datetime.datetime.utcnow()}
+                for name, value in watermarks.items()])
+
+    def _table(self):
+        engine = SQLSession.engine(BigRaysConfig if self.config is None else self.config)
+        with self._lock:
+            if self._sa_table is None:
+                import sqlalchemy as sa
+                table = sa.Table(self.table, sa.MetaData(),
+                                 sa.Column('name', sa.String(255), primary_key=True),
+                                 sa.Column('value', sa.String(255), nullable=False),
+                                 sa.Column('updated_at', sa.DateTime))
+                table.create(engine, checkfirst=True)
+                self._sa_table = table
+        return self._sa_table, engine
+
+
+_default_stores = {}
+
+
+def default_store():
+    """Return the `FileWatermarkStore` at `BigRaysConfig.WATERMARK_FILE`.
+
+    Raises:
+        `bigrays.exceptions.ConfigurationError`: If `WATERMARK_FILE` is not
+            set.
+    """
+    path = getattr(BigRaysConfig, 'WATERMARK_FILE', None)
+    if path is None:
+        raise ConfigurationError(
+            'incremental tasks require a watermark store, set `watermark_store` '
+            'on the task or the environment variable BIGRAYS_WATERMARK_FILE.')
+    # shared so that watermarks of several tasks are committed together
+    return _default_stores.setdefault(path, FileWatermarkStore(path))
+
+
+def to_python(value):
+    """Return the watermark `value` (e.g. a `pandas.Timestamp` or a numpy
+    scalar) as the equivalent built-in Python value.
+    """
+    if hasattr(value, 'to_pydatetime'):  # pandas.Timestamp
+        return value.to_pydatetime()
+    if hasattr(value, 'item'):  # numpy scalars
+        return value.item()
+    return value
+
+
+def name_of(task):
+    """Return the name the watermark of `task` is stored under, its
+    `watermark_name` or else its qualified name.
+    """
+    return getattr(task, 'watermark_name', None) or f'{task.__module__}.{task.__qualname__}'
+
+
+def store_of(task):
+    """Return the `WatermarkStore` of `task`, its `watermark_store` or else
+    `default_store()`.
+    """
+    store = getattr(task, 'watermark_store', None)
+    return default_store() if store is None else store
+
+
+def dump_value(value):
+    """Return a JSON serializable record of the watermark `value`."""
+    value = to_python(value)
+    if isinstance(value, datetime.datetime):
+        return {'type': 'datetime', 'value': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'type': 'date', 'value': value.isoformat()}
+    if isinstance(value, decimal.Decimal):
+        return {'type': 'decimal', 'value': str(value)}
+    if isinstance(value, (int, float, str)):
+        return {'type': type(value).__name__, 'value': value}
+    raise TypeError('unsupported watermark type %s' % type(value).__name__)
+
+
+def load_value(record):
+    """Return the watermark recorded by `dump_value()`."""
+    type_, value = record['type'], record['value']
+    if type_ == 'datetime':
+        # fromisoformat() is not available in python 3.6, and its %z
+        # doesn't accept the colon of the UTC offset of aware datetimes
+        fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S'
+        if len(value) > 19 and value[-6] in '+-' and value[-3] == ':':
+            value = value[:-3] + value[-2:]
+            fmt += '%z'
+        return datetime.datetime.strptime(value, fmt)
+    if type_ == 'date':
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    if type_ == 'decimal':
+        return decimal.Decimal(value)
+    return value
+
+
+def set_pending(task, value):
+    """Record `value` as the watermark `task` reached in the current run."""
+    setattr(task, _PENDING, value)
+
+
+def get_pending(task):
+    """Return the watermark `task` reached in the current run, or `None`."""
+    return vars(task).get(_PENDING)
+
+
+def commit_pending(tasks, succeeded):
+    """Commit the pending watermarks of `tasks` which succeeded along with
+    all of their (transitive) dependants in `tasks`, and discard the rest.
+
+    Args:
+        tasks: The tasks of the run.
+        succeeded: The set of tasks which succeeded.
+
+    Returns:
+        The list of tasks whose watermark was committed.
+    """
+    pending = [task for task in tasks if get_pending(task) is not None]
+    if not pending:
+        return []
+    graph = TaskGraph(tasks)
+    by_store = {}
+    for task in pending:
+        value = vars(task)[_PENDING]
+        delattr(task, _PENDING)
+        failed = [t for t in _with_dependants(graph, task) if t not in succeeded]
+        if failed:
+            _logger.warning('not advancing the watermark of %s since %s did not succeed',
+                            task, failed)
+            continue
+        store = store_of(task)
+        by_store.setdefault(id(store), (store, {}))[1][task] = value
+    committed = []
+    for store, watermarks in by_store.values():
+        store.update({name_of(task): value for task, value in watermarks.items()})
+        for task, value in watermarks.items():
+            _logger.info('advanced the watermark of %s to %s', task, value)
+        committed.extend(watermarks)
+    return committed
+
+
+def _with_dependants(graph, task):
+    found, seen, stack = [task], {task}, [task]
+    while stack:
+        for dependant in graph.dependants(stack.pop()):
+            if dependant not in seen:
+                seen.add(dependant)
+                found.append(dependant)
+                stack.append(dependant)
+    return found
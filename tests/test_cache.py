@@ -0,0 +1,150 @@
+import io
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from bigrays.cache import OutputCache, fingerprint_value
+from bigrays.exceptions import ConfigurationError
+from bigrays.resources import ResourceManager
+from bigrays.run import BigRays, RunContext
+from bigrays import tasks
+
+
+class TestOutputCache(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.cache = OutputCache(self._tmp.name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_round_trip(self):
+        df = pd.DataFrame({'a': [1, 2], 'b': ['x', 'y']})
+        outputs = {'df': df, 'stream': io.BytesIO(b'foo'), 'obj': {'a': [1]}}
+        for key, output in outputs.items():
+            self.cache.put(key, output)
+        pd.testing.assert_frame_equal(self.cache.get('df')[1], df)
+        self.assertEqual(self.cache.get('stream')[1].read(), b'foo')
+        self.assertEqual(self.cache.get('obj'), (True, {'a': [1]}))
+        self.assertEqual(self.cache.get('missing'), (False, None))
+        self.assertEqual(self.cache.stats.as_dict(), {'hits': 3, 'misses': 1, 'stores': 3})
+
+    def test_uncacheable_outputs_are_ignored(self):
+        self.cache.put('iterator', iter([1, 2]))
+        with tempfile.TemporaryFile() as f:
+            self.cache.put('file', f)
+        self.assertEqual(os.listdir(self._tmp.name), [])
+
+    def test_ttl(self):
+        self.cache.ttl = 60
+        self.cache.put('key', 1)
+        self.assertEqual(self.cache.get('key'), (True, 1))
+        with mock.patch('bigrays.cache.time.time', return_value=time.time() + 120):
+            self.assertEqual(self.cache.get('key'), (False, None))
+        self.assertEqual(os.listdir(self._tmp.name), [])
+
+    def test_lru_eviction(self):
+        self.cache.put('a', b'x' * 1000)
+        self.cache.put('b', b'x' * 1000)
+        size = sum(os.path.getsize(os.path.join(self._tmp.name, f))
+                   for f in os.listdir(self._tmp.name))
+        # make "b" the least recently used
+        path = self.cache._find('b')
+        os.utime(path, (time.time() - 100, time.time() - 100))
+        self.cache.get('a')
+        self.cache.max_bytes = size
+        self.cache.put('c', b'x' * 1000)
+        self.assertEqual(self.cache.get('a')[0], True)
+        self.assertEqual(self.cache.get('b')[0], False)
+        self.assertEqual(self.cache.get('c')[0], True)
+
+    def test_default_directory(self):
+        with mock.patch('bigrays.cache.os.path.expanduser', return_value=self._tmp.name):
+            cache = OutputCache()
+        self.assertEqual(cache.directory, os.path.join(self._tmp.name, '.cache', 'bigrays'))
+        self.assertEqual(os.stat(cache.directory).st_mode & 0o777, 0o700)
+
+    @unittest.skipUnless(hasattr(os, 'getuid'), 'requires os.getuid()')
+    def test_shared_directory(self):
+        os.chmod(self._tmp.name, 0o777)
+        with self.assertRaisesRegex(ConfigurationError, 'not writable by others'):
+            OutputCache(self._tmp.name)
+        # entries planted by other users are not loaded
+        os.chmod(self._tmp.name, 0o700)
+        self.cache.put('key', 1)
+        os.chmod(self.cache._find('key'), 0o666)
+        with self.assertRaises(ConfigurationError):
+            self.cache.get('key')
+
+    def test_fingerprint_value(self):
+        df = pd.DataFrame({'a': [1, 2]})
+        self.assertEqual(fingerprint_value(df), fingerprint_value(df.copy()))
+        self.assertNotEqual(fingerprint_value(df), fingerprint_value(df + 1))
+        self.assertEqual(fingerprint_value(b'foo'), fingerprint_value(io.BytesIO(b'foo')))
+        self.assertIsNone(fingerprint_value(iter([])))
+
+
+class TestBigRaysCache(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.cache = OutputCache(self._tmp.name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_cache_hits_skip_tasks(self):
+        calls = []
+        class A(tasks.Task):
+            format_kws = {'n': 1}
+            def run(self):
+                calls.append(self.reformat_keywords()['n'])
+                return pd.DataFrame({'n': [self.reformat_keywords()['n']]})
+            def cache_fingerprint(self):
+                return self.reformat_keywords()
+        class B(tasks.Task):
+            input = A.output
+            def run(self):
+                calls.append('B')
+                return self.input.n.sum()
+            def cache_fingerprint(self):
+                return 'B'
+        resource_manager = ResourceManager(None)
+        BigRays._run_tasks([A, B], resource_manager, RunContext(cache=self.cache))
+        BigRays._run_tasks([A, B], resource_manager, RunContext(cache=self.cache))
+        self.assertEqual(calls, [1, 'B'])
+        self.assertEqual(B.output, 1)
+        # changing the rendered keywords (and therefore B's input) invalidates both
+        A.update_format_kws(n=2)
+        BigRays._run_tasks([A, B], resource_manager, RunContext(cache=self.cache))
+        self.assertEqual(calls, [1, 'B', 2, 'B'])
+        self.assertEqual(B.output, 2)
+        self.assertEqual(self.cache.stats.as_dict(), {'hits': 2, 'misses': 4, 'stores': 4})
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_tasks_are_not_cached_by_default(self):
+        calls = []
+        class A(tasks.Task):
+            def run(self):
+                calls.append(1)
+        BigRays._run_tasks([A], ResourceManager(None), RunContext(cache=self.cache))
+        BigRays._run_tasks([A], ResourceManager(None), RunContext(cache=self.cache))
+        self.assertEqual(calls, [1, 1])
+        self.assertEqual(self.cache.stats.as_dict(), {'hits': 0, 'misses': 0, 'stores': 0})
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_sql_query_fingerprint(self):
+        class Query(tasks.SQLQuery):
+            query = 'select {n}'
+            format_kws = {'n': 1}
+        self.assertEqual(Query().cache_fingerprint(), {'query': 'select 1'})
+        Query.chunksize = 10
+        self.assertIsNone(Query().cache_fingerprint())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from bigrays.checkpoint import Checkpoint
+from bigrays.exceptions import ConfigurationError
+from bigrays.run import BigRays
+from bigrays import tasks
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.run_dir = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_record_and_load(self):
+        class A(tasks.Task):
+            pass
+        class B(tasks.Task):
+            pass
+        df = pd.DataFrame({'a': [1, 2]})
+        checkpoint = Checkpoint(self.run_dir)
+        self.assertTrue(checkpoint.record_success(A, df))
+        checkpoint.record_failure(B)
+        # statuses are persisted
+        checkpoint = Checkpoint(self.run_dir)
+        self.assertTrue(checkpoint.succeeded(A))
+        self.assertFalse(checkpoint.succeeded(B))
+        pd.testing.assert_frame_equal(checkpoint.load(A), df)
+        self.assertEqual(checkpoint.statuses(), {Checkpoint.task_id(A): 'succeeded',
+                                                 Checkpoint.task_id(B): 'failed'})
+        checkpoint.clear()
+        self.assertEqual(checkpoint.statuses(), {})
+        self.assertEqual(os.listdir(self.run_dir), ['status.json'])
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_unstorable_outputs_are_not_recorded(self):
+        class A(tasks.Task):
+            pass
+        checkpoint = Checkpoint(self.run_dir)
+        self.assertFalse(checkpoint.record_success(A, iter([])))
+        self.assertFalse(checkpoint.succeeded(A))
+
+    @unittest.skipUnless(hasattr(os, 'getuid'), 'requires os.getuid()')
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_shared_directory(self):
+        class A(tasks.Task):
+            pass
+        checkpoint = Checkpoint(self.run_dir)
+        checkpoint.record_success(A, {'a': 1})
+        os.chmod(self.run_dir, 0o777)
+        with self.assertRaisesRegex(ConfigurationError, 'not writable by others'):
+            Checkpoint(self.run_dir)
+        with self.assertRaisesRegex(ConfigurationError, 'not writable by others'):
+            BigRays.resume(self.run_dir, A)
+        # outputs planted by other users are not loaded
+        os.chmod(self.run_dir, 0o700)
+        output, = [name for name in os.listdir(self.run_dir) if name.endswith('.pkl')]
+        os.chmod(os.path.join(self.run_dir, output), 0o666)
+        with self.assertRaises(ConfigurationError):
+            Checkpoint(self.run_dir).load(A)
+
+    @mock.patch('bigrays.run.BigRaysConfig', None)
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_resume(self):
+        ran = []
+        fail = [True]
+        class A(tasks.Task):
+            def run(self):
+                ran.append('A')
+                return pd.DataFrame({'a': [1, 2]})
+        class B(tasks.Task):
+            input = A.output
+            def run(self):
+                ran.append('B')
+                if fail[0]:
+                    raise Exception('testing error')
+                return self.input.a.sum()
+        class C(tasks.Task):
+            input = B.output
+            def run(self):
+                ran.append('C')
+                return self.input * 2
+        with self.assertRaisesRegex(Exception, 'exceptions occurred while running tasks'):
+            BigRays.run(A, B, C, checkpoint_dir=self.run_dir)
+        self.assertEqual(ran, ['A', 'B'])
+        # simulate a new process, where A's output is unset
+        A.output = None
+        fail[0] = False
+        BigRays.resume(self.run_dir, A, B, C)
+        self.assertEqual(ran, ['A', 'B', 'B', 'C'])
+        self.assertEqual(C.output, 6)
+        self.assertEqual(set(Checkpoint(self.run_dir).statuses().values()), {'succeeded'})
+        # nothing is left to run
+        BigRays.resume(self.run_dir, A, B, C)
+        self.assertEqual(ran, ['A', 'B', 'B', 'C'])
+        # a new run clears the checkpoint
+        BigRays.run(A, B, C, checkpoint_dir=self.run_dir)
+        self.assertEqual(ran, ['A', 'B', 'B', 'C', 'A', 'B', 'C'])
+
+
+if __name__ == '__main__':
+    unittest.main()
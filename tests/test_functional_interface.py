@@ -1,7 +1,13 @@
+import types
 import unittest
+from unittest import mock
 
+import bigrays
+from bigrays.exceptions import ConfigurationError
+from bigrays.resources import BaseResource, SQLSession
 from bigrays.tasks import Task, REQUIRED_ATTRIBUTE
 from bigrays import functional_interface as fns
+from bigrays import tasks
 
 
 class Test(unittest.TestCase):
@@ -11,15 +17,24 @@ class Test(unittest.TestCase):
                 return self.a ** self.b
         wrapped_task = fns.wrap_task('MyA', A)
         self.assertEqual(wrapped_task(a=2, b=3), 8)
+        self.assertEqual(wrapped_task.__name__, 'MyA')
 
-    def test__create_subtask(self):
+    def test__create_task(self):
         class A(Task):
             pass
-        sub_task = fns._create_subtask('SubclassedA', A, a=1, b=2, c='c')
-        self.assertTrue(issubclass(sub_task, A))
-        self.assertEqual(sub_task.a, 1)
-        self.assertEqual(sub_task.b, 2)
-        self.assertEqual(sub_task.c, 'c')
+        task = fns._create_task('a', A, a=1, b=2, c='c')
+        self.assertIs(type(task), A)
+        self.assertEqual(task.a, 1)
+        self.assertEqual(task.b, 2)
+        self.assertEqual(task.c, 'c')
+
+    def test_placeholders_are_resolved(self):
+        class A(Task):
+            pass
+        A.output = 5
+        task = fns._create_task('a', Task, input=A.output, format_kws={'a': A.output})
+        self.assertEqual(task.input, 5)
+        self.assertEqual(task.reformat_keywords(), {'a': 5})
 
     def test_required_attributes(self):
         class A(Task):
@@ -28,6 +43,63 @@ class Test(unittest.TestCase):
         with self.assertRaisesRegex(ValueError, 'All required attributes'):
             wrapped_task()
 
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_calls_dont_register_tasks(self):
+        class A(Task):
+            def run(self):
+                return self.a
+        wrapped_task = fns.wrap_task('a', A)
+        registered = list(tasks.TASK_REGISTER)
+        for i in range(100):
+            self.assertEqual(wrapped_task(a=i), i)
+        self.assertEqual(tasks.TASK_REGISTER, registered)
+
+
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        opened = self.opened = []
+        class Resource(BaseResource):
+            @classmethod
+            def _open(cls, config):
+                opened.append(config)
+                return len(opened)
+        class A(Task):
+            required_resource = Resource
+            def run(self):
+                return Resource.resource()
+        self.wrapped_task = fns.wrap_task('a', A)
+
+    def test_without_session(self):
+        self.assertEqual([self.wrapped_task(), self.wrapped_task()], [1, 2])
+
+    def test_session_keeps_resources_open(self):
+        config = object()
+        with bigrays.session(config) as session:
+            self.assertEqual([self.wrapped_task(), self.wrapped_task()], [1, 1])
+        self.assertEqual(self.opened, [config])
+        self.assertEqual(list(session.stats.as_dict().values()), [{'opens': 1, 'reuses': 1}])
+        self.assertEqual(self.wrapped_task(), 2)
+
+    def test_keyword_configs_are_checked(self):
+        class Extra(BaseResource):
+            required_configs = ['FOO']
+        class B(Task):
+            extra_config = None
+            @bigrays.utils.hybridmethod
+            def additional_resources(self):
+                return [(Extra, self.extra_config)]
+            def run(self):
+                return 1
+        wrapped_task = fns.wrap_task('b', B)
+        with self.assertRaisesRegex(ConfigurationError, 'FOO'):
+            wrapped_task(extra_config=types.SimpleNamespace(FOO=None))
+        self.assertEqual(wrapped_task(extra_config=types.SimpleNamespace(FOO=1)), 1)
+        config = object()
+        task = fns._create_task('sql_to_s3', tasks.SQLToS3, query='', bucket='', key='',
+                                sql_config=config)
+        self.assertEqual(task.additional_resources(), [(SQLSession, config)])
+        self.assertEqual(tasks.SQLToS3.additional_resources(), [(SQLSession, None)])
+
 
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,141 @@
+import unittest
+from unittest import mock
+
+from bigrays.exceptions import TaskError
+from bigrays.graph import TaskGraph, TaskScheduler, count_resource_opens, task_dependencies
+from bigrays.tasks import Task
+
+
+class TestTaskGraph(unittest.TestCase):
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_dependencies(self):
+        class A(Task): pass
+        class B(Task): pass
+        class C(Task):
+            input = A.output
+        class D(Task):
+            format_kws = {'foo': B.output}
+        class E(Task):
+            depends_on = (C,)
+        class F(Task):
+            run_with_exceptions = True
+        graph = TaskGraph([A, B, C, D, E, F])
+        self.assertEqual(graph.dependencies[A], set())
+        self.assertEqual(graph.dependencies[B], set())
+        self.assertEqual(graph.dependencies[C], {A})
+        self.assertEqual(graph.dependencies[D], {B})
+        self.assertEqual(graph.dependencies[E], {C})
+        self.assertEqual(graph.dependencies[F], {A, B, C, D, E})
+        self.assertEqual(graph.dependants(A), [C, F])
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_run_with_exceptions_barriers(self):
+        class A(Task): pass
+        class B(Task):
+            run_with_exceptions = True
+        class C(Task): pass
+        class D(Task):
+            run_with_exceptions = True
+        graph = TaskGraph([A, B, C, D])
+        self.assertEqual(graph.dependencies[B], {A})
+        # A is a dependency through B
+        self.assertEqual(graph.dependencies[D], {B, C})
+        self.assertEqual(graph.dependants(A), [B])
+        # the number of edges grows linearly with the number of barriers
+        tasks = [type('T%s' % i, (Task,), {'run_with_exceptions': i % 2 == 0})
+                 for i in range(2000)]
+        graph = TaskGraph(tasks)
+        self.assertEqual(sum(len(deps) for deps in graph.dependencies.values()), 1998)
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_dependencies_outside_of_graph(self):
+        class A(Task): pass
+        class B(Task):
+            input = A.output
+        self.assertEqual(task_dependencies(B), [A])
+        self.assertEqual(TaskGraph([B]).dependencies[B], set())
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_scheduler(self):
+        class A(Task): pass
+        class B(Task):
+            input = A.output
+        class C(Task): pass
+        class D(Task):
+            depends_on = (A, C)
+        scheduler = TaskScheduler(TaskGraph([A, B, C, D]))
+        self.assertEqual([scheduler.pop_ready(), scheduler.pop_ready()], [A, C])
+        self.assertIsNone(scheduler.pop_ready())
+        scheduler.finished(C)
+        self.assertIsNone(scheduler.pop_ready())
+        scheduler.finished(A)
+        # in task list order
+        self.assertEqual([scheduler.pop_ready(), scheduler.pop_ready()], [B, D])
+        self.assertEqual(scheduler.pending, 0)
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_cycle(self):
+        class A(Task): pass
+        class B(Task):
+            depends_on = (A,)
+        A.depends_on = (B,)
+        with self.assertRaisesRegex(TaskError, 'circular dependency'):
+            TaskGraph([A, B])
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_resource_order(self):
+        config = object()
+        class SQL(Task):
+            required_resource = 'sql'
+        class S3(Task):
+            required_resource = 's3'
+        class Q1(SQL): pass
+        class U1(S3):
+            input = Q1.output
+        class Q2(SQL): pass
+        class U2(S3):
+            input = Q2.output
+        class Q3(SQL):
+            resource_config = config
+        class Q4(SQL): pass
+        class Custom(Task): pass
+        class Q5(SQL): pass
+        class U3(S3):
+            input = Q4.output
+        class Q6(SQL): pass
+        original = [Q1, U1, Q2, U2, Q3, Q4, Custom, Q5, U3, Q6]
+        planned = TaskGraph(original).resource_order()
+        # tasks are never moved across Custom
+        self.assertEqual(planned, [Q1, Q2, Q4, U1, U2, Q3, Custom, Q5, Q6, U3])
+        self.assertEqual(count_resource_opens(original), 9)
+        self.assertEqual(count_resource_opens(planned), 5)
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_resource_order_many_barriers(self):
+        # alternating resources and barriers, ordered in linear time
+        resources = ['sql', 's3', None]
+        tasks = [type('T%s' % i, (Task,), {'required_resource': resources[i % 3]})
+                 for i in range(6000)]
+        planned = TaskGraph(tasks).resource_order()
+        self.assertEqual(planned, tasks)
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_resource_order_dependency_listed_later(self):
+        # a task listed before the barrier it depends on is not moved ahead
+        # of it
+        class A(Task): pass
+        class B(Task):
+            required_resource = 'sql'
+            input = A.output
+        class X(Task):
+            required_resource = 's3'
+        planned = TaskGraph([B, X, A]).resource_order()
+        self.assertEqual(len(planned), 3)
+        self.assertLess(planned.index(A), planned.index(B))
+
+    def test_non_task(self):
+        self.assertEqual(task_dependencies(mock.Mock()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
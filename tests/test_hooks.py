@@ -0,0 +1,177 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from bigrays import hooks
+from bigrays.hooks import Hook
+from bigrays.resources import ResourceManager
+from bigrays.run import BigRays
+from bigrays import tasks
+
+
+class RecordingHook(Hook):
+    def __init__(self):
+        self.events = []
+
+    def before_task(self, task):
+        self.events.append(('before_task', task.__name__))
+
+    def after_task(self, task, seconds):
+        self.events.append(('after_task', task.__name__))
+
+    def task_failed(self, task, error):
+        self.events.append(('task_failed', task.__name__, str(error)))
+
+    def retry(self, task, attempt, error):
+        self.events.append(('retry', task.__name__, attempt))
+
+    def chunk_processed(self, source, rows):
+        self.events.append(('chunk_processed', source, rows))
+
+
+class TestHooks(unittest.TestCase):
+    def test_emit(self):
+        hook = RecordingHook()
+        hooks.emit('retry', mock.Mock(__name__='A'), 2, None)
+        with hooks.installed([hook]):
+            hooks.emit('retry', mock.Mock(__name__='A'), 2, None)
+            # not implemented by the hook
+            hooks.emit('resource_opened', None, 0)
+        hooks.emit('retry', mock.Mock(__name__='A'), 3, None)
+        self.assertEqual(hook.events, [('retry', 'A', 2)])
+
+    def test_only_overridden_methods_are_listeners(self):
+        with hooks.installed([Hook(), RecordingHook()]):
+            self.assertEqual(set(hooks.current()),
+                             {'before_task', 'after_task', 'task_failed', 'retry',
+                              'chunk_processed'})
+        self.assertEqual(hooks.current(), {})
+
+    def test_nested_installs(self):
+        outer, inner = RecordingHook(), RecordingHook()
+        with hooks.installed([outer]):
+            with hooks.installed([inner]):
+                hooks.emit('chunk_processed', 'write', 1)
+            hooks.emit('chunk_processed', 'write', 2)
+        self.assertEqual(outer.events, [('chunk_processed', 'write', 1), ('chunk_processed', 'write', 2)])
+        self.assertEqual(inner.events, [('chunk_processed', 'write', 1)])
+
+    def test_failing_hooks_are_ignored(self):
+        class FailingHook(Hook):
+            def chunk_processed(self, source, rows):
+                raise Exception('testing error')
+        with hooks.installed([FailingHook()]):
+            with self.assertLogs('bigrays.hooks', 'ERROR'):
+                hooks.emit('chunk_processed', 'write', 1)
+
+    def test_load(self):
+        hook, = hooks.load(['tests.test_hooks:RecordingHook'])
+        self.assertIsInstance(hook, RecordingHook)
+
+
+class TestBigRaysHooks(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    @mock.patch('bigrays.run.BigRaysConfig', None)
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_task_events(self):
+        attempts = []
+        class A(tasks.Task):
+            retries = 2
+            def run(self):
+                # each attempt runs a new instance
+                assert not hasattr(self, 'attempted')
+                self.attempted = True
+                attempts.append(1)
+                if len(attempts) < 3:
+                    raise Exception('testing error')
+                return pd.DataFrame({'a': range(5)})
+        path = os.path.join(self._tmp.name, 'out.csv')
+        class B(tasks.ToCSV):
+            input = A.output
+            filename = path
+            def run(self):
+                self.input = iter([self.input.iloc[:3], self.input.iloc[3:]])
+                return super().run()
+        class C(tasks.Task):
+            def run(self):
+                raise Exception('testing error')
+        hook = RecordingHook()
+        with self.assertRaises(Exception):
+            BigRays.run(A, B, C, hooks=[hook])
+        self.assertEqual(hook.events, [
+            ('before_task', 'A'),
+            ('retry', 'A', 2),
+            ('retry', 'A', 3),
+            ('after_task', 'A'),
+            ('before_task', 'B'),
+            ('chunk_processed', 'to_csv', 3),
+            ('chunk_processed', 'to_csv', 2),
+            ('after_task', 'B'),
+            ('before_task', 'C'),
+            ('task_failed', 'C', 'testing error'),
+        ])
+
+    @mock.patch('bigrays.run.BigRaysConfig', None)
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_concurrent_runs(self):
+        # both runs are running tasks at once, and run "a" finishes first
+        running = threading.Barrier(2)
+        b_finished = threading.Event()
+        class A(tasks.Task):
+            def run(self):
+                running.wait(timeout=5)
+        class B(tasks.Task):
+            def run(self):
+                running.wait(timeout=5)
+        class LateB(tasks.Task):
+            depends_on = (B,)
+            def run(self):
+                b_finished.wait(timeout=5)
+        hook_a, hook_b = RecordingHook(), RecordingHook()
+        errors = []
+        def run(*run_tasks, **kwargs):
+            try:
+                BigRays.run(*run_tasks, **kwargs)
+            except Exception as err:
+                errors.append(err)
+        threads = [threading.Thread(target=run, args=(A,), kwargs={'hooks': [hook_a]}),
+                   threading.Thread(target=run, args=(B, LateB),
+                                    kwargs={'hooks': [hook_b], 'max_workers': 2})]
+        for thread in threads:
+            thread.start()
+        threads[0].join()
+        # run "b" keeps its hooks after run "a" exits
+        b_finished.set()
+        threads[1].join()
+        self.assertEqual(errors, [])
+        self.assertEqual(hook_a.events, [('before_task', 'A'), ('after_task', 'A')])
+        self.assertEqual(hook_b.events, [('before_task', 'B'), ('after_task', 'B'),
+                                         ('before_task', 'LateB'), ('after_task', 'LateB')])
+        self.assertEqual(hooks.current(), {})
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_resource_events(self):
+        events = []
+        class ResourceHook(Hook):
+            def resource_opened(self, resource, seconds):
+                events.append(('opened', resource))
+            def resource_closed(self, resource):
+                events.append(('closed', resource))
+        resource = mock.Mock(__name__='Resource')
+        with hooks.installed([ResourceHook()]):
+            with ResourceManager(None) as manager:
+                manager.open_resource(resource)
+        self.assertEqual(events, [('opened', resource), ('closed', resource)])
+
+
+if __name__ == '__main__':
+    unittest.main()
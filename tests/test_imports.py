@@ -0,0 +1,29 @@
+import subprocess
+import sys
+import unittest
+
+# modules which must only be imported once a task needs them
+HEAVY_MODULES = ('pandas', 'numpy', 'boto3', 'botocore', 'sqlalchemy', 'pyarrow',
+                 'environ', 'attr')
+
+
+class TestImports(unittest.TestCase):
+    def imported_modules(self, code):
+        # run in a new interpreter since the modules are already imported here
+        output = subprocess.check_output(
+            [sys.executable, '-c', code + '\nimport sys\nprint(" ".join(sys.modules))'])
+        return set(output.decode().split())
+
+    def test_import_is_lazy(self):
+        imported = self.imported_modules('import bigrays')
+        self.assertEqual([m for m in HEAVY_MODULES if m in imported], [])
+
+    def test_config_is_loaded_on_access(self):
+        imported = self.imported_modules(
+            'from bigrays.config import BigRaysConfig\nBigRaysConfig.TEMP_DIR')
+        self.assertIn('environ', imported)
+        self.assertNotIn('pandas', imported)
+
+
+if __name__ == '__main__':
+    unittest.main()
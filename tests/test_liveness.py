@@ -0,0 +1,127 @@
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from bigrays.liveness import OutputLiveness
+from bigrays.run import BigRays
+from bigrays.store import SpillStore
+from bigrays.tasks import Placeholder, Register
+from bigrays import tasks
+
+
+class TestOutputLiveness(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_release_after_last_consumer(self):
+        class A(tasks.Task):
+            pass
+        class B(tasks.Task):
+            input = A.output
+        class C(tasks.Task):
+            format_kws = {'a': A.output}
+        liveness = OutputLiveness([A, B, C])
+        A.output = pd.DataFrame({'a': range(100)})
+        liveness.task_finished(A)
+        B.output = 1
+        liveness.task_finished(B)
+        self.assertIsInstance(A.output, pd.DataFrame)
+        C.output = 2
+        liveness.task_finished(C)
+        # A's output (and the placeholders referencing it) are released
+        self.assertIsInstance(A.output, Placeholder)
+        with self.assertRaises(AttributeError):
+            C().reformat_keywords()
+        # outputs without consumers are kept
+        self.assertEqual(B.output, 1)
+        self.assertEqual(C.output, 2)
+        stats = liveness.finish()
+        self.assertEqual(stats.released_outputs, 1)
+        self.assertGreaterEqual(stats.released_bytes, 800)
+        self.assertGreaterEqual(stats.peak_output_bytes, stats.released_bytes)
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_keep_output(self):
+        class A(tasks.Task):
+            keep_output = True
+        class B(tasks.Task):
+            input = A.output
+        liveness = OutputLiveness([A, B])
+        A.output = 1
+        liveness.task_finished(A)
+        B.output = 2
+        liveness.task_finished(B)
+        self.assertEqual(A.output, 1)
+
+    @mock.patch('bigrays.run.BigRaysConfig', None)
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_bigrays_run(self):
+        class A(tasks.Task):
+            def run(self):
+                return pd.DataFrame({'a': [1, 2]})
+        class B(tasks.Task):
+            input = A.output
+            def run(self):
+                return self.input.a.sum()
+        summary = BigRays.run(A, B, release_outputs=True)
+        self.assertIsInstance(A.output, Placeholder)
+        self.assertEqual(B.output, 3)
+        self.assertEqual(summary.memory_stats.released_outputs, 1)
+        # outputs are kept by default
+        summary = BigRays.run(A, B)
+        self.assertIsInstance(A.output, pd.DataFrame)
+        self.assertIsNone(summary.memory_stats)
+
+    @mock.patch('bigrays.run.BigRaysConfig', None)
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_resume(self):
+        fail = [True]
+        class A(tasks.Task):
+            def run(self):
+                return pd.DataFrame({'a': [1, 2]})
+        class B(tasks.Task):
+            input = A.output
+            def run(self):
+                return self.input + 1
+        class C(tasks.Task):
+            input = B.output
+            def run(self):
+                if fail:
+                    raise Exception('testing error')
+                return self.input.a.sum()
+        with self.assertRaises(Exception):
+            BigRays.run(A, B, C, checkpoint_dir=self.tmpdir.name)
+        fail.clear()
+        summary = BigRays.resume(self.tmpdir.name, A, B, C, release_outputs=True)
+        # the restored outputs are released once their consumers finished
+        self.assertIsInstance(A.output, Placeholder)
+        self.assertIsInstance(B.output, Placeholder)
+        self.assertEqual(C.output, 5)
+        self.assertEqual(summary.memory_stats.released_outputs, 2)
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_spilled_output_not_loaded(self):
+        class A(tasks.Task):
+            pass
+        class B(tasks.Task):
+            input = A.output
+        store = SpillStore(max_bytes=0, directory=self.tmpdir.name)
+        with mock.patch.object(vars(Register)['output'], '_store', store):
+            liveness = OutputLiveness([A, B])
+            A.output = pd.DataFrame({'a': ['x' * 100] * 1000})
+            with mock.patch('bigrays.store.load_output') as load_output:
+                liveness.task_finished(A)
+                B.output = 1
+                liveness.task_finished(B)
+            load_output.assert_not_called()
+        self.assertEqual(liveness.stats.released_outputs, 1)
+        self.assertGreater(liveness.stats.released_bytes, 0)
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+import sqlalchemy as sa
+
+from bigrays import metrics
+from bigrays.metrics import RunMetrics, TaskMetrics
+from bigrays.mixins import MapMixin, SQLMixin
+from bigrays.run import BigRays
+from bigrays import tasks
+
+
+class TestRunMetrics(unittest.TestCase):
+    def test_measure(self):
+        run_metrics = RunMetrics()
+        with run_metrics.measure(mock.Mock(__name__='A')) as task_metrics:
+            self.assertIs(metrics.current(), task_metrics)
+            metrics.record('rows_read', 10)
+            metrics.record('rows_read', 5)
+        self.assertIsNone(metrics.current())
+        with self.assertRaises(ValueError):
+            with run_metrics.measure(mock.Mock(__name__='B')):
+                raise ValueError
+        a, b = run_metrics.tasks
+        self.assertEqual((a.task, a.status, a.counters['rows_read']), ('A', 'succeeded', 15))
+        self.assertEqual((b.task, b.status), ('B', 'failed'))
+        self.assertGreaterEqual(a.wall_seconds, 0)
+        self.assertIsNone(a.traced_memory_bytes)
+        report = json.loads(run_metrics.to_json())
+        self.assertEqual([t['task'] for t in report['tasks']], ['A', 'B'])
+        table = run_metrics.table().splitlines()
+        self.assertEqual(len(table), 4)
+        self.assertTrue(table[0].startswith('task'))
+
+    def test_record_outside_of_a_run(self):
+        # does nothing
+        metrics.record('rows_read', 10)
+
+    def test_trace_memory(self):
+        run_metrics = RunMetrics(trace_memory=True)
+        run_metrics.start()
+        try:
+            with run_metrics.measure(mock.Mock(__name__='A')):
+                data = bytearray(10 ** 6)
+        finally:
+            run_metrics.stop()
+        self.assertGreaterEqual(run_metrics.tasks[0].traced_memory_bytes, 10 ** 6)
+
+    def test_map_threads_record_to_task(self):
+        class Mapper(MapMixin):
+            def run_item(self, item):
+                metrics.record('rows_read', item)
+        task_metrics = TaskMetrics('A')
+        previous = metrics.activate(task_metrics)
+        try:
+            Mapper().map(range(10))
+        finally:
+            metrics.activate(previous)
+        self.assertEqual(task_metrics.counters['rows_read'], 45)
+
+
+class TestSQLMetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        engine = sa.create_engine('sqlite:///' + os.path.join(self.tmpdir.name, 'test.db'))
+        self.connection = engine.connect()
+        patcher = mock.patch('bigrays.resources.SQLSession.resource', return_value=self.connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        pd.DataFrame({'foo': range(10)}).to_sql('test', self.connection, index=False)
+        self.task_metrics = TaskMetrics('A')
+        self.previous = metrics.activate(self.task_metrics)
+
+    def tearDown(self):
+        metrics.activate(self.previous)
+        self.connection.close()
+        self.connection.engine.dispose()
+        self.tmpdir.cleanup()
+
+    def test_rows_read_and_written(self):
+        df = SQLMixin().read_query('select * from test')
+        chunks = SQLMixin().read_query('select * from test', chunksize=3)
+        # chunks are read after the task finished, but still attributed to it
+        metrics.activate(None)
+        self.assertEqual(sum(len(chunk) for chunk in chunks), 10)
+        metrics.activate(self.task_metrics)
+        SQLMixin().write('test2', df, index=False)
+        self.assertEqual(self.task_metrics.counters['rows_read'], 20)
+        self.assertEqual(self.task_metrics.counters['rows_written'], 10)
+
+
+class TestBigRaysMetrics(unittest.TestCase):
+    @mock.patch('bigrays.run.BigRaysConfig', None)
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_bigrays_run(self):
+        class A(tasks.Task):
+            def run(self):
+                metrics.record('rows_read', 3)
+        class B(tasks.Task):
+            def run(self):
+                raise Exception('testing error')
+        with self.assertLogs('bigrays.run', 'INFO') as logs:
+            with self.assertRaises(Exception):
+                BigRays.run(A, B)
+        self.assertTrue(any('task metrics:' in line for line in logs.output))
+        summary = BigRays.run(A)
+        self.assertEqual(summary.metrics.tasks[0].counters['rows_read'], 3)
+        self.assertEqual(summary.metrics.tasks[0].status, 'succeeded')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,255 @@
+import datetime
+import decimal
+import os
+import re
+import tempfile
 import unittest
+from unittest import mock
 
+import boto3
+import moto
 import pandas as pd
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
 
-from bigrays.mixins import S3Mixin, ReprMixin
+from bigrays import mixins
+from bigrays.mixins import MultipartUpload, S3Mixin, SQLMixin, ReprMixin
+from bigrays.utils import IterStream, apply_dtypes, is_chunked
+
+
+class TestSQLMixin(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        engine = sa.create_engine('sqlite:///' + os.path.join(self.tmpdir.name, 'test.db'))
+        self.connection = engine.connect()
+        patcher = mock.patch('bigrays.resources.SQLSession.resource', return_value=self.connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.df = pd.DataFrame({'foo': range(10), 'bar': list('abcdefghij')})
+        self.df.to_sql('test', self.connection, index=False)
+
+    def tearDown(self):
+        self.connection.close()
+        self.connection.engine.dispose()
+        self.tmpdir.cleanup()
+
+    def test_read_query_chunked(self):
+        chunks = SQLMixin().read_query('select * from test', chunksize=4)
+        self.assertTrue(is_chunked(chunks))
+        chunks = list(chunks)
+        self.assertEqual([len(c) for c in chunks], [4, 4, 2])
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), self.df)
+
+    def test_read_query_chunked_empty(self):
+        query = 'select * from test where foo < 0'
+        readers = [lambda: SQLMixin().read_query(query, chunksize=4),
+                   lambda: SQLMixin().read_query(query, chunksize=4, fetch_engine='arrow'),
+                   lambda: SQLMixin().read_query_partitioned(query, ['foo < 5', 'foo >= 5'],
+                                                             chunksize=4)]
+        for read in readers:
+            chunks = list(read())
+            self.assertEqual(len(chunks), 1)
+            self.assertEqual(list(chunks[0].columns), ['foo', 'bar'])
+            self.assertEqual(len(chunks[0]), 0)
+        # written as an empty DataFrame would be
+        pd.DataFrame({'foo': [7, 8]}).to_sql('dst', self.connection, index=False)
+        SQLMixin().write('dst', readers[0](), index=False, if_exists='replace')
+        actual = pd.read_sql('select * from dst', self.connection)
+        self.assertEqual(list(actual.columns), ['foo', 'bar'])
+        self.assertEqual(len(actual), 0)
+        self.assertEqual(S3Mixin._format_object(readers[0]()).read(), b'foo,bar\n')
+
+    def test_write_chunked(self):
+        chunks = (self.df.iloc[i:i + 3] for i in range(0, 10, 3))
+        SQLMixin().write('test', chunks, index=False, if_exists='replace')
+        actual = pd.read_sql('select * from test', self.connection)
+        pd.testing.assert_frame_equal(actual, self.df)
+
+    def test_upsert(self):
+        self.connection.execute('create table target (id integer primary key, v text, w real)')
+        self.connection.execute("insert into target values (1, 'a', 1.0), (2, 'b', 2.0)")
+        for i, engine in enumerate(['multi_values', 'default']):
+            with self.subTest(engine=engine):
+                df = pd.DataFrame({'id': [2, 3 + i], 'v': ['B', 'c'], 'w': [20.0, 3.0]})
+                counts = SQLMixin().upsert('target', df, ['id'], write_engine=engine)
+                self.assertEqual(counts, {'inserted': 1, 'updated': 1})
+        chunks = iter([pd.DataFrame({'id': [1], 'v': ['A'], 'w': [None]}),
+                       pd.DataFrame({'id': [5], 'v': ['e'], 'w': [5.0]})])
+        self.assertEqual(SQLMixin().upsert('target', chunks, ['id']), {'inserted': 1, 'updated': 1})
+        self.assertEqual(SQLMixin().upsert('target', iter([]), ['id']), {'inserted': 0, 'updated': 0})
+        actual = pd.read_sql('select * from target order by id', self.connection)
+        expected = pd.DataFrame({'id': [1, 2, 3, 4, 5], 'v': ['A', 'B', 'c', 'c', 'e'],
+                                 'w': [None, 20.0, 3.0, 3.0, 5.0]})
+        pd.testing.assert_frame_equal(actual, expected)
+        # the staging tables were dropped
+        self.assertEqual(sa.inspect(self.connection).get_table_names(), ['target', 'test'])
+
+    def test_upsert_rollback(self):
+        # ON CONFLICT requires a unique constraint on the keys
+        self.connection.execute('create table target (id integer, v text)')
+        self.connection.execute("insert into target values (1, 'a')")
+        with self.assertRaises(sa.exc.OperationalError):
+            SQLMixin().upsert('target', pd.DataFrame({'id': [1, 2], 'v': ['A', 'b']}), ['id'])
+        self.assertEqual(self.connection.execute('select * from target').fetchall(), [(1, 'a')])
+        self.assertEqual(sa.inspect(self.connection).get_table_names(), ['target', 'test'])
+
+    def test__merge_statements(self):
+        # the statements of dialects without an upsert statement run anywhere
+        self.connection.execute('create table target (id integer, k text, v text)')
+        self.connection.execute("insert into target values (1, 'x', 'a'), (2, 'x', 'b')")
+        pd.DataFrame({'id': [2, 3], 'k': ['x', 'x'], 'v': ['B', 'c']}).to_sql(
+            'staging', self.connection, index=False)
+        for statement in mixins._merge_statements('other', 'target', 'staging',
+                                                  ['id', 'k', 'v'], ['id', 'k']):
+            self.connection.execute(statement)
+        self.assertEqual(self.connection.execute('select * from target order by id').fetchall(),
+                         [(1, 'x', 'a'), (2, 'x', 'B'), (3, 'x', 'c')])
+        merge, = mixins._merge_statements('mssql', '[t1]', '[s1]', ['[id]', '[v]'], ['[id]'])
+        self.assertEqual(merge, 'MERGE INTO [t1] AS t USING [s1] AS s ON (t.[id] = s.[id]) '
+                                'WHEN MATCHED THEN UPDATE SET t.[v] = s.[v] '
+                                'WHEN NOT MATCHED THEN INSERT ([id], [v]) VALUES (s.[id], s.[v]);')
+
+    def test_write_engines(self):
+        # wide enough that multi_values needs several statements
+        df = pd.DataFrame([[i * j for j in range(60)] for i in range(100)],
+                          columns=['c%s' % j for j in range(60)])
+        df['c0'] = None
+        for engine in mixins.WRITE_ENGINES:
+            with self.subTest(engine=engine):
+                SQLMixin().write('wide', df, write_engine=engine, index=False, if_exists='replace')
+                actual = pd.read_sql('select * from wide', self.connection)
+                pd.testing.assert_frame_equal(actual, df)
+        with self.assertRaisesRegex(ValueError, 'unrecognized write engine'):
+            SQLMixin().write('wide', df, write_engine='foo')
+
+    def test_insert_copy(self):
+        # read as by `COPY ... CSV NULL '\N'`: unquoted \N fields are NULL and
+        # quoted fields are values
+        copied = {}
+        def copy_expert(statement, buffer):
+            copied['statement'] = statement
+            copied['rows'] = [
+                tuple(None if field == '\\N' else field[1:-1].replace('""', '"')
+                      for field in re.findall(r'\\N|"(?:[^"]|"")*"', line))
+                for line in buffer.getvalue().splitlines()]
+        connection = mock.Mock(dialect=postgresql.dialect())
+        connection.connection.cursor.return_value.copy_expert = copy_expert
+        table = sa.Table('t', sa.MetaData(), sa.Column('a'), sa.Column('b'))
+        rows = [('', None), ('x, "y"', '1.5'), ('\\N', '')]
+        mixins._insert_copy(mock.Mock(table=table), connection, ['a', 'b'], iter(rows))
+        self.assertEqual(copied['statement'], "COPY t (a, b) FROM STDIN WITH CSV NULL '\\N'")
+        self.assertEqual(copied['rows'], rows)
+
+    def test__rows_per_statement(self):
+        self.assertEqual(mixins._rows_per_statement('mssql', 3), 699)
+        self.assertEqual(mixins._rows_per_statement('mssql', 1), 1000)
+        self.assertEqual(mixins._rows_per_statement('sqlite', 60), 16)
+        self.assertEqual(mixins._rows_per_statement('sqlite', 2000), 1)
+
+    def test_read_query_arrow(self):
+        actual = SQLMixin().read_query('select * from test', fetch_engine='arrow')
+        pd.testing.assert_frame_equal(actual, self.df)
+        chunks = list(SQLMixin().read_query('select * from test', chunksize=4, fetch_engine='arrow'))
+        self.assertEqual([len(c) for c in chunks], [4, 4, 2])
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), self.df)
+        empty = SQLMixin().read_query('select * from test where foo < 0', fetch_engine='arrow')
+        self.assertEqual(list(empty.columns), ['foo', 'bar'])
+        self.assertEqual(len(empty), 0)
+        with self.assertRaisesRegex(ValueError, 'unrecognized fetch engine'):
+            SQLMixin().read_query('select * from test', fetch_engine='foo')
+
+    def test_read_query_arrow_batches(self):
+        # batches with NULLs only, or integers only, are inferred as other types
+        df = pd.DataFrame({'a': [None] * 3 + [1.5] * 3, 'b': [1] * 3 + [None] * 3})
+        df.to_sql('mixed', self.connection, index=False)
+        with mock.patch('bigrays.mixins._ARROW_BATCH_ROWS', 2):
+            actual = SQLMixin().read_query('select * from mixed', fetch_engine='arrow')
+        pd.testing.assert_frame_equal(actual, df)
+
+    def test_read_query_arrow_decimals(self):
+        # e.g. DECIMAL columns of SQL Server, read as floats by both engines
+        def execute(query):
+            result = mock.Mock()
+            result.keys.return_value = ['amount', 'id']
+            result.fetchmany.side_effect = [[(decimal.Decimal('1.25'), 1), (None, 2)], []]
+            return result
+        connection = mock.Mock(execute=execute)
+        expected, = mixins._iter_frames('select', connection, 2)
+        self.assertEqual(expected['amount'].dtype, 'float64')
+        for chunksize in [None, 2]:
+            with self.subTest(chunksize=chunksize):
+                actual, = mixins._iter_frames('select', connection, chunksize, fetch_engine='arrow')
+                pd.testing.assert_frame_equal(actual, expected)
+
+    def test_read_query_dtypes(self):
+        df = pd.DataFrame({'id': range(100), 'kind': ['a', 'b'] * 50,
+                           'name': ['n%s' % i for i in range(100)]})
+        df.to_sql('facts', self.connection, index=False)
+        for fetch_engine in mixins.FETCH_ENGINES:
+            with self.subTest(fetch_engine=fetch_engine):
+                actual = SQLMixin().read_query(
+                    'select * from facts', fetch_engine=fetch_engine,
+                    categorize=0.5, downcast=True, dtypes={'name': 'category'})
+                self.assertEqual(actual['id'].dtype, 'int8')
+                self.assertEqual(actual['kind'].dtype, 'category')
+                self.assertEqual(actual['name'].dtype, 'category')
+                pd.testing.assert_frame_equal(actual.astype(df.dtypes.to_dict()), df)
+
+    def test_read_query_chunked_dtypes(self):
+        pd.DataFrame({'id': range(300)}).to_sql('facts', self.connection, index=False)
+        for dtype_plan in [{'categorize': 0.5}, {'downcast': True}]:
+            with self.subTest(**dtype_plan):
+                with self.assertRaisesRegex(ValueError, 'chunksize'):
+                    SQLMixin().read_query('select * from facts', chunksize=100, **dtype_plan)
+                with self.assertRaisesRegex(ValueError, 'chunksize'):
+                    SQLMixin().read_query_partitioned('select * from facts', ['id < 150', 'id >= 150'],
+                                                      chunksize=100, **dtype_plan)
+        chunks = SQLMixin().read_query('select * from facts', chunksize=100, dtypes={'id': 'int16'})
+        self.assertEqual([chunk['id'].dtype for chunk in chunks], ['int16'] * 3)
+
+    def test_apply_dtypes(self):
+        df = pd.DataFrame({'a': [1, 300], 'b': ['x', 'y'], 'c': [1.0, 2.0]})
+        apply_dtypes(df, categorize=0.5, downcast=True)
+        self.assertEqual(df.dtypes.tolist(), ['int16', object, 'float64'])
+        apply_dtypes(df, dtypes={'c': 'float32'}, categorize=1)
+        self.assertEqual(df.dtypes.tolist(), ['int16', 'category', 'float32'])
+
+    def test_read_query_partitioned(self):
+        predicates = ['foo < 3', ('foo >= :low', {'low': 3})]
+        actual = SQLMixin().read_query_partitioned('select * from test;', predicates)
+        pd.testing.assert_frame_equal(actual, self.df)
+        predicates = SQLMixin().partition_predicates('select * from test', 'foo', 4)
+        self.assertEqual(len(predicates), 4)
+        actual = SQLMixin().read_query_partitioned('select * from test', predicates,
+                                                   max_connections=2)
+        pd.testing.assert_frame_equal(actual, self.df)
+        chunks = SQLMixin().read_query_partitioned('select * from test', predicates,
+                                                   max_connections=2, chunksize=2)
+        self.assertTrue(is_chunked(chunks))
+        chunks = list(chunks)
+        self.assertTrue(all(len(c) <= 2 for c in chunks))
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), self.df)
+
+    def test_partition_predicates(self):
+        df = pd.DataFrame({'day': pd.date_range('2020-01-01', periods=10).tolist() + [None]})
+        df.to_sql('days', self.connection, index=False)
+        predicates = SQLMixin().partition_predicates('select * from days', 'day', 3)
+        self.assertEqual(len(predicates), 3)
+        parts = [SQLMixin().read_query_partitioned('select * from days', [p]) for p in predicates]
+        # the null falls into the first partition
+        self.assertEqual([len(p) for p in parts], [4, 3, 4])
+        empty = SQLMixin().partition_predicates('select * from test where foo < 0', 'foo', 3)
+        self.assertEqual(empty, [('1 = 1', {})])
+
+    def test__range_boundaries(self):
+        self.assertEqual(mixins._range_boundaries(0, 10, 4), [2, 5, 7])
+        self.assertEqual(mixins._range_boundaries(0, 2, 4), [1])
+        self.assertEqual(mixins._range_boundaries(0.0, 1.0, 2), [0.5])
+        self.assertEqual(
+            mixins._range_boundaries(datetime.date(2020, 1, 1), datetime.date(2020, 1, 5), 2),
+            [datetime.date(2020, 1, 3)])
+        self.assertEqual(mixins._range_boundaries('2020-01-01', '2020-01-05', 2),
+                         ['2020-01-03 00:00:00'])
 
 
 class TestS3Mixin(unittest.TestCase):
@@ -25,6 +272,56 @@ class TestS3Mixin(unittest.TestCase):
         expected = b'foo bar'
         self.assertEqual(actual, expected)
 
+    def test__obj_to_byte_stream_chunks(self):
+        df = pd.DataFrame([[1, 2], [3, 4], [5, 6]], columns=['foo', 'bar'])
+        chunks = iter([df.iloc[:2], df.iloc[2:]])
+        actual = S3Mixin._format_object(chunks).read()
+        expected = (
+            b'foo,bar\n'
+            b'1,2\n'
+            b'3,4\n'
+            b'5,6\n')
+        self.assertEqual(actual, expected)
+
+
+@moto.mock_s3
+class TestMultipartUpload(unittest.TestCase):
+    def setUp(self):
+        self.client = boto3.client('s3', region_name='us-east-1')
+        self.client.create_bucket(Bucket='bucket')
+
+    def test_multipart(self):
+        data = os.urandom(1024 ** 2)
+        with MultipartUpload(self.client, 'bucket', 'key', part_size=5 * 1024 ** 2) as upload:
+            for _ in range(11):
+                upload.write(data)
+        self.assertEqual(len(upload._parts), 3)
+        actual = self.client.get_object(Bucket='bucket', Key='key')['Body'].read()
+        self.assertEqual(actual, data * 11)
+
+    def test_small(self):
+        with MultipartUpload(self.client, 'bucket', 'key') as upload:
+            upload.write(b'foo')
+        actual = self.client.get_object(Bucket='bucket', Key='key')['Body'].read()
+        self.assertEqual(actual, b'foo')
+
+    def test_abort(self):
+        with self.assertRaises(ValueError):
+            with MultipartUpload(self.client, 'bucket', 'key', part_size=1) as upload:
+                upload.write(b'foo')
+                raise ValueError
+        self.assertEqual(self.client.list_multipart_uploads(Bucket='bucket').get('Uploads', []), [])
+        self.assertNotIn('Contents', self.client.list_objects_v2(Bucket='bucket'))
+
+
+class TestIterStream(unittest.TestCase):
+    def test(self):
+        stream = IterStream([b'foo', b'', b'bar baz'])
+        self.assertEqual(stream.read(2), b'fo')
+        self.assertEqual(stream.read(4), b'o')
+        self.assertEqual(stream.read(), b'bar baz')
+        self.assertEqual(stream.read(), b'')
+
 
 class TestReprMixin(unittest.TestCase):
     def test(self):
@@ -1,7 +1,15 @@
+import os
+import tempfile
+import types
 import unittest
 from unittest import mock
 
-from bigrays.resources import ResourceManager, BaseResource, BaseAWSClient, S3Client, SNSClient
+import sqlalchemy as sa
+
+from bigrays import tasks
+from bigrays.resources import (ResourceManager, PooledResourceManager, BaseResource,
+                               BaseAWSClient, S3Client, SNSClient, SQLSession)
+from bigrays.run import BigRays
 
 
 class TestResourceManager(unittest.TestCase):
@@ -140,6 +148,172 @@ class TestResourceManager(unittest.TestCase):
             raise E
         Resource._open.assert_called()
 
+    def test_stats(self):
+        class Resource1(BaseResource):
+            _open = mock.Mock()
+        class Resource2(BaseResource):
+            _open = mock.Mock()
+        with ResourceManager(None) as resource_manager:
+            resource_manager.open_resource(Resource1)
+            resource_manager.open_resource(Resource1)
+            resource_manager.open_resource(Resource2)
+            resource_manager.open_resource(Resource1)
+        self.assertEqual(resource_manager.stats.as_dict(), {
+            'Resource1': {'opens': 2, 'reuses': 1},
+            'Resource2': {'opens': 1, 'reuses': 0},
+        })
+
+    def test_reopen_resource(self):
+        class Resource(BaseResource):
+            _open = mock.Mock(side_effect=lambda config: object())
+            _close = mock.Mock(side_effect=Exception('broken'))
+        with self.assertRaises(Exception):
+            with ResourceManager(None) as resource_manager:
+                resource_manager.open_resource(Resource)
+                broken = Resource.resource()
+                # errors closing the broken resource are ignored
+                resource_manager.reopen_resource(Resource)
+                self.assertIsNot(Resource.resource(), broken)
+                self.assertEqual(Resource._close.call_count, 1)
+        self.assertEqual(Resource._open.call_count, 2)
+
+class TestPooledResourceManager(unittest.TestCase):
+    def test_context_manager(self):
+        class Resource1(BaseResource):
+            _open = mock.Mock(side_effect=lambda config: ('r1', config))
+            _close = mock.Mock(return_value=False)
+        class Resource2(BaseResource):
+            _open = mock.Mock(side_effect=lambda config: ('r2', config))
+            _close = mock.Mock(return_value=False)
+        config = object()
+
+        with PooledResourceManager(None) as resource_manager:
+            resource_manager.open_resource(Resource1)
+            self.assertEqual(Resource1.resource(), ('r1', None))
+            resource_manager.open_resource(Resource2)
+            resource_manager.open_resource(Resource1, config)
+            self.assertEqual(Resource1.resource(), ('r1', config))
+            resource_manager.open_resource(None)
+            resource_manager.open_resource(Resource1)
+            self.assertEqual(Resource1.resource(), ('r1', None))
+            resource_manager.open_resource(Resource2)
+            Resource1._close.assert_not_called()
+            Resource2._close.assert_not_called()
+
+        self.assertEqual(Resource1._open.call_args_list, [mock.call(None), mock.call(config)])
+        self.assertEqual(Resource2._open.call_args_list, [mock.call(None)])
+        self.assertEqual(Resource1._close.call_count, 2)
+        self.assertEqual(Resource2._close.call_count, 1)
+        self.assertEqual(resource_manager.stats.as_dict(), {
+            'Resource1': {'opens': 2, 'reuses': 1},
+            'Resource2': {'opens': 1, 'reuses': 1},
+        })
+        with self.assertRaises(RuntimeError):
+            Resource1.resource()
+
+    def test_resource_by_config(self):
+        class Resource(BaseResource):
+            _open = mock.Mock(side_effect=lambda config: ('r', config))
+            _close = mock.Mock(return_value=False)
+        config1, config2 = object(), object()
+        with PooledResourceManager(None) as resource_manager:
+            resource_manager.open_resource(Resource, config1)
+            resource_manager.open_resource(Resource, config2)
+            # both are open at once
+            self.assertEqual(Resource.resource(config1), ('r', config1))
+            self.assertEqual(Resource.resource(config2), ('r', config2))
+            self.assertEqual(Resource.resource(), ('r', config2))
+        with self.assertRaises(RuntimeError):
+            Resource.resource(config1)
+        self.assertEqual(Resource._opened_by_config(), {})
+
+    def test_reopen_resource(self):
+        class Resource1(BaseResource):
+            _open = mock.Mock(side_effect=lambda config: object())
+            _close = mock.Mock(return_value=False)
+        class Resource2(BaseResource):
+            _open = mock.Mock(side_effect=lambda config: object())
+            _close = mock.Mock(return_value=False)
+        with PooledResourceManager(None) as resource_manager:
+            resource_manager.open_resource(Resource1)
+            broken = Resource1.resource()
+            resource_manager.open_resource(Resource2)
+            resource_manager.reopen_resource(Resource1)
+            self.assertIsNot(Resource1.resource(), broken)
+            self.assertEqual(Resource1._close.call_count, 1)
+            Resource2._close.assert_not_called()
+        self.assertEqual(Resource1._open.call_count, 2)
+        self.assertEqual(Resource1._close.call_count, 2)
+        self.assertEqual(Resource2._close.call_count, 1)
+
+    def test__exit__with_exception_while_resource_is_opened(self):
+        class Resource(BaseResource):
+            _open = mock.Mock(side_effect=Exception('nope!'))
+            _close = mock.Mock()
+        with self.assertRaises(Exception):
+            with PooledResourceManager(None) as resource_manager:
+                resource_manager.open_resource(Resource)
+        Resource._close.assert_not_called()
+
+
+class TestSQLSession(unittest.TestCase):
+    @mock.patch.object(SQLSession, '_engines', {})
+    @mock.patch('sqlalchemy.create_engine')
+    def test__create_engine(self, mock_create_engine):
+        mock_create_engine.side_effect = lambda url: mock.Mock()
+        engine1 = SQLSession._create_engine('foo://')
+        engine2 = SQLSession._create_engine('foo://')
+        engine3 = SQLSession._create_engine('bar://')
+        self.assertIs(engine1, engine2)
+        self.assertEqual(mock_create_engine.call_args_list, [mock.call('foo://'), mock.call('bar://')])
+        SQLSession.dispose_engines()
+        engine1.dispose.assert_called_once()
+        engine3.dispose.assert_called_once()
+        self.assertEqual(SQLSession._engines, {})
+
+    @mock.patch.object(SQLSession, '_engines', {})
+    @mock.patch.object(SQLSession, '_engine_users', 0)
+    @mock.patch('sqlalchemy.create_engine')
+    def test_release_engines(self, mock_create_engine):
+        mock_create_engine.side_effect = lambda url: mock.Mock()
+        # e.g. runs in two threads
+        SQLSession.acquire_engines()
+        SQLSession.acquire_engines()
+        engine = SQLSession._create_engine('foo://')
+        SQLSession.release_engines()
+        engine.dispose.assert_not_called()
+        self.assertEqual(SQLSession._engines, {'foo://': engine})
+        SQLSession.release_engines()
+        engine.dispose.assert_called_once()
+        self.assertEqual(SQLSession._engines, {})
+
+    @mock.patch.object(SQLSession, '_engines', {})
+    def test_session_state_not_kept(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config = types.SimpleNamespace(
+                ODBC_CONNECT_URL='sqlite:///' + os.path.join(tmpdir, 'test.db'))
+            # pooled like the engines of server databases
+            SQLSession._engines[config.ODBC_CONNECT_URL] = sa.create_engine(
+                config.ODBC_CONNECT_URL, poolclass=sa.pool.QueuePool)
+            with ResourceManager(config) as resource_manager:
+                resource_manager.open_resource(SQLSession)
+                SQLSession.resource().execute('create temp table t (a int)')
+                resource_manager.open_resource(None)
+                # the engine is reused but not the DBAPI connection
+                resource_manager.open_resource(SQLSession)
+                tables = SQLSession.resource().execute(
+                    "select name from sqlite_temp_master where type = 'table'").fetchall()
+                self.assertEqual(tables, [])
+            self.assertEqual(len(SQLSession._engines), 1)
+            with mock.patch('bigrays.run.BigRaysConfig', config), \
+                    mock.patch.object(SQLSession, 'required_configs', ()), \
+                    mock.patch('bigrays.tasks.TASK_REGISTER', []):
+                class Query(tasks.SQLQuery):
+                    query = 'select 1 as a'
+                BigRays.run(Query)
+            # engines are disposed of at the end of the run
+            self.assertEqual(SQLSession._engines, {})
+
 
 class TestBaseAWSClient(unittest.TestCase):
     def test_interface(self):
@@ -1,7 +1,10 @@
+import sys
+import threading
 import unittest
 from unittest import mock
 
-from bigrays.exceptions import ConfigurationError
+from bigrays.exceptions import ConfigurationError, TaskErrors
+from bigrays.resources import BaseResource, PooledResourceManager, ResourceManager
 from bigrays.run import BigRays, bigrays_run
 from bigrays.tasks import BaseTask
 from bigrays import tasks
@@ -51,6 +54,27 @@ class TestBigRays(unittest.TestCase):
         expected = [1, 2]
         self.assertEqual(actual, expected)
 
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test__define_task_list_reorder(self):
+        class Q1(tasks.SQLQuery):
+            query = ''
+        class U1(tasks.ToS3):
+            input = Q1.output
+            bucket = key = ''
+        class Q2(tasks.SQLQuery):
+            query = ''
+        actual = BigRays._define_task_list([Q1, U1, Q2], reorder=True)
+        self.assertEqual(actual, [Q1, Q2, U1])
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test__define_task_list_reorder_dependency_listed_later(self):
+        class A(tasks.Task): pass
+        class C(tasks.ToCSV):
+            input = A.output
+            filename = ''
+        actual = BigRays._define_task_list([C, A], reorder=True)
+        self.assertEqual(actual, [A, C])
+
     def test__define_required_resources(self):
         class SimpleTask:
             def __init__(self, resource):
@@ -99,8 +123,12 @@ class TestBigRays(unittest.TestCase):
         with self.assertRaisesRegex(Exception, 'exceptions occurred while running tasks') as err_cm:
             BigRays._run_tasks(mock_tasks, mock_resource_manager)
         err = err_cm.exception
-        self.assertIs(err.__context__, mock_tasks[7].side_effect)
-        self.assertIs(err.__context__.__context__, mock_tasks[4].side_effect)
+        self.assertIsInstance(err, TaskErrors)
+        self.assertEqual(err.failures, [(mock_tasks[4], mock_tasks[4].side_effect),
+                                        (mock_tasks[7], mock_tasks[7].side_effect)])
+        # the traceback of every error is reported
+        self.assertIn('testing error 1', str(err))
+        self.assertIn('testing error 2', str(err))
         # make sure 1-5 and 7 and 9 ran but the rest didn't
         for i in range(len(mock_tasks)):
             if i in [6, 8]:
@@ -108,6 +136,95 @@ class TestBigRays(unittest.TestCase):
             else:
                 mock_tasks[i].assert_called()
 
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test__run_tasks_in_parallel(self):
+        # A and B can only both complete if they run at the same time
+        barrier = threading.Barrier(2, timeout=5)
+        class A(tasks.Task):
+            def run(self):
+                barrier.wait()
+                return 1
+        class B(tasks.Task):
+            def run(self):
+                barrier.wait()
+                return 2
+        class C(tasks.Task):
+            input = A.output
+            format_kws = {'b': B.output}
+            def run(self):
+                return self.input + self.reformat_keywords()['b']
+        BigRays._run_tasks_in_parallel([A, B, C], ResourceManager(None), 2)
+        self.assertEqual(C.output, 3)
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test__run_tasks_in_parallel_across_configs(self):
+        # tasks requiring the same resource with different configs (e.g.
+        # queries against different databases) run at the same time
+        barrier = threading.Barrier(3, timeout=5)
+        class Database(BaseResource):
+            @classmethod
+            def _open(cls, config):
+                return config
+        class Query(tasks.Task):
+            required_resource = Database
+            def run(self):
+                barrier.wait()
+                return Database.resource(self.resource_config)
+        queries = [type(tasks.Task)('Query%s' % i, (Query,), {'resource_config': 'db%s' % i})
+                   for i in range(3)]
+        BigRays._run_tasks_in_parallel(queries, PooledResourceManager(None), 3)
+        self.assertEqual([query.output for query in queries], ['db0', 'db1', 'db2'])
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test__run_tasks_in_parallel_with_exceptions(self):
+        ran = []
+        errors = [Exception('testing error 1'), Exception('testing error 2')]
+        class A(tasks.Task):
+            def run(self):
+                raise errors[0]
+        class B(tasks.Task):
+            input = A.output
+            def run(self):
+                ran.append(B)
+        class C(tasks.Task):
+            run_with_exceptions = True
+            def run(self):
+                ran.append(C)
+                raise errors[1]
+        class D(tasks.Task):
+            run_with_exceptions = True
+            def run(self):
+                ran.append(D)
+        with self.assertRaisesRegex(Exception, 'exceptions occurred while running tasks') as err_cm:
+            BigRays._run_tasks_in_parallel([A, B, C, D], ResourceManager(None), 4)
+        err = err_cm.exception
+        self.assertEqual(err.exceptions, errors)
+        self.assertEqual(ran, [C, D])
+
+    def test__run_tasks_many(self):
+        # neither running nor failing depends on the recursion limit
+        mock_resource_manager = mock.Mock()
+        mock_tasks = [mock.Mock(run_with_exceptions=True, side_effect=Exception('testing error'))
+                      for i in range(3 * sys.getrecursionlimit())]
+        with self.assertRaises(TaskErrors) as err_cm:
+            BigRays._run_tasks(mock_tasks, mock_resource_manager)
+        self.assertEqual(len(err_cm.exception.failures), len(mock_tasks))
+        str(err_cm.exception)
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test__run_tasks_in_parallel_many(self):
+        class Source(tasks.Task):
+            def run(self):
+                return 0
+        chain = [Source]
+        for i in range(3 * sys.getrecursionlimit()):
+            chain.append(type(tasks.Task)('Step%s' % i, (tasks.Task,), {
+                'input': chain[-1].output,
+                'run': lambda self: self.input + 1,
+            }))
+        BigRays._run_tasks_in_parallel(chain, ResourceManager(None), 4)
+        self.assertEqual(chain[-1].output, len(chain) - 1)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,113 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from bigrays.store import MemoryStore, SpillStore
+from bigrays.tasks import set_output_store
+from bigrays import tasks
+
+
+class TestSpillStore(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.df = pd.DataFrame({'a': range(1000)})
+        # room for one DataFrame
+        self.store = SpillStore(max_bytes=10000, directory=self._tmp.name)
+
+    def tearDown(self):
+        self.store.close()
+        self._tmp.cleanup()
+
+    def test_spill_least_recently_used(self):
+        self.store.set('a', self.df)
+        self.store.set('b', self.df + 1)
+        self.assertEqual(len(os.listdir(self._tmp.name)), 1)
+        self.assertIn('a', self.store)
+        self.assertLessEqual(self.store.memory_bytes, 10000)
+        # loading "a" spills "b"
+        pd.testing.assert_frame_equal(self.store.get('a'), self.df)
+        self.assertEqual(len(os.listdir(self._tmp.name)), 2)
+        pd.testing.assert_frame_equal(self.store.get('b'), self.df + 1)
+
+    def test_unspillable_outputs_stay_in_memory(self):
+        self.store.set('a', list(range(10000)))
+        self.store.set('b', io.BytesIO(b'x' * 20000))
+        self.assertEqual(self.store.get('a'), list(range(10000)))
+        self.assertEqual(len(os.listdir(self._tmp.name)), 1)
+        self.assertEqual(self.store.get('b').getvalue(), b'x' * 20000)
+
+    def test_nbytes(self):
+        self.store.set('a', self.df)
+        self.assertGreaterEqual(self.store.nbytes('a'), 8000)
+        self.store.set('b', self.df + 1)
+        # "a" is spilled and not loaded to be measured
+        with mock.patch('bigrays.store.load_output') as load_output:
+            self.assertGreater(self.store.nbytes('a'), 0)
+        load_output.assert_not_called()
+        with self.assertRaises(KeyError):
+            self.store.nbytes('c')
+        memory_store = MemoryStore()
+        memory_store.set('a', self.df)
+        self.assertGreaterEqual(memory_store.nbytes('a'), 8000)
+        # strings are not measured
+        strings = pd.DataFrame({'a': ['x' * 100] * 10})
+        self.store.set('d', strings)
+        memory_store.set('d', strings)
+        self.assertEqual(self.store.nbytes('d'), memory_store.nbytes('d'))
+
+    def test_discard(self):
+        self.store.set('a', self.df)
+        self.store.set('b', self.df)
+        self.store.discard('a')
+        self.store.discard('b')
+        self.assertNotIn('a', self.store)
+        self.assertEqual(os.listdir(self._tmp.name), [])
+        self.assertEqual(self.store.memory_bytes, 0)
+        with self.assertRaises(KeyError):
+            self.store.get('a')
+
+
+class TestTaskOutputStore(unittest.TestCase):
+    def setUp(self):
+        self.store = SpillStore(max_bytes=10000)
+        set_output_store(self.store)
+
+    def tearDown(self):
+        set_output_store(MemoryStore())
+        self.store.close()
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_placeholders_load_spilled_outputs(self):
+        class A(tasks.Task):
+            pass
+        class B(tasks.Task):
+            input = A.output
+        class C(tasks.Task):
+            pass
+        df = pd.DataFrame({'a': range(1000)})
+        A.output = df
+        C.output = df + 1
+        self.assertNotIn(A, self.store._memory)
+        pd.testing.assert_frame_equal(B().input, df)
+        pd.testing.assert_frame_equal(A.output, df)
+        A.release_output()
+        with self.assertRaises(AttributeError):
+            B().input
+
+    @mock.patch('bigrays.tasks.atexit.register')
+    def test_default_store_closed_at_exit(self, register):
+        with mock.patch.object(tasks.BigRaysConfig, 'OUTPUT_MEMORY_LIMIT', 10000):
+            store = tasks._default_output_store()
+        self.assertIsInstance(store, SpillStore)
+        register.assert_called_once_with(store.close)
+        store.close()
+        self.assertFalse(os.path.exists(store.directory))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,24 @@
 import collections
+import datetime
+import io
+import os
+import tempfile
+import threading
+import traceback
 import unittest
 from unittest import mock
 
-from bigrays.exceptions import TaskError, TaskInterfaceError
+import boto3
+import moto
+import pandas as pd
+import sqlalchemy as sa
+
+from bigrays.exceptions import ConfigurationError, MapError, TaskError, TaskErrors, TaskInterfaceError
+from bigrays.mixins import SQLMixin
+from bigrays.resources import S3Client, SQLSession
+from bigrays.run import BigRays
 from bigrays import tasks
-from bigrays.tasks import ToS3, SQLExecute, SQLQuery, BaseTask
+from bigrays.tasks import FromS3, FromS3Map, ListS3Objects, MapTask, ToCSV, ToS3, SQLExecute, SQLQuery, SQLToS3, SQLUpsert, BaseTask
 
 
 class TestTaskRegister(unittest.TestCase):
@@ -41,6 +55,10 @@ class TestTaskRegister(unittest.TestCase):
         except AssertionError:
             with self.assertRaisesRegexp(TaskInterfaceError, "some class must define.*'attr5', 'attr2'"):
                 tasks.Register._check_interface('some class', bases, namespace_fail)
+        for retries in ['3', 3.0, -1, True]:
+            with self.assertRaisesRegex(TaskInterfaceError, 'some class.retries must be'):
+                tasks.Register._check_interface('some class', bases,
+                                                dict(namespace_pass, retries=retries))
 
 
 class TestTaskInterface(unittest.TestCase):
@@ -74,6 +92,62 @@ class TestBaseTask(unittest.TestCase):
         self.assertEqual(task1_output_placeholder.value, 1)
 
 
+class TestMapTask(unittest.TestCase):
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_map(self):
+        # all items can only complete if they run concurrently
+        barrier = threading.Barrier(3, timeout=5)
+        class Square(MapTask):
+            input = [3, 1, 2]
+            max_workers = 3
+            def run_item(self, item):
+                barrier.wait()
+                return item ** 2
+        self.assertEqual(Square().run(), [9, 1, 4])
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_failures(self):
+        errors = {2: ValueError('two'), 4: ValueError('four')}
+        ran = []
+        class Fail(MapTask):
+            input = range(6)
+            max_workers = 2
+            def run_item(self, item):
+                ran.append(item)
+                if item in errors:
+                    raise errors[item]
+                return item
+        with self.assertRaisesRegex(MapError, r'2 of 6 items failed: \[2, 4\]') as err_cm:
+            Fail().run()
+        err = err_cm.exception
+        self.assertEqual(sorted(ran), list(range(6)))
+        self.assertEqual(err.failures, [(2, errors[2]), (4, errors[4])])
+        self.assertEqual(err.results, [0, 1, errors[2], 3, errors[4], 5])
+        self.assertIsNone(err.__cause__)
+        self.assertIn('ValueError: two', str(err))
+        self.assertIn('ValueError: four', str(err))
+        Fail.allow_failures = True
+        self.assertEqual(Fail().run(), [0, 1, errors[2], 3, errors[4], 5])
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_many_failures(self):
+        class Fail(MapTask):
+            input = range(3000)
+            def run_item(self, item):
+                raise ValueError(item)
+        with self.assertRaisesRegex(MapError, r'3000 of 3000 items failed: \[0, 1, .*, 9, \.\.\.\]') as err_cm:
+            Fail().run()
+        err = err_cm.exception
+        self.assertEqual(len(err.failures), 3000)
+        message = str(err)
+        self.assertEqual(message.count('ValueError: '), MapError.max_tracebacks)
+        self.assertIn('2990 more failed items', message)
+        # formatting the traceback doesn't recurse through the failures
+        formatted = ''.join(traceback.format_exception(type(err), err, err.__traceback__))
+        self.assertIn('2990 more failed items', formatted)
+        self.assertIn('2990 more failed items', str(TaskErrors('tasks failed', [(Fail, err)])))
+
+
 class TestSQLTasks(unittest.TestCase):
     @mock.patch('bigrays.tasks.SQLQuery.read_query')
     @mock.patch('bigrays.tasks.SQLExecute.execute')
@@ -93,6 +167,55 @@ class TestSQLTasks(unittest.TestCase):
         mock_query.assert_called_with('fooBAR baz!')
         mock_execute.assert_called_with('fooBAR baz!')
 
+    @mock.patch('bigrays.tasks.SQLQuery.read_query')
+    def test_chunksize(self, mock_query):
+        class QueryTask(SQLQuery):
+            query = 'foo'
+            chunksize = 10
+        QueryTask().run()
+        mock_query.assert_called_with('foo', chunksize=10)
+
+    @mock.patch('bigrays.tasks.SQLUpsert.upsert')
+    def test_upsert(self, mock_upsert):
+        class UpsertTask(SQLUpsert):
+            input = 'df'
+            tablename = 'foo'
+            keys = ['id']
+        UpsertTask().run()
+        mock_upsert.assert_called_with('foo', 'df', ['id'], write_engine='multi_values', schema=None)
+
+    @mock.patch('bigrays.tasks.SQLQuery.read_query')
+    def test_read_options(self, mock_query):
+        class QueryTask(SQLQuery):
+            query = 'foo'
+            fetch_engine = 'arrow'
+            categorize = 0.5
+            dtypes = {'a': 'int32'}
+        QueryTask().run()
+        mock_query.assert_called_with('foo', fetch_engine='arrow', categorize=0.5,
+                                      dtypes={'a': 'int32'})
+        self.assertEqual(QueryTask().cache_fingerprint()['options'],
+                         {'fetch_engine': 'arrow', 'categorize': 0.5, 'dtypes': {'a': 'int32'}})
+
+    @mock.patch('bigrays.tasks.SQLQuery.partition_predicates', return_value=['a', 'b'])
+    @mock.patch('bigrays.tasks.SQLQuery.read_query_partitioned')
+    def test_partitions(self, mock_query, mock_predicates):
+        class QueryTask(SQLQuery):
+            query = 'foo {bar}'
+            format_kws = {'bar': 'BAR'}
+            partitions = ['x = {bar}', ('y = :y', {'y': 1})]
+        QueryTask().run()
+        mock_query.assert_called_with('foo BAR', ['x = BAR', ('y = :y', {'y': 1})],
+                                      max_connections=4, chunksize=None)
+        QueryTask.partitions = 2
+        with self.assertRaisesRegex(ValueError, 'partition_column'):
+            QueryTask().run()
+        QueryTask.partition_column = 'x'
+        QueryTask.chunksize = 10
+        QueryTask().run()
+        mock_predicates.assert_called_with('foo BAR', 'x', 2)
+        mock_query.assert_called_with('foo BAR', ['a', 'b'], max_connections=4, chunksize=10)
+
 
 class TestS3Tasks(unittest.TestCase):
     @mock.patch('bigrays.resources.S3Client.resource')
@@ -108,6 +231,257 @@ class TestS3Tasks(unittest.TestCase):
         to_s3.upload('fake-data', 'fake-bucket', 'fake-key')
         mock_resource.return_value.upload_fileobj.assert_called()
 
+    @moto.mock_s3
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_transfer_config(self):
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='bucket')
+        class Upload(ToS3):
+            input = os.urandom(11 * 1024 ** 2)
+            bucket = 'bucket'
+            key = 'key'
+            multipart_threshold = multipart_chunksize = 5 * 1024 ** 2
+        with mock.patch('bigrays.resources.S3Client.resource', return_value=client), \
+                mock.patch('bigrays.mixins.BigRaysConfig.S3_MAX_CONCURRENCY', 2), \
+                self.assertLogs('bigrays.mixins', 'INFO') as logs:
+            config = Upload().transfer_config()
+            Upload().run()
+        self.assertEqual(config.multipart_threshold, 5 * 1024 ** 2)
+        self.assertEqual(config.max_concurrency, 2)
+        self.assertRegex(logs.output[-1], r'uploaded bucket/key: %s bytes' % len(Upload.input))
+        head = client.head_object(Bucket='bucket', Key='key')
+        # multipart uploads have an ETag of the form <md5>-<number of parts>
+        self.assertTrue(head['ETag'].endswith('-3"'))
+
+
+@moto.mock_s3
+class TestFromS3(unittest.TestCase):
+    def setUp(self):
+        self.client = boto3.client('s3', region_name='us-east-1')
+        self.client.create_bucket(Bucket='bucket')
+        self.df = pd.DataFrame({'foo': range(10), 'bar': list('abcdefghij')})
+        self.client.put_object(Bucket='bucket', Key='data.csv',
+                               Body=self.df.to_csv(index=False).encode())
+        parquet = io.BytesIO()
+        self.df.to_parquet(parquet, index=False)
+        self.client.put_object(Bucket='bucket', Key='data.parquet', Body=parquet.getvalue())
+        patcher = mock.patch('bigrays.resources.S3Client.resource', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_task(self, key='data.csv', **kwargs):
+        task = type('Download', (FromS3,), dict(bucket='bucket', key=key, **kwargs))
+        return task().run()
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_memory(self):
+        output = self.run_task()
+        self.assertIsInstance(output, io.BytesIO)
+        pd.testing.assert_frame_equal(pd.read_csv(output), self.df)
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_spill_to_disk(self):
+        with self.run_task(spill_to_disk=True) as output:
+            self.assertNotIsInstance(output, io.BytesIO)
+            pd.testing.assert_frame_equal(pd.read_csv(output), self.df)
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_filename(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, '{name}.csv')
+            output = self.run_task(filename=filename, format_kws={'name': 'foo'})
+            output.close()
+            pd.testing.assert_frame_equal(pd.read_csv(os.path.join(tmpdir, 'foo.csv')), self.df)
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_memory_map(self):
+        output = self.run_task(memory_map=True)
+        self.assertEqual(output[:], self.df.to_csv(index=False).encode())
+        output.close()
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_read_as(self):
+        for key, read_as in [('data.csv', 'csv'), ('data.parquet', 'parquet')]:
+            with self.subTest(read_as=read_as):
+                chunks = list(self.run_task(key=key, read_as=read_as, chunksize=4))
+                self.assertEqual([len(c) for c in chunks], [4, 4, 2])
+                pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), self.df)
+        with self.assertRaisesRegex(ValueError, 'unsupported format'):
+            self.run_task(read_as='json')
+
+
+@moto.mock_s3
+class TestFromS3Map(unittest.TestCase):
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test(self):
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='bucket')
+        dfs = [pd.DataFrame({'foo': [i, i + 1]}) for i in range(5)]
+        for i, df in enumerate(dfs):
+            client.put_object(Bucket='bucket', Key='%s.csv' % i, Body=df.to_csv(index=False).encode())
+        # register the client as if opened by a ResourceManager so that it
+        # must be shared with the worker threads
+        S3Client._register_resource(client)
+        self.addCleanup(S3Client._opened_resources().pop, S3Client)
+        class Download(FromS3Map):
+            input = ['%s.csv' % i for i in range(5)]
+            bucket = 'bucket'
+        outputs = Download().run()
+        self.assertEqual([o.read() for o in outputs], [df.to_csv(index=False).encode() for df in dfs])
+        Download.read_as = 'csv'
+        Download.input = [{'Key': '%s.csv' % i} for i in range(5)]
+        for actual, expected in zip(Download().run(), dfs):
+            pd.testing.assert_frame_equal(actual, expected)
+
+
+@moto.mock_s3
+class TestListS3Objects(unittest.TestCase):
+    def setUp(self):
+        self.client = boto3.client('s3', region_name='us-east-1')
+        self.client.create_bucket(Bucket='bucket')
+        patcher = mock.patch('bigrays.resources.S3Client.resource', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_task(self, **kwargs):
+        task = type('List', (ListS3Objects,), dict(bucket='bucket', **kwargs))
+        return task().run()
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_pagination(self):
+        keys = sorted('prefix/%04d.csv' % i for i in range(1100))
+        for key in keys:
+            self.client.put_object(Bucket='bucket', Key=key, Body=b'')
+        self.assertEqual(self.run_task(prefix='prefix/'), keys)
+        lazy = self.run_task(prefix='prefix/', lazy=True)
+        self.assertNotIsInstance(lazy, list)
+        self.assertEqual(list(lazy), keys)
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_empty(self):
+        self.assertEqual(self.run_task(prefix='nothing/'), [])
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_filters(self):
+        self.client.put_object(Bucket='bucket', Key='a.csv', Body=b'a' * 10)
+        self.client.put_object(Bucket='bucket', Key='b.csv', Body=b'b' * 100)
+        self.client.put_object(Bucket='bucket', Key='c.json', Body=b'c' * 100)
+        self.assertEqual(self.run_task(suffix='.csv'), ['a.csv', 'b.csv'])
+        self.assertEqual(self.run_task(min_size=50), ['b.csv', 'c.json'])
+        self.assertEqual(self.run_task(max_size=50), ['a.csv'])
+        future = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+        self.assertEqual(self.run_task(modified_since=future), [])
+        past = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+        metadata = self.run_task(modified_since=past, suffix='.json', include_metadata=True)
+        self.assertEqual(len(metadata), 1)
+        self.assertEqual(set(metadata[0]), {'Key', 'Size', 'ETag', 'LastModified'})
+        self.assertEqual((metadata[0]['Key'], metadata[0]['Size']), ('c.json', 100))
+
+
+@moto.mock_s3
+class TestSQLToS3(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        class SQLConfig:
+            ODBC_CONNECT_URL = 'sqlite:///' + os.path.join(self.tmpdir.name, 'test.db')
+        self.sql_config = SQLConfig
+        engine = sa.create_engine(SQLConfig.ODBC_CONNECT_URL)
+        self.df = pd.DataFrame({'foo': range(10), 'bar': list('abcdefghij')})
+        self.df.to_sql('test', engine, index=False)
+        engine.dispose()
+        self.client = boto3.client('s3', region_name='us-east-1')
+        self.client.create_bucket(Bucket='bucket')
+        patcher = mock.patch('bigrays.resources.S3Client.resource', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_task(self, **kwargs):
+        kwargs.setdefault('chunksize', 3)
+        kwargs.setdefault('query', 'select * from {table}')
+        task = type('Export', (SQLToS3,), dict(
+            bucket='bucket', key='{table}.out',
+            format_kws={'table': 'test'}, sql_config=self.sql_config, **kwargs))
+        task().run()
+        body = self.client.get_object(Bucket='bucket', Key='test.out')['Body'].read()
+        return io.BytesIO(body)
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_csv(self):
+        pd.testing.assert_frame_equal(pd.read_csv(self.run_task()), self.df)
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_csv_gz(self):
+        actual = pd.read_csv(self.run_task(format='csv.gz'), compression='gzip')
+        pd.testing.assert_frame_equal(actual, self.df)
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_parquet(self):
+        actual = pd.read_parquet(self.run_task(format='parquet'))
+        pd.testing.assert_frame_equal(actual, self.df)
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_empty_result(self):
+        empty = self.df.iloc[:0]
+        for format, read in [('csv', pd.read_csv), ('parquet', pd.read_parquet)]:
+            with self.subTest(format=format):
+                actual = read(self.run_task(query='select * from {table} where foo < 0',
+                                            format=format, overwrite_if_exists=True))
+                self.assertEqual(list(actual.columns), list(empty.columns))
+                self.assertEqual(len(actual), 0)
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_sql_configs_checked(self):
+        class Export(SQLToS3):
+            query = 'select * from test'
+            bucket = 'bucket'
+            key = 'test.out'
+            sql_config = object()
+        with mock.patch.object(SQLSession, 'required_configs', ('ODBC_CONNECT_URL',)), \
+                mock.patch.object(S3Client, 'required_configs', {}):
+            # checked before any task runs
+            with self.assertRaisesRegex(ConfigurationError, 'ODBC_CONNECT_URL'):
+                BigRays.run(Export)
+            Export.sql_config = self.sql_config
+            BigRays.run(Export)
+        self.assertEqual(len(pd.read_csv(self.client.get_object(
+            Bucket='bucket', Key='test.out')['Body'])), len(self.df))
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_overwrite_if_exists(self):
+        self.client.put_object(Bucket='bucket', Key='test.out', Body=b'')
+        with self.assertRaises(TaskError):
+            self.run_task()
+        pd.testing.assert_frame_equal(pd.read_csv(self.run_task(overwrite_if_exists=True)), self.df)
+
+
+class TestToCSV(unittest.TestCase):
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_chunks(self):
+        df = pd.DataFrame({'foo': range(5), 'bar': list('abcde')})
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'test.csv')
+            class Write(ToCSV):
+                input = iter([df.iloc[:2], df.iloc[2:4], df.iloc[4:]])
+                filename = os.path.join(tmpdir, 'test.csv')
+            Write().run()
+            pd.testing.assert_frame_equal(pd.read_csv(filename), df)
+
+    @mock.patch('bigrays.tasks.TASK_REGISTER', [])
+    def test_empty_query_chunks(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            engine = sa.create_engine('sqlite:///' + os.path.join(tmpdir, 'test.db'))
+            pd.DataFrame({'foo': [1], 'bar': ['a']}).to_sql('test', engine, index=False)
+            with engine.connect() as connection, \
+                    mock.patch('bigrays.resources.SQLSession.resource', return_value=connection):
+                class Write(ToCSV):
+                    input = SQLMixin().read_query('select * from test where foo < 0', chunksize=2)
+                    filename = os.path.join(tmpdir, 'test.csv')
+                Write().run()
+            engine.dispose()
+            with open(Write.filename) as f:
+                self.assertEqual(f.read(), 'foo,bar\n')
+
 
 if __name__ == '__main__':
     unittest.main()
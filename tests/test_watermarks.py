@@ -0,0 +1,256 @@
+import datetime
+import decimal
+import os
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import pandas as pd
+import sqlalchemy as sa
+
+from bigrays import tasks, watermarks
+from bigrays.exceptions import ConfigurationError, TaskErrors
+from bigrays.resources import SQLSession
+from bigrays.run import BigRays
+from bigrays.watermarks import FileWatermarkStore, SQLWatermarkStore
+
+VALUES = [10, 1.5, 'abc', decimal.Decimal('1.25'), datetime.date(2020, 1, 2),
+          datetime.datetime(2020, 1, 2, 3, 4, 5), datetime.datetime(2020, 1, 2, 3, 4, 5, 6),
+          datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc),
+          datetime.datetime(2020, 1, 2, 3, 4, 5, 6,
+                            tzinfo=datetime.timezone(-datetime.timedelta(hours=5, minutes=30)))]
+
+
+class TestStores(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.url = 'sqlite:///' + os.path.join(self.tmpdir.name, 'test.db')
+
+    def tearDown(self):
+        SQLSession.dispose_engines()
+        self.tmpdir.cleanup()
+
+    def test_stores(self):
+        path = os.path.join(self.tmpdir.name, 'state', 'watermarks.json')
+        config = types.SimpleNamespace(ODBC_CONNECT_URL=self.url)
+        for store in [FileWatermarkStore(path), SQLWatermarkStore(config=config)]:
+            with self.subTest(store=store):
+                self.assertIsNone(store.get('a'))
+                for value in VALUES:
+                    store.update({'a': value, 'b': 1})
+                    self.assertEqual(store.get('a'), value)
+                    self.assertEqual(type(store.get('a')), type(value))
+                    if isinstance(value, datetime.datetime):
+                        self.assertEqual(store.get('a').utcoffset(), value.utcoffset())
+                store.update({'b': pd.Timestamp('2020-01-01'), 'c': pd.Series([3]).max(),
+                              'd': pd.Timestamp('2020-01-01 02:00', tz='Europe/Paris')})
+                self.assertEqual(store.get('a'), VALUES[-1])
+                self.assertEqual(store.get('b'), datetime.datetime(2020, 1, 1))
+                self.assertEqual(store.get('c'), 3)
+                self.assertEqual(store.get('d'), datetime.datetime(2020, 1, 1, 1, tzinfo=datetime.timezone.utc))
+                self.assertEqual(store.get('d').utcoffset(), datetime.timedelta(hours=1))
+        with self.assertRaises(TypeError):
+            watermarks.dump_value(object())
+
+    def test_sql_store_creates_table_once(self):
+        store = SQLWatermarkStore(config=types.SimpleNamespace(ODBC_CONNECT_URL=self.url))
+        with mock.patch('sqlalchemy.Table.create') as create:
+            table, _ = store._table()
+            self.assertIs(store._table()[0], table)
+        create.assert_called_once()
+
+    def test_default_store(self):
+        with mock.patch('bigrays.watermarks.BigRaysConfig', types.SimpleNamespace(WATERMARK_FILE=None)):
+            with self.assertRaisesRegex(ConfigurationError, 'WATERMARK_FILE'):
+                watermarks.default_store()
+        path = os.path.join(self.tmpdir.name, 'watermarks.json')
+        with mock.patch('bigrays.watermarks.BigRaysConfig', types.SimpleNamespace(WATERMARK_FILE=path)):
+            self.assertIs(watermarks.default_store(), watermarks.default_store())
+            self.assertEqual(watermarks.default_store().path, path)
+
+class TestCommitPending(unittest.TestCase):
+    def setUp(self):
+        self.store = mock.Mock()
+        self.tasks = []
+        patcher = mock.patch('bigrays.tasks.TASK_REGISTER', self.tasks)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_commit_pending(self):
+        store = self.store
+        class A(tasks.Task):
+            watermark_store = store
+        class B(tasks.Task):
+            input = A.output
+        class C(tasks.Task):
+            watermark_store = store
+            watermark_name = 'c'
+        class D(tasks.Task):
+            input = C.output
+        class E(tasks.Task):
+            input = D.output
+        watermarks.set_pending(A, 1)
+        watermarks.set_pending(C, 2)
+        # E, depending on C indirectly, failed
+        committed = watermarks.commit_pending([A, B, C, D, E], {A, B, C, D})
+        self.assertEqual(committed, [A])
+        store.update.assert_called_once_with({A.__module__ + '.' + A.__qualname__: 1})
+        # pending watermarks are discarded either way
+        self.assertEqual(watermarks.commit_pending([A, B, C, D, E], {A, B, C, D, E}), [])
+        watermarks.set_pending(A, 3)
+        watermarks.set_pending(C, 4)
+        watermarks.commit_pending([A, B, C, D, E], {A, B, C, D, E})
+        store.update.assert_called_with({A.__module__ + '.' + A.__qualname__: 3, 'c': 4})
+
+    @mock.patch('bigrays.run.BigRaysConfig', None)
+    @mock.patch.object(SQLSession, '_engine_users', 0)
+    @mock.patch('bigrays.run.BigRays._report_metrics')
+    def test_store_error(self, report_metrics):
+        store = self.store
+        store.update.side_effect = Exception('store error')
+        fail = []
+        class A(tasks.Task):
+            watermark_store = store
+            def run(self):
+                watermarks.set_pending(A, 1)
+        class B(tasks.Task):
+            def run(self):
+                if fail:
+                    raise Exception('testing error')
+        with self.assertRaisesRegex(Exception, 'store error'):
+            BigRays.run(A, B)
+        self.assertEqual(SQLSession._engine_users, 0)
+        report_metrics.assert_called_once()
+        # the error of the run is raised rather than the store's
+        fail.append(True)
+        with self.assertRaises(TaskErrors):
+            BigRays.run(A, B)
+        self.assertEqual(store.update.call_count, 2)
+        self.assertEqual(SQLSession._engine_users, 0)
+        self.assertEqual(report_metrics.call_count, 2)
+
+
+class TestSQLIncrementalQuery(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        url = 'sqlite:///' + os.path.join(self.tmpdir.name, 'test.db')
+        self.engine = sa.create_engine(url)
+        config = types.SimpleNamespace(ODBC_CONNECT_URL=url)
+        for patcher in [mock.patch('bigrays.run.BigRaysConfig', config),
+                        mock.patch.object(SQLSession, 'required_configs', ()),
+                        mock.patch('bigrays.tasks.TASK_REGISTER', [])]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.store = FileWatermarkStore(os.path.join(self.tmpdir.name, 'watermarks.json'))
+
+    def tearDown(self):
+        SQLSession.dispose_engines()
+        self.engine.dispose()
+        self.tmpdir.cleanup()
+
+    def insert(self, ids):
+        pd.DataFrame({'id': ids, 'day': ['2020-01-%02d' % i for i in ids]}).to_sql(
+            'events', self.engine, index=False, if_exists='append')
+
+    def test_run(self):
+        store = self.store
+        loaded, fail = [], []
+        class Events(tasks.SQLIncrementalQuery):
+            query = 'select * from events where id > {watermark} and day >= {day}'
+            format_kws = {'day': "'2020-01-01'"}
+            watermark_column = 'id'
+            initial_watermark = 0
+            watermark_store = store
+        class Load(tasks.Task):
+            input = Events.output
+            def run(self):
+                if fail:
+                    raise Exception('testing error')
+                loaded.append(self.input['id'].tolist())
+
+        self.insert([1, 2, 3])
+        BigRays.run(Events, Load)
+        self.assertEqual(store.get(watermarks.name_of(Events)), 3)
+        self.insert([4, 5])
+        fail.append(True)
+        with self.assertRaises(TaskErrors):
+            BigRays.run(Events, Load)
+        # not advanced, the rows are read again
+        self.assertEqual(store.get(watermarks.name_of(Events)), 3)
+        fail.clear()
+        BigRays.run(Events, Load)
+        # nothing new
+        BigRays.run(Events, Load)
+        self.assertEqual(loaded, [[1, 2, 3], [4, 5], []])
+        self.assertEqual(store.get(watermarks.name_of(Events)), 5)
+
+    def test_resume(self):
+        store = self.store
+        loaded, fail = [], [True]
+        class Events(tasks.SQLIncrementalQuery):
+            query = 'select * from events where id > {watermark}'
+            watermark_column = 'id'
+            initial_watermark = 0
+            watermark_store = store
+        class Load(tasks.Task):
+            input = Events.output
+            def run(self):
+                if fail:
+                    raise Exception('testing error')
+                loaded.append(self.input['id'].tolist())
+
+        self.insert([1, 2, 3])
+        checkpoint_dir = os.path.join(self.tmpdir.name, 'checkpoint')
+        with self.assertRaises(TaskErrors):
+            BigRays.run(Events, Load, checkpoint_dir=checkpoint_dir)
+        self.assertIsNone(store.get(watermarks.name_of(Events)))
+        fail.clear()
+        # Events' output is restored, its watermark is committed
+        BigRays.resume(checkpoint_dir, Events, Load)
+        self.assertEqual(store.get(watermarks.name_of(Events)), 3)
+        BigRays.run(Events, Load)
+        self.assertEqual(loaded, [[1, 2, 3], []])
+
+    def test_chunks(self):
+        store = self.store
+        class Events(tasks.SQLIncrementalQuery):
+            query = 'select * from events where day > {watermark}'
+            watermark_column = 'day'
+            initial_watermark = datetime.date(2020, 1, 1)
+            watermark_store = store
+            chunksize = 2
+        class Load(tasks.Task):
+            input = Events.output
+            def run(self):
+                return pd.concat(self.input)
+
+        self.insert([1, 2, 3, 4, 5])
+        BigRays.run(Events, Load)
+        self.assertEqual(Load.output['id'].tolist(), [2, 3, 4, 5])
+        self.assertEqual(store.get(watermarks.name_of(Events)), '2020-01-05')
+
+    def test_bind_watermark(self):
+        class Events(tasks.SQLIncrementalQuery):
+            query = "select * from events where day > {watermark} and day != '10\\:00'"
+            watermark_column = 'day'
+            initial_watermark = pd.Timestamp('2020-01-02 03:04:05.123456')
+            watermark_store = self.store
+        query = Events().bind_watermark(Events.query.format(**Events().reformat_keywords()))
+        self.assertEqual(query.compile().params,
+                         {'bigrays_watermark': datetime.datetime(2020, 1, 2, 3, 4, 5, 123456)})
+        self.assertIn("'10:00'", str(query))
+        # queries not using the watermark are left as is
+        self.assertEqual(Events().bind_watermark('select 1'), 'select 1')
+
+    def test_no_initial_watermark(self):
+        class Events(tasks.SQLIncrementalQuery):
+            query = 'select * from events where id > {watermark}'
+            watermark_column = 'id'
+            watermark_store = self.store
+        with self.assertRaisesRegex(ValueError, 'initial_watermark'):
+            Events().current_watermark()
+
+
+if __name__ == '__main__':
+    unittest.main()